@@ -0,0 +1,76 @@
+import argparse
+import time
+
+import pandas as pd
+
+from src.utils import http_client
+from src.utils.response_cache import ResponseCache
+from collect_data import SCRAPERS
+from websites import parsing
+
+
+class CountingClient:
+    """Wraps a client and counts the pages it serves."""
+
+    def __init__(self, client):
+        self.client = client
+        self.pages = 0
+
+    def get(self, url, **kwargs):
+        self.pages += 1
+        return self.client.get(url, **kwargs)
+
+
+def benchmark(data_file, cache_dir, data_type="description", backends=None, max_books=None):
+    """
+    Scrape every book of data_file from a recorded response cache with each parser backend and report the number
+    of parsed pages per second for each website.
+    """
+
+    data = pd.read_csv(data_file, sep="\t", index_col=False)
+    if max_books is not None:
+        data = data.head(max_books)
+
+    cache = ResponseCache(cache_dir, replay=True)
+    results = []
+
+    for backend in backends or parsing.BACKENDS:
+        try:
+            parsing.set_backend(backend)
+        except ValueError as e:
+            print(e)
+            continue
+
+        for website, rows in data.groupby(data["Url"].str.extract(r"www\.(\w+)\.com", expand=False)):
+            client = CountingClient(http_client.HttpClient(requests_per_second=None, cache=cache))
+            http_client.set_client(client)
+
+            elapsed = 0.0
+            for _, row in rows.iterrows():
+                start = time.perf_counter()
+                try:
+                    SCRAPERS[website](row["BookId"], row["Title"], row["Author"], row["Url"], data_type)
+                except Exception as e:
+                    print(f"Failed {row['Url']}: {e}")
+                elapsed += time.perf_counter() - start
+
+            results.append({"backend": backend, "website": website, "pages": client.pages, "seconds": elapsed,
+                            "pages/sec": client.pages / elapsed if elapsed else 0.0})
+
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the HTML parser backends on a recorded response cache.")
+    parser.add_argument("--data_file", required=True, help="Path to the input TSV file containing book data.")
+    parser.add_argument("--cache_dir", required=True, help="Directory of the recorded response cache.")
+    parser.add_argument("--data_type", choices=["description", "analysis"], default="description",
+                        help="Type of data to scrape.")
+    parser.add_argument("--backends", nargs="+", choices=parsing.BACKENDS, default=None,
+                        help="Parser backends to compare.")
+    parser.add_argument("--max_books", type=int, default=None, help="Only use the first books of data_file.")
+    args = parser.parse_args()
+
+    report = benchmark(args.data_file, args.cache_dir, args.data_type, args.backends, args.max_books)
+    print(report.to_string(index=False))
@@ -1,25 +1,211 @@
 import argparse
+import hashlib
+import json
 import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
 from gutenbergpy import textget
 
+from src.utils.book_store import BookStore
+
+
+BOOK_FILES = ["book.txt", "book_cleaned.txt"]
+
+
+def file_digest(path, content):
+    return {"size": len(content), "mtime": os.stat(path).st_mtime_ns, "sha256": hashlib.sha256(content).hexdigest()}
+
+
+def write_atomic(path, content):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Manifest:
+    """
+    Size, mtime and sha256 of every downloaded book file, stored in save_path/manifest.json. A book is only
+    downloaded again if one of its files is missing or does not match the manifest. Files whose size and mtime are
+    unchanged are not hashed again.
+    """
+
+    def __init__(self, save_path):
+        self.path = os.path.join(save_path, "manifest.json")
+        self.lock = threading.Lock()
+        self.books = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.books = json.load(f)
+
+    def is_valid(self, book_dir, book_id):
+        entry = self.books.get(str(book_id))
+        if entry is None:
+            return False
+
+        rehashed = False
+        for name in BOOK_FILES:
+            path = os.path.join(book_dir, name)
+            if name not in entry or not os.path.exists(path):
+                return False
+            stat = os.stat(path)
+            if stat.st_size != entry[name]["size"]:
+                return False
+            if stat.st_mtime_ns == entry[name].get("mtime"):
+                continue
+            with open(path, "rb") as f:
+                if hashlib.sha256(f.read()).hexdigest() != entry[name]["sha256"]:
+                    return False
+            with self.lock:
+                entry[name]["mtime"] = stat.st_mtime_ns
+            rehashed = True
+
+        if rehashed:
+            # the file was touched but not changed, it is not hashed again on the next run
+            self.save()
+        return True
+
+    def add(self, book_id, book_dir, files):
+        with self.lock:
+            self.books[str(book_id)] = {name: file_digest(os.path.join(book_dir, name), content)
+                                        for name, content in files.items()}
+        self.save()
+
+    def save(self):
+        with self.lock:
+            write_atomic(self.path, json.dumps(self.books, indent=1).encode())
+
+
+def mirror_candidates(mirror_dir, book_id):
+    """
+    Possible paths of a book in a local Gutenberg mirror, both for the generated cache layout
+    (cache/epub/{id}/pg{id}.txt) and for the classic rsync layout (1/2/3/123/123-0.txt).
+    """
+
+    book_id = str(book_id)
+    candidates = [os.path.join(mirror_dir, *parts, book_id, f"pg{book_id}.txt")
+                  for parts in [["cache", "epub"], ["epub"], []]]
+
+    classic_dir = os.path.join(mirror_dir, *book_id[:-1], book_id) if len(book_id) > 1 else \
+        os.path.join(mirror_dir, "0", book_id)
+    for suffix in ["-0", "-8", ""]:
+        candidates.append(os.path.join(classic_dir, f"{book_id}{suffix}.txt"))
+        candidates.append(os.path.join(classic_dir, f"{book_id}{suffix}.zip"))
+
+    return candidates
 
-def get_books(data_file, save_path):
-    data = pd.read_csv(data_file, sep="\t")
 
-    for i, row in data.iterrows():
-        raw_book = textget.get_text_by_id(row["Id"])
-        clean_book = textget.strip_headers(raw_book)
+def read_from_mirror(mirror_dir, book_id):
+    for path in mirror_candidates(mirror_dir, book_id):
+        if not os.path.exists(path):
+            continue
+        if path.endswith(".zip"):
+            with zipfile.ZipFile(path) as archive:
+                names = [name for name in archive.namelist() if name.endswith(".txt")]
+                if names:
+                    return archive.read(names[0])
+        else:
+            with open(path, "rb") as f:
+                return f.read()
+    return None
 
-        if not os.path.exists(os.path.join(save_path, str(row["Id"]))):
-            os.makedirs(os.path.join(save_path, str(row["Id"])))
 
-        with open(os.path.join(save_path, str(row["Id"]), "book.txt"), 'wb') as raw_file:
-            raw_file.write(raw_book)
+def adopt_existing(manifest, book_dir, book_id):
+    """
+    Add the files of a book downloaded before the manifest existed, if its cleaned text matches its raw text.
+    """
+
+    paths = [os.path.join(book_dir, name) for name in BOOK_FILES]
+    if not all(os.path.exists(path) for path in paths):
+        return False
+
+    contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    raw_book, clean_book = contents
+    if not raw_book or textget.strip_headers(raw_book) != clean_book:
+        return False
+
+    manifest.add(book_id, book_dir, dict(zip(BOOK_FILES, contents)))
+    return True
+
+
+def add_to_store(store, book_dir, book_id):
+    if store is None or str(book_id) in store:
+        return
+    with open(os.path.join(book_dir, "book_cleaned.txt"), "rb") as f:
+        store.add(book_id, f.read().decode("utf-8", errors="replace"))
+
+
+def get_book(book_id, save_path, manifest, mirror_dir=None, store=None):
+    """
+    Download a book unless valid files of it are already in save_path. With mirror_dir, the text is read from a
+    local Gutenberg mirror and only downloaded if the mirror does not have it. With store, a
+    utils.book_store.BookStore, the cleaned text is only added to the store and no files are written; books already
+    downloaded to save_path are added to the store without downloading them again. Returns the source of the book.
+    """
+
+    if store is not None and str(book_id) in store:
+        return "existing"
+
+    book_dir = os.path.join(save_path, str(book_id))
+    if manifest.is_valid(book_dir, book_id) or \
+            (str(book_id) not in manifest.books and adopt_existing(manifest, book_dir, book_id)):
+        add_to_store(store, book_dir, book_id)
+        return "existing"
+
+    raw_book, source = None, "gutenberg"
+    if mirror_dir is not None:
+        raw_book, source = read_from_mirror(mirror_dir, book_id), "mirror"
+    if raw_book is None:
+        raw_book, source = textget.get_text_by_id(book_id), "gutenberg"
+    clean_book = textget.strip_headers(raw_book)
+
+    if store is not None:
+        store.add(book_id, clean_book.decode("utf-8", errors="replace"))
+        return source
+
+    if not os.path.exists(book_dir):
+        os.makedirs(book_dir)
+
+    files = {"book.txt": raw_book, "book_cleaned.txt": clean_book}
+    for name, content in files.items():
+        write_atomic(os.path.join(book_dir, name), content)
+    manifest.add(book_id, book_dir, files)
+
+    return source
+
+
+def get_books(data_file, save_path, num_workers=4, mirror_dir=None, store_dir=None):
+    """
+    Download the books of data_file with num_workers threads. Books whose files match the manifest are skipped,
+    so an interrupted or repeated run only fetches the missing books.
+    """
+
+    data = pd.read_csv(data_file, sep="\t")
+    os.makedirs(save_path, exist_ok=True)
+    manifest = Manifest(save_path)
+    store = BookStore(store_dir) if store_dir is not None else None
+
+    counts = {}
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(get_book, book_id, save_path, manifest, mirror_dir, store): book_id
+                   for book_id in data["Id"].drop_duplicates()}
+        for future in as_completed(futures):
+            try:
+                source = future.result()
+            except Exception as e:
+                print(f"Failed to get book {futures[future]}: {e}")
+                source = "failed"
+            counts[source] = counts.get(source, 0) + 1
 
-        with open(os.path.join(save_path, str(row["Id"]), "book_cleaned.txt"), 'wb') as clean_file:
-            clean_file.write(clean_book)
+    print(", ".join(f"{count} {source}" for source, count in counts.items()))
 
 
 if __name__ == "__main__":
@@ -27,9 +213,18 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download Gutenberg Books")
     parser.add_argument("--data_file", help="Path to the input TSV file containing book data.")
     parser.add_argument("--save_path", help="Directory where downloaded books will be saved.")
+    parser.add_argument("--num_workers", type=int, default=4, help="Number of books downloaded concurrently.")
+    parser.add_argument("--mirror_dir", default=None,
+                        help="Local Gutenberg mirror (or rsync dump) to read the books from instead of the network.")
+    parser.add_argument("--store_dir", default=None,
+                        help="Add the cleaned books to a compressed book store (see utils/book_store.py) instead of "
+                             "writing text files.")
     args = parser.parse_args()
 
     get_books(
         args.data_file,
         args.save_path,
+        num_workers=args.num_workers,
+        mirror_dir=args.mirror_dir,
+        store_dir=args.store_dir
     )
@@ -0,0 +1,187 @@
+import argparse
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import pandas as pd
+
+from src.utils import http_client, journal, wayback
+from websites import litcharts, sparknotes, cliffsnotes, shmoop, gradesaver
+
+
+CATALOG_SCRAPERS = {
+    'litcharts': litcharts.scrape,
+    'sparknotes': sparknotes.scrape,
+    'cliffsnotes': cliffsnotes.scrape,
+    'shmoop': shmoop.scrape,
+    'gradesaver': gradesaver.scrape,
+}
+
+CATALOG_COLUMNS = ["Title", "Author", "Url"]
+
+
+def guide_key(url):
+    """
+    Study guide prefix of a live or (relative) Wayback url (see wayback.url_prefix), so that the landing url of a
+    guide in a catalogue matches the page urls of the data files, e.g. the /play-summary pages of CliffsNotes.
+    """
+
+    if url.startswith("/web/"):
+        url = urljoin("https://web.archive.org", url)
+    return wayback.url_prefix(wayback.split_wayback_url(url)[1])
+
+
+def crawl_site(website):
+    titles, authors, urls = CATALOG_SCRAPERS[website]()
+    return pd.DataFrame({"Title": titles, "Author": authors, "Url": urls}, columns=CATALOG_COLUMNS)
+
+
+def crawl(websites, num_workers=None):
+    """
+    Crawl the study guide catalogues of the websites concurrently. The index pages of a single website (e.g. the
+    letters of GradeSaver) are fetched by the page workers. Returns {website: catalogue} for the websites that
+    were crawled successfully.
+    """
+
+    catalogs = {}
+    with ThreadPoolExecutor(max_workers=num_workers or len(websites)) as executor:
+        futures = {website: executor.submit(crawl_site, website) for website in websites}
+        for website, future in futures.items():
+            try:
+                catalogs[website] = future.result()
+                print(f"{website}: {len(catalogs[website])} study guides")
+            except Exception as e:
+                print(f"Failed to crawl the catalogue of {website}: {e}")
+
+    return catalogs
+
+
+def save_catalog(catalog, catalog_dir, website):
+    os.makedirs(catalog_dir, exist_ok=True)
+    path = os.path.join(catalog_dir, f"{website}.tsv")
+    catalog.to_csv(path + ".tmp", sep="\t", index=False)
+    os.replace(path + ".tmp", path)
+
+
+def load_scraped(save_paths):
+    """
+    {guide key: (title, author)} of the study guides already scraped to the save paths of
+    collect_data.py: the books done in save_path/journal.sqlite, with the authors of the *_written.tsv files. The
+    author is None for a book that is only in the journal.
+    """
+
+    scraped = {}
+    for save_path in save_paths:
+        for written_file in sorted(glob.glob(os.path.join(save_path, "*_written.tsv"))):
+            written = pd.read_csv(written_file, sep="\t", dtype="string", keep_default_na=False, index_col=False)
+            for _, row in written.iterrows():
+                scraped[guide_key(row["Url"])] = (row["Title"], row["Author"])
+
+        journal_path = os.path.join(save_path, "journal.sqlite")
+        if not os.path.exists(journal_path):
+            continue
+        scrape_journal = journal.Journal(journal_path)
+        for url, title in scrape_journal.done_books():
+            scraped.setdefault(guide_key(url), (title, None))
+        scrape_journal.close()
+
+    return scraped
+
+
+def load_known(data_files):
+    """
+    {guide key: (title, author)} of the study guides in the data files (e.g. data/description_data.tsv).
+    """
+
+    known = {}
+    for data_file in data_files:
+        if not os.path.exists(data_file):
+            continue
+        data = pd.read_csv(data_file, sep="\t", dtype="string", keep_default_na=False, index_col=False)
+        for _, row in data.iterrows():
+            known[guide_key(row["Url"])] = (row["Title"], row["Author"])
+    return known
+
+
+def diff_catalog(catalog, scraped, known=None):
+    """
+    Return the study guides of catalog that were not scraped yet (see load_scraped) and are not in the data files
+    (see load_known) ("new"), or that were scraped or are in the data files under another title or author
+    ("changed").
+    """
+
+    known = known or {}
+    catalog = catalog.drop_duplicates(subset=["Url"]).copy()
+    catalog["Key"] = catalog["Url"].apply(guide_key)
+
+    statuses = []
+    for _, row in catalog.iterrows():
+        if row["Key"] in scraped or row["Key"] in known:
+            title, author = scraped[row["Key"]] if row["Key"] in scraped else known[row["Key"]]
+            if author is None:
+                author = known.get(row["Key"], (None, None))[1]
+            changed = title != row["Title"] or (author is not None and author != row["Author"])
+            statuses.append("changed" if changed else None)
+        else:
+            statuses.append("new")
+
+    catalog["Status"] = statuses
+    return catalog[catalog["Status"].notna()].drop(columns=["Key"])
+
+
+def update_catalogs(websites, catalog_dir, save_paths, data_files=(), output_file=None, num_workers=None):
+    """
+    Crawl the catalogues, store them as catalog_dir/{website}.tsv and report the study guides that are new or
+    changed compared to the guides already scraped to save_paths (e.g. data/corpus) and the existing data files
+    (e.g. data/description_data.tsv).
+    """
+
+    scraped = load_scraped(save_paths)
+    known = load_known(data_files)
+
+    updates = []
+    for website, catalog in crawl(websites, num_workers).items():
+        site_updates = diff_catalog(catalog, scraped, known)
+        site_updates.insert(0, "Website", website)
+        updates.append(site_updates)
+        save_catalog(catalog, catalog_dir, website)
+        print(f"{website}: {(site_updates['Status'] == 'new').sum()} new, "
+              f"{(site_updates['Status'] == 'changed').sum()} changed")
+
+    updates = pd.concat(updates, ignore_index=True) if updates else pd.DataFrame(
+        columns=["Website"] + CATALOG_COLUMNS + ["Status"])
+    if output_file is not None:
+        updates.to_csv(output_file, sep="\t", index=False)
+
+    return updates
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Crawl the study guide catalogues and report new or changed guides.")
+    parser.add_argument("--websites", nargs="+", choices=list(CATALOG_SCRAPERS), default=list(CATALOG_SCRAPERS),
+                        help="Websites whose catalogues are crawled.")
+    parser.add_argument("--catalog_dir", default="../../data/catalog",
+                        help="Directory where the catalogues are stored.")
+    parser.add_argument("--save_paths", nargs="+", default=["../../data/corpus"],
+                        help="Save paths of collect_data.py whose scraped study guides are compared.")
+    parser.add_argument("--data_files", nargs="+",
+                        default=["../../data/description_data.tsv", "../../data/analysis_data.tsv"],
+                        help="Data files of the study guides that are already known.")
+    parser.add_argument("--output_file", default=None, help="TSV file of the new and changed study guides.")
+    parser.add_argument("--page_workers", type=int, default=8,
+                        help="Number of index pages of a website fetched concurrently.")
+    parser.add_argument("--max_concurrency", type=int, default=8,
+                        help="Maximum number of in-flight requests across all websites.")
+    parser.add_argument("--requests_per_second", type=float, default=4.0, help="Maximum request rate per host.")
+    args = parser.parse_args()
+
+    http_client.configure(
+        page_workers=args.page_workers,
+        max_concurrency=args.max_concurrency,
+        requests_per_second=args.requests_per_second
+    )
+
+    updates = update_catalogs(args.websites, args.catalog_dir, args.save_paths, args.data_files, args.output_file)
+    print(updates.to_string(index=False))
@@ -1,43 +1,125 @@
 import argparse
-import json
 import os
+import queue
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
 
-from websites import litcharts, sparknotes, cliffsnotes, shmoop, gradesaver
+from src.utils import http_client, journal, jsonl_store, pipeline, wayback
+from src.utils.response_cache import ResponseCache, CacheMissError
+from websites import litcharts, sparknotes, cliffsnotes, shmoop, gradesaver, parsing
 
 
-def get_data_from_website(book_id, title, author, website, url, data_type, max_attempts=3, exp_base=3):
+SCRAPERS = {
+    'litcharts': litcharts.get_data,
+    'sparknotes': sparknotes.get_data,
+    'cliffsnotes': cliffsnotes.get_data,
+    'shmoop': shmoop.get_data,
+    'gradesaver': gradesaver.get_data,
+}
+
+SUPPORTED_DATA_TYPES = {
+    'litcharts': ["description", "summary"],
+    'sparknotes': ["description", "analysis", "summary"],
+    'cliffsnotes': ["description", "analysis", "summary"],
+    'shmoop': ["analysis", "summary"],
+    'gradesaver': ["description", "summary"],
+}
+
+SOURCES = {
+    'litcharts': "LitCharts",
+    'sparknotes': "SparkNotes",
+    'cliffsnotes': "Cliffnotes",
+    'shmoop': "Shmoop",
+    'gradesaver': "GradeSaver",
+}
+
+DATA_TYPES = ["description", "analysis", "summary"]
+
+
+def get_data_from_website(book_id, title, author, website, url, data_types, max_attempts=3, exp_base=3):
+    """
+    Scrape all the requested data types of a book in a single crawl, so that a page needed by several data types
+    (e.g. the characters page) is only fetched once. Returns ({data_type: records}, None), or (None, error) on
+    failure, where error is the repr of the exception of the last attempt, if any.
+    """
+
+    scraper_func = SCRAPERS.get(website)
+    data_types = [t for t in data_types if t in SUPPORTED_DATA_TYPES[website]]
+
+    # pages fetched successfully are kept across attempts
+    graph = http_client.PageGraph()
     current_attempt = 0
+    error = None
     while current_attempt <= max_attempts:
         try:
-            scraper_func = {
-                'litcharts': litcharts.get_data,
-                'sparknotes': sparknotes.get_data,
-                'cliffsnotes': cliffsnotes.get_data,
-                'shmoop': shmoop.get_data,
-                'gradesaver': gradesaver.get_data,
-            }.get(website)
-            return scraper_func(book_id, title, author, url, data_type)
+            scraped_data = {}
+            with http_client.page_scope(graph):
+                for data_type in data_types:
+                    with journal.scope(url, data_type):
+                        scraped = journal.checkpoint(url, scraper_func, book_id, title, author, url, data_type)
+
+                    if data_type == "summary":
+                        scraped = [{"id": book_id, "book": title, "author": author, "summary": scraped,
+                                    "source": SOURCES[website], "url": url}] if scraped else []
+                    elif scraped is None:
+                        return None, None
+
+                    scraped_data[data_type] = scraped
+
+            return scraped_data, None
+
+        except CacheMissError as e:
+            # retrying cannot help when replaying from the cache
+            print(e)
+            return None, repr(e)
 
         except Exception as e:
             current_attempt += 1
+            error = repr(e)
+            print(f"Attempt {current_attempt} of {max_attempts + 1} failed for {url}: {error}")
             time.sleep(exp_base ** current_attempt)
 
             continue
 
-    return None
+    return None, error
+
+
+def scrape_row(i, row, data_types, max_attempts=3, exp_base=3):
+    website = re.search(r"www\.(\w+)\.com", row["Url"]).group(1)
+
+    print(f"{i} Scraping data from: ", row["Url"], row["Title"])
 
+    return get_data_from_website(row["BookId"], row["Title"], row["Author"], website, row["Url"],
+                                 data_types, max_attempts, exp_base)
 
-def create_data(data_file, save_path, data_type="description", max_attempts=3, exp_base=3):
+
+def create_data(data_file, save_path, data_type="description", max_attempts=3, exp_base=3, num_workers=1,
+                write_queue_size=64, metrics_interval=30, flush_records=100, flush_seconds=5.0, fsync=False,
+                shard_records=None, compression=None):
     """
-    Scrape and create a dataset from literary websites.
+    Scrape and create a dataset from literary websites. Scraping is a staged pipeline: num_workers threads fetch
+    the pages of different books, the pages are parsed in the parser pool (see websites.parsing.configure_pool) and
+    a single writer thread appends the results of each finished book. Each stage is bounded, and its queue depth is
+    printed every metrics_interval seconds. data_type can also be a list of data types, which are then scraped
+    together in one crawl per book and written to their respective files.
+
+    Progress is kept in a journal (save_path/journal.sqlite), so a rerun skips finished books and resumes unfinished
+    ones at the first character page that was not scraped yet.
+
+    Records are written in batches of flush_records or every flush_seconds (see utils.jsonl_store.JsonlWriter),
+    optionally rotated into shards of shard_records records and zstd compressed. A book is only marked as done
+    once all its records are flushed.
     """
 
-    if data_type not in ["description", "analysis"]:
-        raise ValueError("data_type must be either 'description' or 'analysis'")
+    data_types = [data_type] if isinstance(data_type, str) else list(data_type)
+    if not data_types or any(t not in DATA_TYPES for t in data_types):
+        raise ValueError(f"data_type must be one or more of {DATA_TYPES}")
+
+    written_name = "-".join(data_types)
 
     dtype_dict = {
         'BookId': 'int64',
@@ -47,60 +129,221 @@ def create_data(data_file, save_path, data_type="description", max_attempts=3, e
     }
 
     data = pd.read_csv(data_file, sep="\t", dtype=dtype_dict, index_col=False)
+    data = data.drop_duplicates(subset=["BookId", "Url"])
+
+    writers = {}
+    for t in data_types:
+        if not os.path.exists(os.path.join(save_path, t)):
+            os.makedirs(os.path.join(save_path, t))
+        writers[t] = jsonl_store.JsonlWriter(os.path.join(save_path, f"{t}/{t}_data.jsonl"),
+                                             flush_records=flush_records, flush_seconds=flush_seconds, fsync=fsync,
+                                             shard_records=shard_records, compression=compression)
 
-    if not os.path.exists(os.path.join(save_path, data_type)):
-        os.makedirs(os.path.join(save_path, data_type))
+    scrape_journal = journal.Journal(os.path.join(save_path, "journal.sqlite"))
+    journal.set_journal(scrape_journal)
 
-    f_data = open(os.path.join(save_path, f"{data_type}/{data_type}_data.jsonl"), "a")
-    f_written = open(os.path.join(save_path, f"{data_type}_written.tsv"), "a+")
+    f_written = open(os.path.join(save_path, f"{written_name}_written.tsv"), "a+")
 
-    if not os.stat(os.path.join(save_path, f"{data_type}_written.tsv")).st_size:
+    if not os.stat(os.path.join(save_path, f"{written_name}_written.tsv")).st_size:
         f_written.write("\t".join(["BookId", "Title", "Author", "Url"]) + "\n")
     else:
-        data_written = pd.read_csv(os.path.join(save_path, f"{data_type}_written.tsv"), sep="\t", dtype=dtype_dict)
+        # books written before the journal existed
+        data_written = pd.read_csv(os.path.join(save_path, f"{written_name}_written.tsv"), sep="\t",
+                                   dtype=dtype_dict)
+        for t in data_types:
+            statuses = scrape_journal.book_statuses(t)
+            for _, row in data_written.iterrows():
+                if statuses.get(row["Url"]) != "done":
+                    scrape_journal.set_book_status(row["BookId"], row["Title"], row["Url"], t, "done")
 
-        data = pd.concat([data, data_written])
-        data = data.drop_duplicates(keep=False)
+    statuses = {t: scrape_journal.book_statuses(t) for t in data_types}
+    data = data[~data["Url"].apply(lambda url: all(statuses[t].get(url) == "done" for t in data_types))]
 
     failed_data = []
-    for i, row in data.iterrows():
+    write_queue = pipeline.MeteredQueue("write", maxsize=write_queue_size)
 
-        website = re.search(r"www\.(\w+)\.com", row["Url"]).group(1)
+    def scrape_and_queue(i, row):
+        write_queue.put((row, *scrape_row(i, row, data_types, max_attempts, exp_base)))
 
-        print(f"{i} Scraping data from: ", row["Url"], row["Title"])
+    def mark_written(row):
+        pending = set(data_types)
 
-        scraped_data = get_data_from_website(row["BookId"], row["Title"], row["Author"], website, row["Url"],
-                                             data_type, max_attempts, exp_base)
+        def callback(t):
+            # called by the writer of t once the records of the book are flushed
+            scrape_journal.set_book_status(row["BookId"], row["Title"], row["Url"], t, "done")
+            pending.discard(t)
+            if not pending:
+                f_written.write('\t'.join(map(str, row)) + '\n')
+                f_written.flush()
 
-        if scraped_data is not None:
-            for data_row in scraped_data:
-                f_data.write(json.dumps(data_row) + "\n")
-                f_data.flush()
-            f_written.write('\t'.join(map(str, row)) + '\n')
-            f_written.flush()
-        else:
-            print("Fail to scrape data from: ", row["Url"], row["Title"])
-            failed_data.append(row)
+        return callback
+
+    def write_results():
+        while True:
+            try:
+                item = write_queue.get(timeout=flush_seconds)
+            except queue.Empty:
+                for writer in writers.values():
+                    writer.flush_if_due()
+                continue
+
+            if item is None:
+                write_queue.task_done()
+                break
+
+            row, scraped_data, error = item
+            if scraped_data is not None:
+                callback = mark_written(row)
+                for t in data_types:
+                    writers[t].write_many(scraped_data.get(t, []), lambda t=t: callback(t))
+            else:
+                print("Fail to scrape data from: ", row["Url"], row["Title"], error or "")
+                for t in data_types:
+                    scrape_journal.set_book_status(row["BookId"], row["Title"], row["Url"], t, "failed", error)
+                failed_data.append(row)
+            write_queue.task_done()
+
+    writer_thread = threading.Thread(target=write_results)
+    writer_thread.start()
+    monitor = pipeline.Monitor([http_client.get_client().fetch_stage, parsing.parse_stage, write_queue],
+                               interval=metrics_interval)
+    monitor.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(scrape_and_queue, i, row) for i, row in data.iterrows()]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        write_queue.put(None)
+        writer_thread.join()
+        for writer in writers.values():
+            writer.close()
+        monitor.stop()
 
-    f_data.close()
     f_written.close()
+    scrape_journal.close()
+
+
+def print_status(save_path, data_file=None, data_type="description"):
+    """
+    Report the scraping progress and failures recorded in the journal.
+    """
+
+    data_types = [data_type] if isinstance(data_type, str) else list(data_type)
+    journal_path = os.path.join(save_path, "journal.sqlite")
+    if not os.path.exists(journal_path):
+        print(f"No journal found at {journal_path}")
+        return
+
+    scrape_journal = journal.Journal(journal_path)
+    books, pages = scrape_journal.summary()
+
+    print("Books:")
+    for t, status, count in books:
+        print(f"  {t:<12} {status:<8} {count}")
+    print("Pages:")
+    for t, status, count in pages:
+        print(f"  {t:<12} {status:<8} {count}")
+
+    if data_file is not None:
+        data = pd.read_csv(data_file, sep="\t", index_col=False).drop_duplicates(subset=["BookId", "Url"])
+        for t in data_types:
+            statuses = scrape_journal.book_statuses(t)
+            pending = sum(statuses.get(url) != "done" for url in data["Url"])
+            print(f"{t}: {len(data) - pending}/{len(data)} books done, {pending} pending")
+
+    failures = scrape_journal.failures()
+    if failures:
+        print("Failures:")
+        for kind, t, url, error in failures:
+            print(f"  {kind} {t} {url} {error or ''}")
+
+    scrape_journal.close()
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Scrape literary data from websites.")
+    parser.add_argument("--action", choices=["scrape", "status"], default="scrape",
+                        help="Scrape data or report the progress of previous runs.")
     parser.add_argument("--data_file", help="Path to the input TSV file containing book data.")
     parser.add_argument("--save_path", help="Directory where scraped data will be saved.")
-    parser.add_argument("--data_type", choices=["description", "analysis"], default="description",
-                        help="Type of data to scrape.")
+    parser.add_argument("--data_type", nargs="+", choices=DATA_TYPES, default=["description"],
+                        help="Types of data to scrape. Several types are scraped together in one crawl per book.")
     parser.add_argument("--max_attempts", type=int, default=3, help="Maximum number of attempts for scraping.")
     parser.add_argument("--exp_base", type=int, default=3, help="Base for exponential backoff.")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of books scraped concurrently.")
+    parser.add_argument("--page_workers", type=int, default=1,
+                        help="Number of character pages of a book fetched concurrently.")
+    parser.add_argument("--max_concurrency", type=int, default=8,
+                        help="Maximum number of in-flight requests across all workers.")
+    parser.add_argument("--requests_per_second", type=float, default=4.0,
+                        help="Maximum request rate per host (e.g. web.archive.org).")
+    parser.add_argument("--max_retries", type=int, default=4,
+                        help="Maximum number of retries of a single page before the whole book is retried.")
+    parser.add_argument("--cache_dir", default=None, help="Directory of the on-disk response cache.")
+    parser.add_argument("--replay", action="store_true",
+                        help="Only serve pages from --cache_dir and never access the network.")
+    parser.add_argument("--resolve_snapshots", action="store_true",
+                        help="Query the Wayback CDX index for all books before scraping starts.")
+    parser.add_argument("--cdx_endpoint", default=wayback.CDX_ENDPOINT, help="Url of the Wayback CDX server.")
+    parser.add_argument("--parser", choices=parsing.BACKENDS, default="html.parser", help="HTML parsing backend.")
+    parser.add_argument("--parse_workers", type=int, default=0,
+                        help="Number of processes parsing pages (0 parses in the fetching threads).")
+    parser.add_argument("--max_pending_pages", type=int, default=None,
+                        help="Maximum number of pages waiting to be parsed before fetchers block.")
+    parser.add_argument("--write_queue_size", type=int, default=64,
+                        help="Maximum number of scraped books waiting to be written.")
+    parser.add_argument("--metrics_interval", type=int, default=30,
+                        help="Seconds between two reports of the pipeline queue depths.")
+    parser.add_argument("--flush_records", type=int, default=100,
+                        help="Number of buffered records that triggers a write of the output files.")
+    parser.add_argument("--flush_seconds", type=float, default=5.0,
+                        help="Maximum number of seconds records stay buffered before they are written.")
+    parser.add_argument("--fsync", action="store_true", help="Fsync the output files after every write.")
+    parser.add_argument("--shard_records", type=int, default=None,
+                        help="Rotate the output into numbered shards of this many records.")
+    parser.add_argument("--compression", choices=["zstd"], default=None, help="Compress the output files.")
     args = parser.parse_args()
 
+    if args.action == "status":
+        print_status(args.save_path, args.data_file, args.data_type)
+        raise SystemExit
+
+    if args.replay and args.cache_dir is None:
+        parser.error("--cache_dir is required for --replay.")
+
+    parsing.set_backend(args.parser)
+    parsing.configure_pool(args.parse_workers, args.max_pending_pages)
+    http_client.configure(
+        page_workers=args.page_workers,
+        max_concurrency=args.max_concurrency,
+        requests_per_second=args.requests_per_second,
+        max_retries=args.max_retries,
+        cache=ResponseCache(args.cache_dir, replay=args.replay) if args.cache_dir else None
+    )
+
+    resolver = wayback.SnapshotResolver(
+        cache_dir=os.path.join(args.cache_dir, "cdx") if args.cache_dir else None,
+        cdx_endpoint=args.cdx_endpoint
+    )
+    wayback.set_resolver(resolver)
+    if args.resolve_snapshots:
+        wayback.resolve_tsv(args.data_file, resolver)
+
     create_data(
         args.data_file,
         args.save_path,
         data_type=args.data_type,
         max_attempts=args.max_attempts,
-        exp_base=args.exp_base
+        exp_base=args.exp_base,
+        num_workers=args.num_workers,
+        write_queue_size=args.write_queue_size,
+        metrics_interval=args.metrics_interval,
+        flush_records=args.flush_records,
+        flush_seconds=args.flush_seconds,
+        fsync=args.fsync,
+        shard_records=args.shard_records,
+        compression=args.compression
     )
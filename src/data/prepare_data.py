@@ -1,56 +1,454 @@
 import argparse
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+from itertools import islice, repeat
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from nltk.tokenize import word_tokenize
 
+from src.utils.arrow_store import FORMATS, iter_split, open_writer
+from src.utils.book_store import BookStore
+from src.utils.character_alignment import CharacterTable, align_characters, normalize_name, write_character_table
+from src.utils.jsonl_store import iter_jsonl
+from src.utils.mentions import read_mention_index, scan_mentions, write_mention_index
+from src.utils.minhash import MinHasher, find_clusters
+from src.utils.misc import truncate_paragraphs
 
-def filter_corpus(dataset_path, tokens_threshold, output_path, task="description"):
-    data = pd.read_json(dataset_path, lines=True)
 
-    data = data[data[task].apply(lambda x: len(word_tokenize(x)) > tokens_threshold)]
+def count_tokens(text):
+    return len(word_tokenize(text))
+
+
+class TokenCountCache:
+    """
+    Word token counts of texts, keyed by the sha256 of the text and appended to a TSV file, so that filtering the
+    same corpus with other thresholds does not tokenize it again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.counts = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) == 2:
+                        self.counts[parts[0]] = int(parts[1])
+        self.file = open(path, "a") if path is not None else None
+
+    def count(self, texts, executor=None):
+        digests = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        missing = {d: text for d, text in zip(digests, texts) if d not in self.counts}
+
+        if missing:
+            if executor is None:
+                counts = map(count_tokens, missing.values())
+            else:
+                counts = executor.map(count_tokens, missing.values(), chunksize=max(1, len(missing) // 64))
+            for d, count in zip(missing, counts):
+                self.counts[d] = count
+                if self.file is not None:
+                    self.file.write(f"{d}\t{count}\n")
+            if self.file is not None:
+                self.file.flush()
+
+        return [self.counts[d] for d in digests]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def filter_corpus(dataset_path, tokens_threshold, output_path, task="description", num_workers=1, chunk_size=1000,
+                  count_cache=None):
+    """
+    Keep the records whose task text has more than tokens_threshold word tokens. tokens_threshold can be a list,
+    in which case one file per threshold is written in a single pass. The dataset is streamed in chunks of
+    chunk_size records whose tokens are counted by num_workers processes, and the counts are cached in count_cache
+    (by default output_path/token_counts.tsv).
+    """
+
+    thresholds = [tokens_threshold] if isinstance(tokens_threshold, int) else list(tokens_threshold)
+    data_name = Path(dataset_path).stem
+    count_cache = TokenCountCache(count_cache or os.path.join(output_path, "token_counts.tsv"))
+    output_files = {t: os.path.join(output_path, data_name + f"-filtered-{t}.jsonl") for t in thresholds}
+    f_out = {t: open(path + ".tmp", "w") for t, path in output_files.items()}
+
+    executor = ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+    try:
+        records = iter_jsonl(dataset_path)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            counts = count_cache.count([record[task] for record in chunk], executor)
+            for record, count in zip(chunk, counts):
+                line = json.dumps(record) + "\n"
+                for t in thresholds:
+                    if count > t:
+                        f_out[t].write(line)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        count_cache.close()
+        for f in f_out.values():
+            f.close()
+
+    for path in output_files.values():
+        os.replace(path + ".tmp", path)
+
+
+SPLITS = ["train", "val", "test"]
+
+
+def load_split_map(split_path):
+    """
+    Map every BookId of the split files (split_path/{train,val,test}.tsv) to its split.
+    """
+
+    split_map = {}
+    for split in SPLITS:
+        for book_id in pd.read_csv(os.path.join(split_path, f"{split}.tsv"), sep="\t")["BookId"].unique():
+            if split_map.setdefault(int(book_id), split) != split:
+                raise ValueError(f"Book {book_id} is in both the {split_map[int(book_id)]} and {split} splits")
+
+    return split_map
+
+
+def hash_split(book_id, split_ratios=(0.8, 0.1, 0.1)):
+    """
+    Deterministically assign a book to a split from the hash of its id, so that new books always land in the
+    same split.
+    """
+
+    fraction = int(hashlib.sha256(str(book_id).encode()).hexdigest()[:8], 16) / 16 ** 8
+    cumulative = 0.0
+    for split, ratio in zip(SPLITS, split_ratios):
+        cumulative += ratio
+        if fraction < cumulative:
+            return split
+    return SPLITS[-1]
+
+
+def split_corpus(dataset_path, split_path, save_path, hash_unassigned=False, split_ratios=(0.8, 0.1, 0.1),
+                 data_format="jsonl"):
+    """
+    Route every record of the corpus to the split of its book in a single streaming pass. Records of books that
+    are in no split are reported, or assigned by hash_split if hash_unassigned is set. data_format is "jsonl",
+    "parquet" or "arrow".
+    """
+
+    split_map = load_split_map(split_path)
+    f_splits = {split: open_writer(os.path.join(save_path, split), data_format) for split in SPLITS}
+    counts = {split: 0 for split in SPLITS}
+    unassigned = {}
+
+    try:
+        for record in iter_jsonl(dataset_path):
+            book_id = int(record["id"])
+            split = split_map.get(book_id)
+            if split is None:
+                unassigned[book_id] = unassigned.get(book_id, 0) + 1
+                if not hash_unassigned:
+                    continue
+                split = hash_split(book_id, split_ratios)
+
+            f_splits[split].write(record)
+            counts[split] += 1
+    finally:
+        for f in f_splits.values():
+            f.close()
+
+    print(", ".join(f"{split}: {count}" for split, count in counts.items()))
+    if unassigned:
+        action = "assigned by hash" if hash_unassigned else "skipped"
+        print(f"{sum(unassigned.values())} records of {len(unassigned)} books in no split ({action}): "
+              f"{sorted(unassigned)}")
+
+    return counts, unassigned
+
+
+def build_full_book(dataset_path, store_dir, save_path, data_format="jsonl", character_table=None):
+    """
+    Build the full book dataset from the character splits in dataset_path (train, val and test in any of FORMATS),
+    written in data_format. Instead of embedding the book text in every character record, each record refers to its
+    book in the book store by book_id, which the loaders resolve with utils.book_store.BookTexts. With
+    character_table (see build_character_table), the canonical character_id of each record is added too.
+    """
+
+    store = BookStore(store_dir)
+    characters = CharacterTable(character_table) if character_table is not None else None
+    os.makedirs(save_path, exist_ok=True)
+    missing = set()
+
+    for split in SPLITS:
+        count = 0
+        writer = open_writer(os.path.join(save_path, split), data_format)
+        for record in iter_split(dataset_path, split):
+            if record["id"] not in store:
+                missing.add(record["id"])
+                continue
+            record = {k: v for k, v in record.items() if k != "input"}
+            record["book_id"] = record["id"]
+            if characters is not None:
+                record["character_id"] = characters.lookup(record["id"], record["character"])
+            writer.write(record)
+            count += 1
+        writer.close()
+        print(f"{split}: {count}")
+
+    if missing:
+        print(f"Skipped the records of {len(missing)} books that are not in the book store: {sorted(missing)}")
+
+
+def dedup_corpus(dataset_path, output_path, task="description", threshold=0.8, num_perm=128, ngram=5,
+                 split_path=None, deduplicate=False, num_workers=1, chunk_size=1000):
+    """
+    Find near-duplicate task texts (e.g. descriptions copied between sources) with MinHash signatures and LSH
+    buckets instead of comparing all pairs. The clusters are written to output_path/{name}-clusters.jsonl; with
+    split_path, clusters spanning several splits (leaks) are flagged. With deduplicate, only the first record of
+    every cluster is kept in output_path/{name}-dedup.jsonl.
+    """
+
+    hasher = MinHasher(num_perm=num_perm, ngram=ngram)
+    split_map = load_split_map(split_path) if split_path is not None else {}
     data_name = Path(dataset_path).stem
-    data.to_json(os.path.join(output_path, data_name + f"-filtered-{tokens_threshold}.jsonl"),
-                 orient='records', lines=True)
 
+    # only the signatures and a few fields per record are kept in memory
+    records, signatures = [], []
+    executor = ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+    try:
+        dataset = iter_jsonl(dataset_path)
+        while True:
+            chunk = list(islice(dataset, chunk_size))
+            if not chunk:
+                break
+            texts = [record[task] or "" for record in chunk]
+            if executor is None:
+                signatures.append(hasher.signatures(texts))
+            else:
+                step = max(1, len(texts) // num_workers)
+                parts = [texts[i:i + step] for i in range(0, len(texts), step)]
+                signatures.extend(executor.map(hasher.signatures, parts))
+            records.extend({k: record.get(k) for k in ["id", "book", "character", "source"]} for record in chunk)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    signatures = np.concatenate(signatures) if signatures else np.empty((0, num_perm), dtype=np.uint32)
+    clusters = find_clusters(signatures, threshold)
+
+    cross_split = 0
+    with open(os.path.join(output_path, f"{data_name}-clusters.jsonl"), "w") as f:
+        for k, members in enumerate(clusters):
+            cluster = {"cluster": k, "members": [{"index": i, **records[i]} for i in members]}
+            if split_map:
+                for member in cluster["members"]:
+                    member["split"] = split_map.get(int(member["id"]))
+                cluster["cross_split"] = len({member["split"] for member in cluster["members"]}) > 1
+                cross_split += cluster["cross_split"]
+            f.write(json.dumps(cluster) + "\n")
+
+    duplicates = {i for members in clusters for i in members[1:]}
+    print(f"{len(clusters)} clusters, {len(duplicates)} duplicate records of {len(records)}"
+          + (f", {cross_split} clusters across splits" if split_map else ""))
+
+    if deduplicate:
+        dedup_path = os.path.join(output_path, f"{data_name}-dedup.jsonl")
+        with open(dedup_path + ".tmp", "w") as f:
+            for i, record in enumerate(iter_jsonl(dataset_path)):
+                if i not in duplicates:
+                    f.write(json.dumps(record) + "\n")
+        os.replace(dedup_path + ".tmp", dedup_path)
+
+    return clusters
+
+
+def build_character_table(dataset_paths, output_path, threshold=0.6):
+    """
+    Align the characters of every book across sources (e.g. "Ebenezer Scrooge" and "Scrooge") and write the
+    canonical character table to output_path/characters.sqlite, see utils.character_alignment.
+    """
+
+    mentions = set()
+    for dataset_path in dataset_paths:
+        for record in iter_jsonl(dataset_path):
+            mentions.add((int(record["id"]), record["character"], record["source"]))
 
-def split_corpus(dataset_path, split_path, save_path):
-    train = pd.read_csv(os.path.join(split_path, "train.tsv"), sep="\t")
-    val = pd.read_csv(os.path.join(split_path, "val.tsv"), sep="\t")
-    test = pd.read_csv(os.path.join(split_path, "test.tsv"), sep="\t")
-    full_corpus = pd.read_json(dataset_path, lines=True)
+    characters = align_characters(mentions, threshold)
+    write_character_table(characters, os.path.join(output_path, "characters.sqlite"))
+    print(f"{len(characters)} characters from {len({(b, n) for b, n, _ in mentions})} names")
 
-    train_split = full_corpus[full_corpus["id"].isin(train["BookId"].unique())]
-    train_split.to_json(os.path.join(save_path, "train.jsonl"), orient='records', lines=True)
+    return characters
+
+
+def _mention_key(record, characters=None):
+    if record.get("character_id"):
+        return record["character_id"]
+    if characters is not None:
+        character_id = characters.lookup(record["id"], record["character"])
+        if character_id is not None:
+            return character_id
+    return normalize_name(record["character"])
+
+
+def _index_book(store_dir, book_id, characters):
+    with BookStore(store_dir).open(book_id) as reader:
+        mentions = scan_mentions(reader.iter_paragraphs(), characters)
+    write_mention_index(store_dir, book_id, mentions)
+    return book_id
+
+
+def build_mention_index(dataset_path, store_dir, character_table=None, num_workers=1):
+    """
+    Scan every book of the dataset once for the mentions of all its characters (names and aliases of the
+    character table) and store the counts and paragraph positions next to the book, see utils.mentions.
+    """
+
+    characters = CharacterTable(character_table) if character_table is not None else None
+    store = BookStore(store_dir)
+    books = defaultdict(dict)
+    for record in iter_jsonl(dataset_path):
+        key = _mention_key(record, characters)
+        aliases = books[record["id"]].setdefault(key, {record["character"]})
+        character = characters.get(key) if characters is not None else None
+        if character is not None:
+            aliases.update(character["aliases"])
+
+    books = {book_id: {key: sorted(aliases) for key, aliases in book.items()}
+             for book_id, book in books.items() if book_id in store}
+
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(_index_book, repeat(store_dir), books, books.values()))
+    else:
+        for book_id, book in books.items():
+            _index_book(store_dir, book_id, book)
+    print(f"Indexed the character mentions of {len(books)} books")
+
+
+def filter_unmentioned(dataset_path, store_dir, output_path, tokenizer_name, truncate_length,
+                       character_table=None):
+    """
+    Keep only the records whose character is mentioned in the part of the book that truncate_text keeps, i.e. in
+    its first truncate_length tokens, according to the mention index of build_mention_index.
+    """
+
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    characters = CharacterTable(character_table) if character_table is not None else None
+    store = BookStore(store_dir)
+    kept_paragraphs, indexes = {}, {}
+    kept, total = 0, 0
+
+    data_name = Path(dataset_path).stem
+    output_file = os.path.join(output_path, data_name + f"-mentioned-{truncate_length}.jsonl")
+    with open(output_file + ".tmp", "w") as f:
+        for record in iter_jsonl(dataset_path):
+            total += 1
+            book_id = record["id"]
+            if book_id not in indexes:
+                indexes[book_id] = read_mention_index(store_dir, book_id)
+                if indexes[book_id] is not None:
+                    # only the leading blocks of the book are read and tokenized
+                    with store.open(book_id) as reader:
+                        kept_paragraphs[book_id] = len(truncate_paragraphs(reader.iter_paragraphs(), tokenizer,
+                                                                           truncate_length))
+            if indexes[book_id] is None:
+                continue
 
-    val_split = full_corpus[full_corpus["id"].isin(val["BookId"].unique())]
-    val_split.to_json(os.path.join(save_path, "val.jsonl"), orient='records', lines=True)
+            mentions = indexes[book_id].get(_mention_key(record, characters)) or \
+                indexes[book_id].get(normalize_name(record["character"]))
+            if mentions and mentions["paragraphs"] and mentions["paragraphs"][0] < kept_paragraphs[book_id]:
+                f.write(json.dumps(record) + "\n")
+                kept += 1
+    os.replace(output_file + ".tmp", output_file)
 
-    test_split = full_corpus[full_corpus["id"].isin(test["BookId"].unique())]
-    test_split.to_json(os.path.join(save_path, "test.jsonl"), orient='records', lines=True)
+    missing = [book_id for book_id, index in indexes.items() if index is None]
+    print(f"Kept {kept} of {total} records" + (f", no mention index for books {missing}" if missing else ""))
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Script for filtering or splitting corpus data.")
-    parser.add_argument('--action', type=str, choices=['filter', 'split'], required=True,
-                        help="Action to perform: 'filter' or 'split'.")
+    parser.add_argument('--action', type=str,
+                        choices=['filter', 'split', 'full_book', 'dedup', 'align', 'mentions', 'filter_mentions'],
+                        required=True, help="Action to perform.")
 
     parser.add_argument('--dataset_path', type=str, required=True, help='Path to the dataset')
     parser.add_argument('--task', type=str, default='description', help='Task name')
-    parser.add_argument('--tokens_threshold', type=int, help='Tokens threshold for filtering')
+    parser.add_argument('--tokens_threshold', type=int, nargs='+',
+                        help='Tokens thresholds for filtering, one output file is written per threshold')
     parser.add_argument('--output_path', type=str, help='Output path for filtered data')
     parser.add_argument('--split_path', type=str, help='Path to the split files')
     parser.add_argument('--save_path', type=str, help='Path to save the splits')
+    parser.add_argument('--format', type=str, choices=list(FORMATS), default='jsonl',
+                        help='Format of the split files; parquet and arrow need pyarrow')
+    parser.add_argument('--extra_dataset_paths', type=str, nargs='*', default=[],
+                        help='Further datasets whose characters are aligned (e.g. the analysis data)')
+    parser.add_argument('--character_table', type=str, default=None,
+                        help='Character table written by the align action, adds character_id to full_book records')
+    parser.add_argument('--tokenizer', type=str, default=None,
+                        help='Tokenizer that defines the truncate_length tokens of filter_mentions')
+    parser.add_argument('--truncate_length', type=int, default=None,
+                        help='Number of leading book tokens in which the characters must be mentioned')
+    parser.add_argument('--store_dir', type=str, help='Path to the book store (see utils/book_store.py)')
+    parser.add_argument('--hash_unassigned', action='store_true',
+                        help='Assign books that are in no split file to a split by the hash of their BookId')
+    parser.add_argument('--split_ratios', type=float, nargs=3, default=[0.8, 0.1, 0.1],
+                        help='Train, val and test ratios of --hash_unassigned')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='Similarity above which texts (dedup, default 0.8) or names (align, default 0.6) match')
+    parser.add_argument('--num_perm', type=int, default=128, help='Number of MinHash permutations')
+    parser.add_argument('--ngram', type=int, default=5, help='Number of words per shingle')
+    parser.add_argument('--deduplicate', action='store_true',
+                        help='Also write the dataset with only the first record of every cluster')
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help='Number of processes counting tokens or computing signatures')
+    parser.add_argument('--chunk_size', type=int, default=1000, help='Number of records read at once')
+    parser.add_argument('--count_cache', type=str, default=None,
+                        help='File of cached token counts (default: <output_path>/token_counts.tsv)')
 
     args = parser.parse_args()
 
     if args.action == 'filter':
         if args.tokens_threshold is None or args.output_path is None:
             parser.error("--tokens_threshold and --output_path are required for action 'filter'.")
-        filter_corpus(args.dataset_path, args.tokens_threshold, args.output_path, args.task)
+        filter_corpus(args.dataset_path, args.tokens_threshold, args.output_path, args.task, args.num_workers,
+                      args.chunk_size, args.count_cache)
     elif args.action == 'split':
         if args.split_path is None or args.save_path is None:
             parser.error("--split_path and --save_path are required for action 'split'.")
-        split_corpus(args.dataset_path, args.split_path, args.save_path)
+        split_corpus(args.dataset_path, args.split_path, args.save_path, args.hash_unassigned, args.split_ratios,
+                     args.format)
+    elif args.action == 'full_book':
+        if args.store_dir is None or args.save_path is None:
+            parser.error("--store_dir and --save_path are required for action 'full_book'.")
+        build_full_book(args.dataset_path, args.store_dir, args.save_path, args.format, args.character_table)
+    elif args.action == 'dedup':
+        if args.output_path is None:
+            parser.error("--output_path is required for action 'dedup'.")
+        dedup_corpus(args.dataset_path, args.output_path, args.task,
+                     args.threshold if args.threshold is not None else 0.8, args.num_perm, args.ngram,
+                     args.split_path, args.deduplicate, args.num_workers, args.chunk_size)
+    elif args.action == 'align':
+        if args.output_path is None:
+            parser.error("--output_path is required for action 'align'.")
+        build_character_table([args.dataset_path] + args.extra_dataset_paths, args.output_path,
+                              args.threshold if args.threshold is not None else 0.6)
+    elif args.action == 'mentions':
+        if args.store_dir is None:
+            parser.error("--store_dir is required for action 'mentions'.")
+        build_mention_index(args.dataset_path, args.store_dir, args.character_table, args.num_workers)
+    elif args.action == 'filter_mentions':
+        if None in [args.store_dir, args.output_path, args.tokenizer, args.truncate_length]:
+            parser.error("--store_dir, --output_path, --tokenizer and --truncate_length are required for action "
+                         "'filter_mentions'.")
+        filter_unmentioned(args.dataset_path, args.store_dir, args.output_path, args.tokenizer, args.truncate_length,
+                           args.character_table)
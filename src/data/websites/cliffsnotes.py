@@ -1,11 +1,17 @@
 import re
-import time
 from urllib.parse import urljoin, urlsplit
 
-import requests
-from bs4 import BeautifulSoup
-
+from src.utils import http_client, journal
 from src.utils.misc import check_snapshot_date
+from src.utils.response_cache import CacheMissError
+from . import parsing
+
+# subtrees needed by each extractor, see parsing.make_strainer
+STRAINERS = {
+    "summary": [("div", "gts-placeholder-wrapper"), ("p", "litNoteText")],
+    "character_analysis_urls": [("li", None), ("a", None)],
+    "character_analysis": [("article", None)],
+}
 
 
 def scrape():
@@ -13,8 +19,8 @@ def scrape():
 
     base_url = "https://www.cliffsnotes.com/"
     all_literature_notes = "https://www.cliffsnotes.com/literature?filter=ShowAll&sort=TITLE"
-    page = requests.get(all_literature_notes)
-    soup = BeautifulSoup(page.content, "html.parser")
+    page = http_client.get(all_literature_notes)
+    soup = parsing.make_soup(page.content)
 
     lit_studies = soup.find_all("a", class_="clear-padding")
     lit_titles = []
@@ -43,8 +49,10 @@ def get_data(book_id, title, author, url, data_type):
     elif data_type == "analysis":
         char_urls = extract_char_analysis_urls(url)
         char_analysis = []
-        for _url in char_urls:
-            char_analysis.extend(get_character_analysis(book_id, title, author, _url))
+        pages_data = http_client.map_pages(
+            lambda _url: journal.checkpoint(_url, get_character_analysis, book_id, title, author, _url), char_urls)
+        for char_data in pages_data:
+            char_analysis.extend(char_data)
         return char_analysis
     elif data_type == "summary":
         return get_summary(url)
@@ -57,17 +65,30 @@ def get_summary(url):
     Scrape the summary from a given URL
     """
     url_suffix = ["/book-summary", "/play-summary", "/poem-summary"]
-    summary = ""
     page = None
     for suffix in url_suffix:
         test_url = urljoin(url[:url.rfind('/') + 1], suffix)
-        if requests.get(test_url):
-            page = requests.get(test_url)
+        try:
+            response = http_client.get(test_url)
+        except CacheMissError:
+            # only successful pages are cached, so in replay a missing summary page was not found
+            continue
+        if response:
+            page = response
             break
     if page is None:
-        page = requests.get(url)
+        page = http_client.get(url)
+
+    return parsing.parse(parse_summary, page.content)
+
+
+def parse_summary(content):
+    """
+    Extract the summary from the content of the summary page
+    """
 
-    soup = BeautifulSoup(page.content, "html.parser")
+    soup = parsing.make_soup(content, STRAINERS["summary"])
+    summary = ""
     content_div = soup.find("div", class_="gts-placeholder-wrapper float left middle-for-small-only")
 
     if content_div:
@@ -78,72 +99,80 @@ def get_summary(url):
     return summary
 
 
-def get_character_description(book_id, title, author, url, max_attempts=5):
+def get_character_description(book_id, title, author, url):
     """
     Get character descriptions from the given URL
     """
-    page = requests.get(url)
+    page = http_client.get(url)
     valid, edit_page = check_snapshot_date(page, url)
     if not valid:
         page = edit_page
-    soup = BeautifulSoup(page.content, "html.parser")
+
+    return parsing.parse(parse_character_description, page.content, book_id, title, author, url)
+
+
+def parse_character_description(content, book_id, title, author, url):
+    """
+    Extract character descriptions from the content of the character list page. Returns None if the page matches
+    none of the known layouts.
+    """
+
+    soup = parsing.make_soup(content)
     data = []
 
-    current_attempt = 1
-
-    while current_attempt <= max_attempts:
-        major_char_heading = soup.find("p", class_="litNoteTextHeading", text="Major Characters")
-        if major_char_heading:
-            characters = major_char_heading.find_next_siblings("p", class_="litNoteText")
-            for c in characters:
-                char_name = c.findNext("strong").text.strip()
-                descr = re.sub(char_name, "", c.text).strip()
-                data.append({"id": book_id, "book": title, "author": author, "character": char_name,
-                             "description": descr, "source": "Cliffnotes", "url": url})
-            break
+    major_char_heading = soup.find("p", class_="litNoteTextHeading", text="Major Characters")
+    if major_char_heading:
+        characters = major_char_heading.find_next_siblings("p", class_="litNoteText")
+        for c in characters:
+            char_name = c.findNext("strong").text.strip()
+            descr = re.sub(char_name, "", c.text).strip()
+            data.append({"id": book_id, "book": title, "author": author, "character": char_name,
+                         "description": descr, "source": "Cliffnotes", "url": url})
+        return data
+
+    paragraphs = soup.find_all("p", class_="litNoteText")
+    if paragraphs:
+        for p in paragraphs:
+            if p.findChildren("strong"):
+                char_name = p.findNext("strong").text.strip()
+                descr = re.sub(char_name, "", p.text).strip()
 
-        paragraphs = soup.find_all("p", class_="litNoteText")
-        if paragraphs:
-            for p in paragraphs:
-                if p.findChildren("strong"):
-                    char_name = p.findNext("strong").text.strip()
-                    descr = re.sub(char_name, "", p.text).strip()
-
-                elif p.findNext("b"):
-                    char_name = p.findNext("b").text.strip()
-                    descr = re.sub(char_name, "", p.text, count=1).strip()
-                else:
-                    continue
-
-                data.append({"id": book_id, "book": title, "author": author, "character": char_name,
-                             "description": descr, "source": "Cliffnotes", "url": url})
-            break
-        headings = soup.find_all("p", class_="litNoteTextHeading")
-
-        if headings:
-            for h in headings:
-                char_name = h.text.strip()
-                descr = h.findNext("p").text.strip()
-                data.append({"id": book_id, "book": title, "author": author, "character": char_name,
-                             "description": descr, "source": "Cliffnotes", "url": url})
-            break
+            elif p.findNext("b"):
+                char_name = p.findNext("b").text.strip()
+                descr = re.sub(char_name, "", p.text, count=1).strip()
+            else:
+                continue
 
-        current_attempt += 1
-        time.sleep(30)
+            data.append({"id": book_id, "book": title, "author": author, "character": char_name,
+                         "description": descr, "source": "Cliffnotes", "url": url})
+        return data
 
-    if current_attempt >= max_attempts:
-        return None
-        # print("Failed to get character description for {}".format(title))
+    headings = soup.find_all("p", class_="litNoteTextHeading")
+    if headings:
+        for h in headings:
+            char_name = h.text.strip()
+            descr = h.findNext("p").text.strip()
+            data.append({"id": book_id, "book": title, "author": author, "character": char_name,
+                         "description": descr, "source": "Cliffnotes", "url": url})
+        return data
 
-    return data
+    return None
 
 
 def extract_char_analysis_urls(url):
     """Extract character analysis URLs from the given character list URL."""
 
     phrase = "character-list"
-    page = requests.get(urljoin(url[:url.rfind('/') + 1], phrase))
-    soup = BeautifulSoup(page.content, "html.parser")
+    page = http_client.get(urljoin(url[:url.rfind('/') + 1], phrase))
+    return parsing.parse(parse_char_analysis_urls, page.content, url)
+
+
+def parse_char_analysis_urls(content, url):
+    """
+    Extract character analysis URLs from the content of the character list page.
+    """
+
+    soup = parsing.make_soup(content, STRAINERS["character_analysis_urls"])
 
     character_analysis_urls = []
 
@@ -164,13 +193,21 @@ def extract_char_analysis_urls(url):
 def get_character_analysis(book_id, title, author, url):
     """Get character analysis from the given URL."""
 
-    data = []
-    page = requests.get(url)
+    page = http_client.get(url)
     valid, edit_page = check_snapshot_date(page, url)
     if not valid:
         page = edit_page
 
-    analysis_soup = BeautifulSoup(page.content, "html.parser")
+    return parsing.parse(parse_character_analysis, page.content, book_id, title, author, url)
+
+
+def parse_character_analysis(content, book_id, title, author, url):
+    """
+    Extract character analysis from the content of a character analysis page.
+    """
+
+    analysis_soup = parsing.make_soup(content, STRAINERS["character_analysis"])
+    data = []
 
     article = analysis_soup.find("article")
     if article:
@@ -1,10 +1,15 @@
 from string import ascii_uppercase
 from urllib.parse import urljoin
 
-import requests
-from bs4 import BeautifulSoup
-
+from src.utils import http_client
 from src.utils.misc import check_snapshot_date
+from . import parsing
+
+# subtrees needed by each extractor, see parsing.make_strainer
+STRAINERS = {
+    "character_description": [("h2", "toc_header"), ("p", None)],
+    "summary": [("article", "section__article")],
+}
 
 
 def scrape():
@@ -16,16 +21,17 @@ def scrape():
     lit_authors = []
     lit_websites = []
 
-    for letter in ascii_uppercase:
-        page = requests.get(studies_url + letter)
-        soup = BeautifulSoup(page.content, "html.parser")
+    def scrape_letter(letter):
+        page = http_client.get(studies_url + letter)
+        soup = parsing.make_soup(page.content)
         lit_studies = soup.find_all("a", class_="columnList__link")
-        for x in lit_studies:
-            title = x.text.strip()
-            url = urljoin(base_url, x["href"])
+        return [(x.text.strip(), x.findNext("a").text, urljoin(base_url, x["href"])) for x in lit_studies]
 
+    # the letter pages are fetched concurrently by the page workers
+    for letter_studies in http_client.map_pages(scrape_letter, ascii_uppercase):
+        for title, author, url in letter_studies:
             lit_titles.append(title)
-            lit_authors.append(x.findNext("a").text)
+            lit_authors.append(author)
             lit_websites.append(url)
 
     return lit_titles, lit_authors, lit_websites
@@ -48,12 +54,20 @@ def get_data(book_id, title, author, url, data_type):
 def get_character_description(book_id, title, author, url):
     """Retrieve character descriptions from the specified URL."""
 
-    page = requests.get(url)
+    page = http_client.get(url)
     valid, edit_page = check_snapshot_date(page, url)
     if not valid:
         page = edit_page
 
-    soup = BeautifulSoup(page.content, "html.parser")
+    return parsing.parse(parse_character_description, page.content, book_id, title, author, url)
+
+
+def parse_character_description(content, book_id, title, author, url):
+    """
+    Extract character descriptions from the content of the character list page.
+    """
+
+    soup = parsing.make_soup(content, STRAINERS["character_description"])
     chars_nodes = soup.find_all("h2", class_="toc_header")
     data = []
 
@@ -72,8 +86,16 @@ def get_summary(url):
 
     url_suffix = "/study-guide/summary"
 
-    page = requests.get(url + "/" + url_suffix)
-    soup = BeautifulSoup(page.content, "html.parser")
+    page = http_client.get(url + "/" + url_suffix)
+    return parsing.parse(parse_summary, page.content)
+
+
+def parse_summary(content):
+    """
+    Extract the book summary from the content of the summary page.
+    """
+
+    soup = parsing.make_soup(content, STRAINERS["summary"])
     summary_paragraphs = []
 
     article_node = soup.find("article", class_="section__article")
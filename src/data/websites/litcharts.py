@@ -1,18 +1,25 @@
 import json
 from urllib.parse import urlparse, urljoin
 
-import requests
-from bs4 import BeautifulSoup
 import time
 
+from src.utils import http_client, journal
+from . import parsing
+
+# subtrees needed by each extractor, see parsing.make_strainer
+STRAINERS = {
+    "character_page": [("div", "highlightable-content")],
+    "summary": [("p", "plot-text")],
+}
+
 
 def scrape():
     """Scrape url links of LitCharts website"""
 
     base_url = "https://www.litcharts.com/"
     all_studies_url = f"{base_url}lit#all"
-    page = requests.get(all_studies_url)
-    soup = BeautifulSoup(page.content, "html.parser")
+    page = http_client.get(all_studies_url)
+    soup = parsing.make_soup(page.content)
 
     lit_studies = soup.find("div", id="all")
     all_lits = json.loads(lit_studies.find("div")["data-react-props"])
@@ -52,53 +59,87 @@ def get_character_description(book_id, title, author, url, max_attempts=3):
     data = []
     scrape_url = urljoin(url + "/", url_suffix)
 
-    page = requests.get(scrape_url)
-    soup = BeautifulSoup(page.content, "html.parser")
+    page = http_client.get(scrape_url)
+    chars = parsing.parse(parse_character_links, page.content)
 
-    chars_node = soup.find_all("a", class_="subcomponent tappable", string="All Characters")
+    def scrape_character(char):
+        char_name, href = char
+        num_attempts = 0
 
-    if chars_node:
-        chars = chars_node[0].findNextSiblings("a", class_="subcomponent tappable")
-        for c in chars:
-            # print(c)
-            num_attempts = 0
+        # max_retries per character
+        # Keep trying until success or until we exceed max_retries
+        while num_attempts < max_attempts:
 
-            # max_retries per character
-            # Keep trying until success or until we exceed max_retries
-            while num_attempts < max_attempts:
+            try:
+                character_url = "https://" + base_url + href
+                char_response = http_client.get(character_url)
+                descr = parsing.parse(parse_character_page, char_response.content)
 
-                try:
-                    char_name = c.text.strip()
-                    character_url = "https://" + base_url + c["href"]
-                    char_response = requests.get(character_url)
-                    char_soup = BeautifulSoup(char_response.content, "html.parser")
-                    description_node = char_soup.find_all("div", class_="highlightable-content")
+                if descr is not None:
+                    return {"id": book_id, "book": title, "author": author, "character": char_name,
+                            "description": descr, "source": "LitCharts", "url": character_url}
+            except:
+                print("wait")
+                time.sleep(30)
 
-                    if description_node:
-                        descr = description_node[0].text.strip()
+                if num_attempts == max_attempts:
+                    raise ValueError("Failed to scrape character description")
 
-                        data.append(
-                            {"id": book_id, "book": title, "author": author, "character": char_name, "description": descr,
-                             "source": "LitCharts", "url": character_url})
-                        break
-                except:
-                    print("wait")
-                    time.sleep(30)
+            num_attempts += 1
 
-                    if num_attempts == max_attempts:
-                        raise ValueError("Failed to scrape character description")
+        return None
 
-                num_attempts += 1
+    pages_data = http_client.map_pages(
+        lambda char: journal.checkpoint("https://" + base_url + char[1], scrape_character, char), chars)
+    for char_data in pages_data:
+        if char_data is not None:
+            data.append(char_data)
 
     return data
 
 
+def parse_character_links(content):
+    """
+    Extract the (name, link) pairs of all characters from the content of the characters page
+    """
+
+    soup = parsing.make_soup(content)
+    chars_node = soup.find_all("a", class_="subcomponent tappable", string="All Characters")
+
+    if not chars_node:
+        return []
+
+    chars = chars_node[0].findNextSiblings("a", class_="subcomponent tappable")
+    return [(c.text.strip(), c["href"]) for c in chars]
+
+
+def parse_character_page(content):
+    """
+    Extract the description from the content of a character page, or None if it has no description
+    """
+
+    char_soup = parsing.make_soup(content, STRAINERS["character_page"])
+    description_node = char_soup.find_all("div", class_="highlightable-content")
+
+    if description_node:
+        return description_node[0].text.strip()
+    return None
+
+
 def get_summary(url):
     """Scrape the summary of the book from the given URL."""
 
     url_suffix = "summary"
-    page = requests.get(url + "/" + url_suffix)
-    soup = BeautifulSoup(page.content, "html.parser")
+    page = http_client.get(url + "/" + url_suffix)
+    return parsing.parse(parse_summary, page.content)
+
+
+def parse_summary(content):
+    """
+    Extract the summary of the book from the content of the summary page.
+    """
+
+    soup = parsing.make_soup(content, STRAINERS["summary"])
 
     paragraphs = soup.find_all("p", class_="plot-text")
     summary_paragraphs = []
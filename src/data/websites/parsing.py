@@ -0,0 +1,157 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from src.utils.pipeline import StageMetrics
+
+try:
+    import lxml  # noqa: F401
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+BACKENDS = ["html.parser", "lxml", "selectolax"]
+
+_backend = "html.parser"
+_pool = None
+parse_stage = StageMetrics("parse")
+
+
+def set_backend(name):
+    """
+    Select the HTML parsing backend used by the scrapers: the pure-Python "html.parser", "lxml", or "selectolax",
+    which cuts the strained subtrees out of the page with a fast C parser and only builds those with BeautifulSoup.
+    """
+    global _backend
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown parser backend: {name}. Choose one of {BACKENDS}")
+    if name == "lxml" and not LXML_AVAILABLE:
+        raise ValueError("The lxml backend requires the lxml package")
+    if name == "selectolax" and LexborHTMLParser is None:
+        raise ValueError("The selectolax backend requires the selectolax package")
+
+    _backend = name
+
+
+def get_backend():
+    return _backend
+
+
+def _classes(value):
+    if value is None:
+        return set()
+    if isinstance(value, str):
+        return set(value.split())
+    return set(value)
+
+
+class RuleStrainer(SoupStrainer):
+    """
+    SoupStrainer matching any of a list of (tag name, set of classes) rules. An element matches a rule if it has
+    the tag name and all of the classes.
+    """
+
+    def __init__(self, rules):
+        super().__init__(self.match_rules)
+        self.rules = rules
+
+    def match_rules(self, tag, attrs=None):
+        # bs4 < 4.13 calls the function with (name, attrs) while parsing; later versions call it with a Tag
+        if attrs is None and hasattr(tag, "attrs"):
+            tag, attrs = tag.name, tag.attrs
+        element_classes = _classes((attrs or {}).get("class"))
+        return any(tag == name and classes <= element_classes for name, classes in self.rules)
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        # bs4 >= 4.13 decides which tags to build here, passing only the tag name to the function
+        return self.match_rules(name, attrs)
+
+
+def make_strainer(strainer):
+    """
+    Build a SoupStrainer from a strainer declaration, a list of (tag name, space-separated classes or None) pairs.
+    """
+
+    return RuleStrainer([(name, _classes(classes)) for name, classes in strainer])
+
+
+def strainer_to_css(strainer):
+    selectors = []
+    for name, classes in strainer:
+        selectors.append(name + "".join("." + c for c in sorted(_classes(classes))))
+    return ", ".join(selectors)
+
+
+def _select_subtrees(content, strainer):
+    tree = LexborHTMLParser(content)
+    nodes = tree.css(strainer_to_css(strainer))
+
+    selected = set()
+    html_parts = []
+    for node in nodes:
+        # nested matches are already part of their ancestor's html
+        parent, nested = node.parent, False
+        while parent is not None:
+            if parent.mem_id in selected:
+                nested = True
+                break
+            parent = parent.parent
+        selected.add(node.mem_id)
+        if not nested:
+            html_parts.append(node.html)
+
+    return "\n".join(html_parts)
+
+
+def make_soup(content, strainer=None):
+    """
+    Parse a page with the selected backend. If a strainer declaration is given, only the matching subtrees are
+    built, which is enough for extractors that search within these containers.
+    """
+
+    if _backend == "selectolax":
+        bs4_parser = "lxml" if LXML_AVAILABLE else "html.parser"
+        if strainer is None:
+            return BeautifulSoup(content, bs4_parser)
+        return BeautifulSoup(_select_subtrees(content, strainer), bs4_parser)
+
+    parse_only = make_strainer(strainer) if strainer is not None else None
+    return BeautifulSoup(content, _backend, parse_only=parse_only)
+
+
+def _run_parser(backend, func, content, args):
+    global _backend
+
+    _backend = backend
+    return func(content, *args)
+
+
+def configure_pool(num_processes=0, max_pending=None):
+    """
+    Run the page parsers in a pool of num_processes processes, so that parsing is not serialised by the GIL of the
+    fetching threads. At most max_pending pages wait for or are being parsed; fetchers block beyond that.
+    """
+    global _pool, parse_stage
+
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = ProcessPoolExecutor(max_workers=num_processes) if num_processes > 0 else None
+    parse_stage = StageMetrics("parse", max_pending or (2 * num_processes if num_processes > 0 else None))
+
+
+def parse(func, content, *args):
+    """
+    Call func(content, *args) in the parser pool if there is one, otherwise in the calling thread. func must be a
+    module-level function returning picklable data.
+    """
+
+    with parse_stage.slot():
+        if _pool is None:
+            return func(content, *args)
+        return _pool.submit(_run_parser, _backend, func, content, args).result()
@@ -2,10 +2,9 @@ import re
 import time
 from urllib.parse import urlparse
 
-import requests
-from bs4 import BeautifulSoup
-
+from src.utils import http_client, journal
 from src.utils.misc import check_snapshot_date
+from . import parsing
 
 
 def scrape():
@@ -18,16 +17,20 @@ def scrape():
     lit_authors = []
     lit_websites = []
 
-    for i in range(1, num_pages+1):
-        page = requests.get(base_page + str(i))
-        soup = BeautifulSoup(page.content, "html.parser")
+    def scrape_page(i):
+        page = http_client.get(base_page + str(i))
+        soup = parsing.make_soup(page.content)
         lit_studies = soup.find_all("a", class_="details")
 
         page_titles = [
             item.find("div", class_="item-info").get_text(strip=True) for item in lit_studies
         ]
         page_urls = [item["href"] for item in lit_studies]
+        return page_titles, page_urls
 
+    # the listing pages are fetched concurrently by the page workers and merged in page order
+    pages = http_client.map_pages(scrape_page, range(1, num_pages+1))
+    for i, (page_titles, page_urls) in enumerate(pages, start=1):
         lit_titles.extend(page_titles)
         lit_authors.extend(["N/A"] * len(page_titles))  # no available author name
         lit_websites.extend(page_urls)
@@ -46,16 +49,15 @@ def get_data(book_id, title, author, url, data_type, max_attempts=3, sleep_time=
         c_url = url + url_suffix
 
         char_urls, char_names = extract_char_analysis_urls(c_url)
-        url_to_data = {}
-        for i, _url in enumerate(char_urls):
+
+        def scrape_character(i):
             attempt = 0
             while attempt < max_attempts:
 
                 try:
-                    _data = get_character_analysis(book_id, title, author, _url, char_names[i])
+                    _data = get_character_analysis(book_id, title, author, char_urls[i], char_names[i])
                     if _data:
-                        url_to_data[_url] = _data
-                        break
+                        return _data
                     time.sleep(30)
                 except Exception as e:
                     # print(e)
@@ -65,6 +67,15 @@ def get_data(book_id, title, author, url, data_type, max_attempts=3, sleep_time=
                     time.sleep(sleep_time)
                     attempt += 1
 
+            return []
+
+        url_to_data = {}
+        pages_data = http_client.map_pages(lambda i: journal.checkpoint(char_urls[i], scrape_character, i),
+                                           range(len(char_urls)))
+        for i, _data in enumerate(pages_data):
+            if _data:
+                url_to_data[char_urls[i]] = _data
+
         flattened_char_analysis = [item for sublist in url_to_data.values() for item in sublist]
 
         return flattened_char_analysis
@@ -79,8 +90,16 @@ def extract_char_analysis_urls(url):
     """
     Extract character analysis URLs from the characters page.
     """
-    page = requests.get(url)
-    soup = BeautifulSoup(page.content, "html.parser")
+    page = http_client.get(url)
+    return parsing.parse(parse_char_analysis_urls, page.content, url)
+
+
+def parse_char_analysis_urls(content, url):
+    """
+    Extract character analysis URLs from the content of the characters page.
+    """
+
+    soup = parsing.make_soup(content)
     nodes = soup.find("div", attrs={'data-content-type': 'text'})
     character_analysis_urls = []
     char_names = []
@@ -104,13 +123,21 @@ def get_character_analysis(book_id, title, author, url, char_name=None):
     """
     Scrape character analysis from a given url
     """
-    data = []
-    page = requests.get(url)
+    page = http_client.get(url)
     valid, edit_page = check_snapshot_date(page, url)
     if not valid:
         page = edit_page
 
-    soup = BeautifulSoup(page.content, "html.parser")
+    return parsing.parse(parse_character_analysis, page.content, book_id, title, author, url, char_name)
+
+
+def parse_character_analysis(content, book_id, title, author, url, char_name):
+    """
+    Extract character analysis from the content of a character page
+    """
+
+    soup = parsing.make_soup(content)
+    data = []
 
     analysis = ""
     title_node = soup.find("h2", class_="title")
@@ -134,8 +161,16 @@ def get_summary(url):
 
     summary_url = f"{url}/summary"
 
-    page = requests.get(summary_url)
-    soup = BeautifulSoup(page.content, "html.parser")
+    page = http_client.get(summary_url)
+    return parsing.parse(parse_summary, page.content)
+
+
+def parse_summary(content):
+    """
+    Extract the summary from the content of the summary page
+    """
+
+    soup = parsing.make_soup(content)
     summary_paragraphs = []
     node = soup.find("h2", class_="title")
 
@@ -1,9 +1,19 @@
 import re
 import urllib.parse
 
-import requests
-from bs4 import BeautifulSoup
+from src.utils import http_client, journal
 from src.utils.misc import check_snapshot_date
+from . import parsing
+
+# subtrees needed by each extractor, see parsing.make_strainer
+STRAINERS = {
+    "character_description": [("div", "mainTextContent main-container"),
+                              ("ul", "mainTextContent__list-content")],
+    "character_analysis_urls": [("a", None)],
+    "character_analysis": [("span", "interior-sticky-nav__title__section"),
+                           ("div", "mainTextContent main-container"), ("div", "content_txt")],
+    "summary": [("div", "mainTextContent main-container"), ("div", "studyGuideText hack-to-hide-first-h2")],
+}
 
 
 def scrape():
@@ -14,8 +24,8 @@ def scrape():
     base_url = "https://www.sparknotes.com/"
     all_studies = urllib.parse.urljoin(base_url, "lit/")
 
-    page = requests.get(all_studies)
-    soup = BeautifulSoup(page.content, "html.parser")
+    page = http_client.get(all_studies)
+    soup = parsing.make_soup(page.content)
 
     study_link_class = (
         "hub-AZ-list__card__title__link "
@@ -50,11 +60,17 @@ def get_data(book_id, title, author, base_url, data_type):
         url = urllib.parse.urljoin(base_url, "characters")
 
         char_urls = extract_char_analysis_urls(url, base_url)
-        char_analysis = []
-        for char_url in char_urls:
+
+        def scrape_character(char_url):
             char_data = get_character_analysis(book_id, title, author, char_url)
             if not char_data:
                 char_data = get_character_analysis(book_id, title, author, char_url.replace("character/", ""))
+            return char_data
+
+        char_analysis = []
+        pages_data = http_client.map_pages(lambda char_url: journal.checkpoint(char_url, scrape_character, char_url),
+                                           char_urls)
+        for char_data in pages_data:
             char_analysis.extend(char_data)
         return char_analysis
     elif data_type == "summary":
@@ -67,12 +83,20 @@ def get_character_description(book_id, title, author, url):
     Scrape character descriptions for a given url
     """
 
-    page = requests.get(url)
+    page = http_client.get(url)
     valid, edit_page = check_snapshot_date(page, url)
     if not valid:
         page = edit_page
 
-    soup = BeautifulSoup(page.content, "html.parser")
+    return parsing.parse(parse_character_description, page.content, book_id, title, author, url)
+
+
+def parse_character_description(content, book_id, title, author, url):
+    """
+    Extract character descriptions from the characters page
+    """
+
+    soup = parsing.make_soup(content, STRAINERS["character_description"])
     data = []
 
     # try:
@@ -83,7 +107,7 @@ def get_character_description(book_id, title, author, url):
 
         for header in header_tags:
             char_name = header.text
-            siblings = header.findNextSiblings("p")
+            siblings = header.find_next_siblings("p")
             descr = siblings[0].text
             descr = ' '.join(i.strip() for i in descr.split('\n'))
             data.append(
@@ -110,8 +134,16 @@ def extract_char_analysis_urls(url, base_url):
     Extract character analysis URLs from the characters page.
     """
 
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, "html.parser")
+    response = http_client.get(url)
+    return parsing.parse(parse_char_analysis_urls, response.content, base_url)
+
+
+def parse_char_analysis_urls(content, base_url):
+    """
+    Extract character analysis URLs from the content of the characters page.
+    """
+
+    soup = parsing.make_soup(content, STRAINERS["character_analysis_urls"])
     character_analysis_urls = []
 
     nodes = soup.find_all("a", recursive=True)
@@ -132,11 +164,19 @@ def get_character_analysis(book_id, title, author, url):
     """
     Scrape character analysis from a given url
     """
-    response = requests.get(url)
+    response = http_client.get(url)
     valid, edit_page = check_snapshot_date(response, url)
     if not valid:
         response = edit_page
-    soup = BeautifulSoup(response.content, "html.parser")
+    return parsing.parse(parse_character_analysis, response.content, book_id, title, author, url)
+
+
+def parse_character_analysis(content, book_id, title, author, url):
+    """
+    Extract character analysis from the content of a character page
+    """
+
+    soup = parsing.make_soup(content, STRAINERS["character_analysis"])
     data = []
 
     char_name_tag = soup.find("span", class_="interior-sticky-nav__title__section", recursive=True)
@@ -171,8 +211,16 @@ def get_summary(url):
     Scrape the summary from a given URL
     """
 
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, "html.parser")
+    response = http_client.get(url)
+    return parsing.parse(parse_summary, response.content)
+
+
+def parse_summary(content):
+    """
+    Extract the summary from the content of the summary page
+    """
+
+    soup = parsing.make_soup(content, STRAINERS["summary"])
 
     if soup.find("div", class_="mainTextContent main-container"):
         main_content = soup.find("div", class_="mainTextContent main-container")
@@ -1,11 +1,35 @@
 import argparse
 import json
 import os
+from itertools import islice
 
 from src.utils.train_utils import load_unsloth_model
 from src.models.llama import base
-from src.utils.misc import (read_jsonl, truncate_text, segment_text, format_prompt, load_config, save_config,
-                            get_new_experiment_path, load_template)
+from src.utils.arrow_store import iter_split
+from src.utils.book_store import BookTexts
+from src.utils.book_tokens import token_cache_from_config
+from src.utils.misc import load_config, save_config, get_new_experiment_path, load_template
+from src.utils.eval_utils import length_batches, tree_merge
+from src.utils.prompt_tokens import PromptBuilder
+
+EVAL_COLUMNS = ["id", "book_id", "book", "character", "character_id", "input"]
+
+
+def generate(prompts_ids, model_func, tokenizer, model, generate_config, batch_size=1, max_batch_tokens=None,
+             max_new_tokens=0):
+    """
+    Generate the outputs of a list of prompt ids in length-sorted batches and return them in the order of the list.
+    """
+
+    outputs = [None] * len(prompts_ids)
+    lengths = [len(ids) + max_new_tokens for ids in prompts_ids]
+    for batch in length_batches(lengths, batch_size, max_batch_tokens):
+        batch_outputs = model_func.prompt_model_batch([prompts_ids[i] for i in batch], tokenizer, model,
+                                                      generate_config)
+        for i, output in zip(batch, batch_outputs):
+            outputs[i] = output
+
+    return outputs
 
 
 def main(config):
@@ -29,7 +53,17 @@ def main(config):
 
     prompt_template = load_template(eval_config["method"], task="description")
 
-    data = read_jsonl(os.path.join(data_config["data_path"], eval_config["split"] + ".jsonl"))
+    # characters of the same book share its text and token ids
+    book_texts = BookTexts(data_config.get("book_store_dir"))
+    token_cache = token_cache_from_config(tokenizer, data_config)
+    # the chat input ids are assembled from the cached book ids and the pre-tokenized template fragments
+    general_prompt_template = prompt_template[0] if eval_config["method"] == "hierarchical" else prompt_template
+    prompt_builder = PromptBuilder(tokenizer, general_prompt_template, token_cache)
+    if eval_config["method"] == "hierarchical":
+        merge_builder = PromptBuilder(tokenizer, prompt_template[1], token_cache, context_key="descriptions")
+
+    # only the columns used below are read from Arrow and Parquet splits
+    data = iter_split(data_config["data_path"], eval_config["split"], columns=EVAL_COLUMNS)
 
     predictions = []
 
@@ -37,57 +71,68 @@ def main(config):
     f = open(os.path.join(experiment_path, "preds.jsonl"), "a")
     save_config(config, os.path.join(experiment_path, "config.yaml"))
 
-    for i, sample in enumerate(data):
-        print(i)
+    # samples are read in buckets of bucket_size, whose prompts are sorted by length into batches
+    batch_kwargs = {"batch_size": eval_config["batch_size"], "max_batch_tokens": eval_config.get("max_batch_tokens"),
+                    "max_new_tokens": generate_config.get("max_new_tokens", 0)}
+    data = iter(data)
+    while True:
+        samples = list(islice(data, eval_config.get("bucket_size", 64)))
+        if not samples:
+            break
 
         if eval_config["method"] == "truncate":
 
-            truncated_context = truncate_text(sample["input"], tokenizer, max_length=eval_config["truncate_length"])
-
-            variables = {
-                "character": sample["character"],
-                "context": truncated_context
-            }
-
-            prompt = format_prompt(prompt_template, **variables)
+            prompts_ids = [prompt_builder.generation_ids(book_texts.input(sample),
+                                                         max_length=eval_config["truncate_length"],
+                                                         book_id=sample.get("book_id", sample.get("id")),
+                                                         character=sample["character"])
+                           for sample in samples]
 
-            output = model_func.prompt_model(prompt, tokenizer, model, generate_config)
-            print(output)
-            pred_data = {"book": sample["book"], "character": sample["character"], "output": output}
+            outputs = generate(prompts_ids, model_func, tokenizer, model, generate_config, **batch_kwargs)
+            samples_pred_data = [{"book": sample["book"], "character": sample["character"],
+                                  "character_id": sample.get("character_id"), "output": output}
+                                 for sample, output in zip(samples, outputs)]
 
         elif eval_config["method"] == "hierarchical":
-            general_prompt_template, merge_prompt_template = prompt_template
-            segments = segment_text(sample["input"], tokenizer, max_length=eval_config["truncate_length"])
-
-            outputs = []
-            for segment in segments:
-                variables = {
-                    "character": sample["character"],
-                    "context": segment
-                }
-                prompt = format_prompt(general_prompt_template, **variables)
-                output = model_func.prompt_model(prompt, tokenizer, model, generate_config)
-                outputs.append(output)
-
-            intermediate_descriptions = "\n\n".join(outputs)
-
-            variables = {
-                "character": sample["character"],
-                "descriptions": intermediate_descriptions
-            }
-
-            prompt = format_prompt(merge_prompt_template, **variables)
-            final_output = model_func.prompt_model(prompt, tokenizer, model, generate_config)
-            print(final_output)
-            pred_data = {"book": sample["book"], "character": sample["character"], "segmet_outputs": outputs,
-                         "output": final_output}
+            # with a segment_overlap, consecutive segments share the paragraphs of up to segment_overlap tokens at
+            # their boundary
+            samples_segment_ids = [
+                prompt_builder.segment_generation_ids(book_texts.input(sample),
+                                                      max_length=eval_config["truncate_length"],
+                                                      overlap=eval_config.get("segment_overlap", 0),
+                                                      book_id=sample.get("book_id", sample.get("id")),
+                                                      character=sample["character"])
+                for sample in samples]
+
+            # the segments of all samples of the bucket are generated together
+            segment_outputs = generate([ids for segment_ids in samples_segment_ids for ids in segment_ids],
+                                       model_func, tokenizer, model, generate_config, **batch_kwargs)
+            samples_outputs = []
+            for segment_ids in samples_segment_ids:
+                samples_outputs.append(segment_outputs[:len(segment_ids)])
+                segment_outputs = segment_outputs[len(segment_ids):]
+
+            # merged in rounds of merge prompts that fit in max_input_length, with the new tokens
+            final_outputs = tree_merge(samples_outputs, [sample["character"] for sample in samples], merge_builder,
+                                       eval_config["max_input_length"] - batch_kwargs["max_new_tokens"],
+                                       lambda prompts_ids: generate(prompts_ids, model_func, tokenizer, model,
+                                                                    generate_config, **batch_kwargs))
+            samples_pred_data = [{"book": sample["book"], "character": sample["character"],
+                                  "character_id": sample.get("character_id"), "segmet_outputs": outputs,
+                                  "output": final_output}
+                                 for sample, outputs, final_output in zip(samples, samples_outputs, final_outputs)]
         else:
             raise ValueError("Method not supported")
 
-        predictions.append(pred_data)
-
-        f.write(json.dumps(pred_data) + "\n")
+        # written in the order of the split, whatever the order of the batches
+        for pred_data in samples_pred_data:
+            print(pred_data["output"])
+            predictions.append(pred_data)
+            f.write(json.dumps(pred_data) + "\n")
         f.flush()
+        print(len(predictions))
+
+    print(f"Token cache: {token_cache.summary()}")
 
     return predictions
 
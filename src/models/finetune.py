@@ -2,102 +2,58 @@ import argparse
 import os
 
 import datasets
-import pandas as pd
 import wandb
 from tqdm.auto import tqdm
 from transformers import AutoTokenizer, TrainingArguments
 from trl import SFTTrainer
 from unsloth import FastLanguageModel, is_bfloat16_supported
 
-from src.utils.misc import load_config, truncate_text, format_prompt
+from src.utils.arrow_store import read_split
+from src.utils.book_store import BookTexts
+from src.utils.book_tokens import token_cache_from_config
+from src.utils.misc import load_config
+from src.utils.prompt_tokens import PromptBuilder
 from src.utils.train_utils import load_unsloth_model
 
 tqdm.pandas()
 
 
-def tokenize_example(train_config, tokenizer, text):
-    prompt, description = text
-
-    messages = [
-        {"role": "user", "content": prompt},
-        {"role": "assistant", "content": description}
-    ]
-
-    full_prompt = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True
-    )
-
-    tokenized_full_prompt = tokenizer(
-        full_prompt,
-        truncation=True,
-        max_length=train_config["max_input_length"],
-        padding=False,
-        return_tensors=None
-    )
-
-    input_ids = tokenized_full_prompt["input_ids"]
-
-    assistant_message = tokenizer.apply_chat_template(
-        [{"role": "assistant", "content": description}],
-        tokenize=False,
-        add_generation_prompt=True
-    )
-
-    tokenized_assistant = tokenizer(
-        assistant_message,
-        truncation=True,
-        max_length=train_config["max_input_length"],
-        padding=False,
-        return_tensors=None
-    )
-    assistant_ids = tokenized_assistant["input_ids"]
-
-    # Create labels, masking the non-assistant tokens with -100
-    labels = [-100] * (len(input_ids) - len(assistant_ids)) + assistant_ids
-    tokenized_full_prompt["labels"] = labels
-
+def generate_and_tokenize_prompt(train_config, data_point, prompt_builder, book_texts):
+    # the prompt is truncated to truncate_length tokens and the chat to max_input_length; the labels mask everything
+    # but the assistant message
+    #
     # code to test the masking
     # print(tokenizer.decode(trainer.train_dataset[0]["input_ids"]))
     # space = tokenizer(" ", add_special_tokens = False).input_ids[0]
     # print("\n---------------------------------------------------\n")
     # print(tokenizer.decode([space if x == -100 else x for x in trainer.train_dataset[0]["labels"]]))
-
-    return tokenized_full_prompt
-
-
-def generate_and_tokenize_prompt(train_config, tokenizer, data_point, prompt_template):
-    return tokenize_example(train_config, tokenizer,
-                            formatting_func(data_point, train_config, tokenizer, prompt_template))
-
-
-def formatting_func(example, train_config, tokenizer, prompt_template):
-    variables = {
-        "character": example["character"],
-        "context": example["input"]
-    }
-
-    input_text = format_prompt(prompt_template, **variables)
-
-    truncated_text = truncate_text(input_text, tokenizer, max_length=train_config["truncate_length"])
-
-    return truncated_text, example["description"]
+    return prompt_builder.training_example(book_texts.input(data_point), data_point["description"],
+                                           max_length=train_config["truncate_length"],
+                                           max_input_length=train_config["max_input_length"],
+                                           book_id=data_point.get("book_id", data_point.get("id")),
+                                           character=data_point["character"])
 
 
 def prepare_data(tokenizer, data_config, train_config):
-    train_df = pd.read_json(os.path.join(data_config['data_path'], "train.jsonl"), lines=True)
-    val_df = pd.read_json(os.path.join(data_config['data_path'], "val.jsonl"), lines=True)
+    # Arrow splits are memory-mapped and handed to datasets without a copy, with only the needed columns
+    columns = ["id", "book_id", "character", "input", "description"]
+    train_table = read_split(data_config['data_path'], "train", columns)
+    val_table = read_split(data_config['data_path'], "val", columns)
 
     prompt_template = open(data_config['prompt_path']).read()
+    token_cache = token_cache_from_config(tokenizer, data_config)
+    prompt_builder = PromptBuilder(tokenizer, prompt_template, token_cache)
+    # records of the full book dataset refer to their book, which is loaded once
+    book_texts = BookTexts(data_config.get("book_store_dir"))
 
-    train_dataset = datasets.Dataset.from_pandas(train_df)
-    val_dataset = datasets.Dataset.from_pandas(val_df)
+    train_dataset = datasets.Dataset(train_table)
+    val_dataset = datasets.Dataset(val_table)
 
     tokenized_train_dataset = train_dataset.map(
-        lambda x: generate_and_tokenize_prompt(train_config, tokenizer, x, prompt_template))
+        lambda x: generate_and_tokenize_prompt(train_config, x, prompt_builder, book_texts))
     tokenized_val_dataset = val_dataset.map(
-        lambda x: generate_and_tokenize_prompt(train_config, tokenizer, x, prompt_template))
+        lambda x: generate_and_tokenize_prompt(train_config, x, prompt_builder, book_texts))
+    print(f"Token cache: {token_cache.summary()}")
 
     return tokenized_train_dataset, tokenized_val_dataset
 
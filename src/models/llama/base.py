@@ -29,6 +29,31 @@ def prompt_model(prompt, tokenizer, model, generation_params):
     return output
 
 
+def prompt_model_batch(batch_input_ids, tokenizer, model, generation_params):
+    """
+    Generate for a batch of chat prompt ids at once. The prompts are left-padded, so that the new tokens of all of
+    them start at the same position, and the padding is masked out.
+    """
+
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    max_length = max(len(ids) for ids in batch_input_ids)
+
+    input_ids = torch.full((len(batch_input_ids), max_length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch_input_ids), max_length), dtype=torch.long)
+    for i, ids in enumerate(batch_input_ids):
+        input_ids[i, max_length - len(ids):] = torch.as_tensor(ids, dtype=torch.long)
+        attention_mask[i, max_length - len(ids):] = 1
+
+    terminators = [
+        tokenizer.eos_token_id,
+        tokenizer.convert_tokens_to_ids("<|eot_id|>")
+    ]
+
+    outputs = model.generate(input_ids.to(model.device), attention_mask=attention_mask.to(model.device),
+                             eos_token_id=terminators, pad_token_id=pad_token_id, **generation_params)
+    return tokenizer.batch_decode(outputs[:, max_length:], skip_special_tokens=True)
+
+
 if __name__ == "__main__":
 
     model_name = "meta-llama/Meta-Llama-3-8B-Instruct"
@@ -0,0 +1,134 @@
+import json
+import os
+
+from src.utils.jsonl_store import iter_jsonl
+from src.utils.misc import read_jsonl
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = {"jsonl": ".jsonl", "parquet": ".parquet", "arrow": ".arrow"}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Arrow and Parquet datasets require the pyarrow package")
+
+
+class TableWriter:
+    """
+    Write records to an Arrow IPC (.arrow) or Parquet (.parquet) file in record batches of batch_records records.
+    The schema is inferred from the first batch. The file is written under a temporary name and renamed on close.
+    """
+
+    def __init__(self, path, batch_records=1000):
+        _require_pyarrow()
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.batch_records = batch_records
+        self.buffer = []
+        self.schema = None
+        self.writer = None
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_records:
+            self._write_batch()
+
+    def _write_batch(self):
+        table = pa.Table.from_pylist(self.buffer, schema=self.schema)
+        if self.writer is None:
+            self.schema = table.schema
+            if self.path.endswith(".parquet"):
+                self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.tmp_path, self.schema)
+        self.writer.write_table(table)
+        self.buffer = []
+
+    def close(self):
+        if self.buffer or self.writer is None:
+            self._write_batch()
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class JsonlSplitWriter:
+    """
+    TableWriter counterpart for JSONL files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path + ".tmp", "w")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+def open_writer(path_without_extension, data_format="jsonl"):
+    path = path_without_extension + FORMATS[data_format]
+    if data_format == "jsonl":
+        return JsonlSplitWriter(path)
+    return TableWriter(path)
+
+
+def split_file(data_path, split):
+    """
+    Path of a split in data_path, preferring the columnar formats over JSONL.
+    """
+
+    for extension in [".arrow", ".parquet", ".jsonl"]:
+        path = os.path.join(data_path, split + extension)
+        if os.path.exists(path):
+            return path
+    return os.path.join(data_path, split + ".jsonl")
+
+
+def read_table(path, columns=None):
+    """
+    Read a dataset file as an Arrow table with only the given columns (those that exist in the file). Arrow IPC
+    files are memory-mapped without copying, Parquet files only decode the projected columns.
+    """
+
+    _require_pyarrow()
+
+    if path.endswith(".arrow"):
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    elif path.endswith(".parquet"):
+        names = pq.read_schema(path).names
+        return pq.read_table(path, columns=[c for c in columns if c in names] if columns else None,
+                             memory_map=True)
+    else:
+        table = pa.Table.from_pylist(read_jsonl(path))
+
+    if columns:
+        table = table.select([c for c in columns if c in table.column_names])
+    return table
+
+
+def read_split(data_path, split, columns=None):
+    return read_table(split_file(data_path, split), columns)
+
+
+def iter_records(table, batch_size=1000):
+    """
+    Yield the rows of an Arrow table as dicts, converting one record batch at a time.
+    """
+
+    for batch in table.to_batches(max_chunksize=batch_size):
+        yield from batch.to_pylist()
+
+
+def iter_split(data_path, split, columns=None):
+    path = split_file(data_path, split)
+    if path.endswith(".jsonl"):
+        return iter_jsonl(path)
+    return iter_records(read_table(path, columns))
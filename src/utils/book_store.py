@@ -0,0 +1,228 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+
+MAGIC = b"BKST"
+VERSION = 1
+HEADER = struct.Struct("<4sHII")
+BLOCK_SIZE = 64 * 1024
+
+
+def _to_bytes(values, typecode):
+    values = array(typecode, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(data, typecode):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def write_book(path, text, block_size=BLOCK_SIZE):
+    """
+    Store the paragraphs of text (separated by blank lines, as in truncate_text) in zlib-compressed blocks of about
+    block_size bytes, preceded by an index of the block and paragraph offsets. The file is written atomically.
+    """
+
+    paragraphs = [p.encode("utf-8") for p in text.split("\n\n")]
+
+    para_offsets = [0]
+    for p in paragraphs:
+        para_offsets.append(para_offsets[-1] + len(p))
+
+    # blocks hold whole paragraphs, so that reading a paragraph decompresses a single block
+    block_first = [0]
+    for i in range(1, len(paragraphs)):
+        if para_offsets[i] - para_offsets[block_first[-1]] >= block_size:
+            block_first.append(i)
+    block_first.append(len(paragraphs))
+
+    blocks = [zlib.compress(b"".join(paragraphs[block_first[b]:block_first[b + 1]]))
+              for b in range(len(block_first) - 1)]
+
+    index_size = HEADER.size + 8 * (len(blocks) + 1) + 4 * (len(blocks) + 1) + 8 * (len(paragraphs) + 1)
+    block_offsets = [index_size]
+    for block in blocks:
+        block_offsets.append(block_offsets[-1] + len(block))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(paragraphs), len(blocks)))
+        f.write(_to_bytes(block_offsets, "Q"))
+        f.write(_to_bytes(block_first, "I"))
+        f.write(_to_bytes(para_offsets, "Q"))
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+
+
+class BookReader:
+    """
+    Memory-mapped access to a book written by write_book. Only the blocks that hold the requested paragraphs are
+    read and decompressed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_paragraphs, num_blocks = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a book store file")
+
+        offset = HEADER.size
+        self.block_offsets = _from_bytes(self.mmap[offset:offset + 8 * (num_blocks + 1)], "Q")
+        offset += 8 * (num_blocks + 1)
+        self.block_first = _from_bytes(self.mmap[offset:offset + 4 * (num_blocks + 1)], "I")
+        offset += 4 * (num_blocks + 1)
+        self.para_offsets = _from_bytes(self.mmap[offset:offset + 8 * (num_paragraphs + 1)], "Q")
+
+        self.num_paragraphs = num_paragraphs
+        self.num_blocks = num_blocks
+
+    def __len__(self):
+        return self.num_paragraphs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _block_of(self, paragraph):
+        lo, hi = 0, self.num_blocks - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.block_first[mid] <= paragraph:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def _read_block(self, block):
+        return zlib.decompress(self.mmap[self.block_offsets[block]:self.block_offsets[block + 1]])
+
+    def iter_paragraphs(self, start=0, end=None):
+        """
+        Yield the paragraphs start to end lazily, decompressing one block at a time.
+        """
+
+        end = self.num_paragraphs if end is None else min(end, self.num_paragraphs)
+        if start >= end:
+            return
+
+        block = self._block_of(start)
+        while start < end:
+            data = self._read_block(block)
+            base = self.para_offsets[self.block_first[block]]
+            block_end = min(end, self.block_first[block + 1])
+            for i in range(start, block_end):
+                yield data[self.para_offsets[i] - base:self.para_offsets[i + 1] - base].decode("utf-8")
+            start = block_end
+            block += 1
+
+    def paragraphs(self, start=0, end=None):
+        return list(self.iter_paragraphs(start, end))
+
+    def first(self, n):
+        return self.paragraphs(0, n)
+
+    def text(self, start=0, end=None):
+        return "\n\n".join(self.iter_paragraphs(start, end))
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+class BookStore:
+    """
+    Directory of books written by write_book, one {book_id}.book file per book.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    def path(self, book_id):
+        return os.path.join(self.store_dir, f"{book_id}.book")
+
+    def __contains__(self, book_id):
+        return os.path.exists(self.path(book_id))
+
+    def add(self, book_id, text, block_size=BLOCK_SIZE):
+        write_book(self.path(book_id), text, block_size)
+
+    def open(self, book_id):
+        return BookReader(self.path(book_id))
+
+
+class BookTexts:
+    """
+    Resolve the book_id references of dataset records (see prepare_data.build_full_book) to the book texts of a
+    store, keeping one copy of each book in memory however many characters refer to it. Records with an inline
+    "input" are returned as they are.
+    """
+
+    def __init__(self, store_dir=None):
+        self.store = BookStore(store_dir) if store_dir is not None else None
+        self.lock = threading.Lock()
+        self.texts = {}
+
+    def get(self, book_id):
+        book_id = str(book_id)
+        with self.lock:
+            text = self.texts.get(book_id)
+        if text is None:
+            if self.store is None:
+                raise ValueError(f"Record refers to book {book_id}, but no book store is configured")
+            with self.store.open(book_id) as reader:
+                text = reader.text()
+            with self.lock:
+                text = self.texts.setdefault(book_id, text)
+        return text
+
+    def input(self, record):
+        if "input" in record and record["input"] is not None:
+            return record["input"]
+        return self.get(record["book_id"])
+
+
+def import_books(books_dir, store_dir, block_size=BLOCK_SIZE):
+    """
+    Add the book_cleaned.txt files downloaded by books.py ({books_dir}/{book_id}/book_cleaned.txt) to a store.
+    """
+
+    store = BookStore(store_dir)
+    added = 0
+    for book_id in sorted(os.listdir(books_dir)):
+        book_path = os.path.join(books_dir, book_id, "book_cleaned.txt")
+        if not os.path.exists(book_path) or book_id in store:
+            continue
+        with open(book_path, "rb") as f:
+            store.add(book_id, f.read().decode("utf-8", errors="replace"), block_size)
+        added += 1
+
+    return added
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build a compressed book store from downloaded books.")
+    parser.add_argument("--books_dir", required=True, help="Directory of the books downloaded by books.py.")
+    parser.add_argument("--store_dir", required=True, help="Directory of the book store.")
+    parser.add_argument("--block_size", type=int, default=BLOCK_SIZE, help="Uncompressed bytes per block.")
+    args = parser.parse_args()
+
+    print(f"Added {import_books(args.books_dir, args.store_dir, args.block_size)} books")
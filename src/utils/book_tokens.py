@@ -0,0 +1,398 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from src.utils.misc import segment_text, truncate_text
+
+SEPARATED = ".separated"
+
+
+def tokenizer_fingerprint(tokenizer):
+    """
+    Identify a tokenizer by its full serialised state (vocabulary, normaliser, special tokens), so that cached token
+    ids are never shared between tokenizers that encode differently.
+    """
+
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        state = backend.to_str()
+    else:
+        state = json.dumps([type(tokenizer).__name__, getattr(tokenizer, "name_or_path", None),
+                            len(tokenizer) if hasattr(tokenizer, "__len__") else None])
+    return hashlib.sha256(state.encode()).hexdigest()[:16]
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def truncate_count(offsets, max_length):
+    """
+    Number of leading paragraphs that fit in max_length tokens, given the prefix sums of their token lengths.
+    """
+
+    return int(np.searchsorted(offsets[1:], offsets[0] + max_length, side="right"))
+
+
+def segment_bounds(offsets, max_length):
+    """
+    (start, end) paragraph ranges of the segments built by segment_paragraphs, computed on the prefix sums of the
+    paragraph token lengths. As in segment_paragraphs, a first paragraph longer than max_length is preceded by an
+    empty segment and every other paragraph longer than max_length forms a segment of its own.
+    """
+
+    ends = offsets[1:]
+    num_paragraphs = len(ends)
+    bounds = []
+    start = 0
+    while start < num_paragraphs:
+        end = int(np.searchsorted(ends, offsets[start] + max_length, side="right"))
+        if end <= start:
+            if start == 0:
+                bounds.append((0, 0))
+            end = start + 1
+        bounds.append((start, end))
+        start = end
+
+    return bounds
+
+
+def window_bounds(offsets, max_length, overlap=0):
+    """
+    (start, end) paragraph ranges of windows of at most max_length tokens, each starting with the last paragraphs
+    of the previous window that fit in overlap tokens. Paragraphs longer than max_length are a window of their own.
+    With overlap=0 the windows are the segments of segment_bounds, without the leading empty segment.
+    """
+
+    ends = offsets[1:]
+    num_paragraphs = len(ends)
+    bounds = []
+    start = 0
+    while start < num_paragraphs:
+        end = max(start + 1, int(np.searchsorted(ends, offsets[start] + max_length, side="right")))
+        bounds.append((start, end))
+        if end == num_paragraphs:
+            break
+        # first paragraph from which the rest of the window fits in overlap tokens, but always move forward
+        start = max(start + 1, int(np.searchsorted(offsets[:end], offsets[end] - overlap, side="left")))
+
+    return bounds
+
+
+class BookTokens:
+    """
+    Token ids of the paragraphs of a book (text.split("\\n\\n")), as one flat array plus the paragraph boundaries
+    in it. The boundaries are the prefix sums of the paragraph lengths, so truncation and segmentation only search
+    in them. separated holds the (token_ids, offsets) of the paragraphs each followed by the separator, once
+    BookTokenCache.separated computed them.
+    """
+
+    def __init__(self, paragraphs, token_ids, offsets, digest=None):
+        self.paragraphs = paragraphs
+        self.token_ids = token_ids
+        self.offsets = offsets
+        self.digest = digest
+        self.separated = None
+
+    def __len__(self):
+        return len(self.paragraphs)
+
+    def num_tokens(self):
+        return len(self.token_ids) + (len(self.separated[0]) if self.separated is not None else 0)
+
+    def paragraph_ids(self, i):
+        return self.token_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def truncate_text(self, max_length=4096):
+        return "\n\n".join(self.paragraphs[:truncate_count(self.offsets, max_length)])
+
+    def segment_text(self, max_length=4096):
+        return ["\n\n".join(self.paragraphs[start:end]) for start, end in segment_bounds(self.offsets, max_length)]
+
+    def window_text(self, max_length=4096, overlap=0):
+        return ["\n\n".join(self.paragraphs[start:end])
+                for start, end in window_bounds(self.offsets, max_length, overlap)]
+
+
+class BookTokenCache:
+    """
+    Tokenize every text once per tokenizer. Books (get) are stored as token ids plus paragraph offsets, short texts
+    (encode) such as descriptions and prompt fragments as plain token ids. Both are keyed by the hash of the text,
+    so that the same text is shared across book ids, runs and scripts.
+
+    In memory, the most recently used books are kept up to max_memory_tokens tokens and the short texts up to
+    max_memory_texts entries. With cache_dir, entries are also stored under cache_dir/<tokenizer fingerprint>/:
+    books as .npy files that later runs memory-map, evicting the least recently used ones beyond max_disk_bytes,
+    and short texts in a SQLite table. stats counts the hits and the time spent tokenizing.
+    """
+
+    def __init__(self, tokenizer, cache_dir=None, max_memory_tokens=200_000_000, max_memory_texts=100_000,
+                 max_disk_bytes=None):
+        self.tokenizer = tokenizer
+        self.fingerprint = tokenizer_fingerprint(tokenizer)
+        self.cache_dir = os.path.join(cache_dir, self.fingerprint) if cache_dir is not None else None
+        self.max_memory_tokens = max_memory_tokens
+        self.max_memory_texts = max_memory_texts
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+        self.books = OrderedDict()
+        self.memory_tokens = 0
+        self.texts = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "tokenize_seconds": 0.0, "memory_evictions": 0,
+                      "disk_evictions": 0}
+
+        self.conn = None
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.conn = sqlite3.connect(os.path.join(self.cache_dir, "texts.sqlite"), check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            with self.conn:
+                self.conn.execute("CREATE TABLE IF NOT EXISTS texts (digest TEXT PRIMARY KEY, ids BLOB)")
+
+    def _count(self, stat, value=1):
+        with self.lock:
+            self.stats[stat] += value
+
+    def _paths(self, digest, suffix=""):
+        base = os.path.join(self.cache_dir, digest + suffix)
+        return base + ".ids.npy", base + ".offsets.npy"
+
+    def _load(self, digest, suffix=""):
+        ids_path, offsets_path = self._paths(digest, suffix)
+        # the offsets are written last and mark the arrays as complete
+        if not os.path.exists(offsets_path):
+            return None
+        for path in [ids_path, offsets_path]:
+            os.utime(path)
+        return np.load(ids_path, mmap_mode="r"), np.load(offsets_path, mmap_mode="r")
+
+    def _save(self, digest, token_ids, offsets, suffix=""):
+        for path, values in zip(self._paths(digest, suffix), [token_ids, offsets]):
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, values)
+            os.replace(path + ".tmp", path)
+        if self.max_disk_bytes is not None:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # books are evicted as a whole, least recently used (by modification time, see _load) first
+        books = {}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                size, used = books.get(name.split(".")[0], (0, 0))
+                books[name.split(".")[0]] = (size + stat.st_size, max(used, stat.st_mtime))
+
+        total = sum(size for size, _ in books.values())
+        for digest, (size, _) in sorted(books.items(), key=lambda item: item[1][1]):
+            if total <= self.max_disk_bytes:
+                break
+            for path in self._paths(digest) + self._paths(digest, SEPARATED):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
+            self._count("disk_evictions")
+
+    def _tokenize(self, paragraphs, add_special_tokens=True):
+        # a single batched call, which fast tokenizers encode in parallel; the ids of every paragraph are the ones
+        # of tokenizer.encode(p), special tokens included by default, so the lengths match those of truncate_text
+        start = time.perf_counter()
+        encoded = self.tokenizer(paragraphs, add_special_tokens=add_special_tokens)["input_ids"] \
+            if paragraphs else []
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in encoded], out=offsets[1:])
+        token_ids = np.fromiter((i for ids in encoded for i in ids), dtype=np.uint32, count=int(offsets[-1]))
+        self._count("tokenize_seconds", time.perf_counter() - start)
+        return token_ids, offsets
+
+    def get(self, text, book_id=None):
+        """
+        Return the BookTokens of text, tokenizing it only if it is not cached yet. book_id is not needed to find
+        the entry, which is keyed by the content of text.
+        """
+
+        digest = text_digest(text)
+
+        with self.lock:
+            book = self.books.get(digest)
+            if book is not None:
+                self.books.move_to_end(digest)
+                self.stats["memory_hits"] += 1
+                return book
+
+        paragraphs = text.split("\n\n")
+        arrays = self._load(digest) if self.cache_dir is not None else None
+        if arrays is not None:
+            self._count("disk_hits")
+        else:
+            self._count("misses")
+            arrays = self._tokenize(paragraphs)
+            if self.cache_dir is not None:
+                self._save(digest, *arrays)
+
+        book = BookTokens(paragraphs, *arrays, digest=digest)
+        with self.lock:
+            if digest not in self.books:
+                self.books[digest] = book
+                self.memory_tokens += book.num_tokens()
+            self._evict_memory()
+        return book
+
+    def _evict_memory(self):
+        # the book used last stays even if it alone exceeds the limit
+        while self.memory_tokens > self.max_memory_tokens and len(self.books) > 1:
+            _, evicted = self.books.popitem(last=False)
+            self.memory_tokens -= evicted.num_tokens()
+            self.stats["memory_evictions"] += 1
+
+    def separated(self, book):
+        """
+        Token ids of the paragraphs of the BookTokens book, each followed by the paragraph separator and without
+        special tokens, as (token_ids, offsets). A token that merges the end of a paragraph with the separator
+        (e.g. ".\n\n") is kept, unlike in the ids of the paragraphs alone. Tokenized on first use and cached with
+        the book.
+        """
+
+        if book.separated is not None:
+            return book.separated
+
+        arrays = self._load(book.digest, SEPARATED) if self.cache_dir is not None else None
+        if arrays is None:
+            arrays = self._tokenize([p + "\n\n" for p in book.paragraphs], add_special_tokens=False)
+            if self.cache_dir is not None:
+                self._save(book.digest, *arrays, suffix=SEPARATED)
+
+        with self.lock:
+            if book.separated is None:
+                book.separated = arrays
+                if self.books.get(book.digest) is book:
+                    self.memory_tokens += len(arrays[0])
+                    self._evict_memory()
+        return book.separated
+
+    def encode(self, text):
+        """
+        Memoised tokenizer.encode(text, add_special_tokens=False), as a list of ids.
+        """
+
+        digest = text_digest(text)
+
+        with self.lock:
+            ids = self.texts.get(digest)
+            if ids is not None:
+                self.texts.move_to_end(digest)
+                self.stats["memory_hits"] += 1
+                return ids
+
+        row = None
+        if self.conn is not None:
+            with self.lock:
+                row = self.conn.execute("SELECT ids FROM texts WHERE digest = ?", (digest,)).fetchone()
+
+        if row is not None:
+            self._count("disk_hits")
+            ids = np.frombuffer(row[0], dtype=np.uint32).tolist()
+        else:
+            self._count("misses")
+            start = time.perf_counter()
+            ids = self.tokenizer.encode(text, add_special_tokens=False)
+            self._count("tokenize_seconds", time.perf_counter() - start)
+            if self.conn is not None:
+                with self.lock:
+                    with self.conn:
+                        self.conn.execute("INSERT OR REPLACE INTO texts VALUES (?, ?)",
+                                          (digest, np.array(ids, dtype=np.uint32).tobytes()))
+
+        with self.lock:
+            self.texts[digest] = ids
+            while len(self.texts) > self.max_memory_texts:
+                self.texts.popitem(last=False)
+                self.stats["memory_evictions"] += 1
+        return ids
+
+    def summary(self):
+        """
+        The stats with the hit rate of the memory and disk caches.
+        """
+
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+    def truncate_text(self, text, max_length=4096, book_id=None):
+        return self.get(text, book_id).truncate_text(max_length)
+
+    def segment_text(self, text, max_length=4096, book_id=None):
+        return self.get(text, book_id).segment_text(max_length)
+
+    def window_text(self, text, max_length=4096, overlap=0, book_id=None):
+        return self.get(text, book_id).window_text(max_length, overlap)
+
+def token_cache_from_config(tokenizer, data_config):
+    max_gb = data_config.get("token_cache_max_gb")
+    return BookTokenCache(tokenizer, data_config.get("token_cache_dir"),
+                          max_disk_bytes=int(max_gb * 2 ** 30) if max_gb is not None else None)
+
+
+def benchmark(tokenizer, texts, max_length=4096):
+    """
+    Time truncate_text and segment_text of utils.misc against the BookTokenCache on the same texts, checking that
+    the outputs are identical.
+    """
+
+    start = time.perf_counter()
+    expected = [(truncate_text(text, tokenizer, max_length), segment_text(text, tokenizer, max_length))
+                for text in texts]
+    paragraph_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cache = BookTokenCache(tokenizer)
+    books = [cache.get(text) for text in texts]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    outputs = [(book.truncate_text(max_length), book.segment_text(max_length)) for book in books]
+    search_time = time.perf_counter() - start
+
+    if outputs != expected:
+        raise AssertionError("BookTokenCache output differs from utils.misc")
+
+    return {"books": len(texts), "paragraph_encode": paragraph_time, "batched_encode": encode_time,
+            "search": search_time, "speedup": paragraph_time / (encode_time + search_time)}
+
+
+if __name__ == "__main__":
+
+    from transformers import AutoTokenizer
+
+    from src.utils.book_store import BookStore
+
+    parser = argparse.ArgumentParser(description="Benchmark the truncation and segmentation of full books.")
+    parser.add_argument("--tokenizer", required=True, help="Name or path of the tokenizer.")
+    parser.add_argument("--store_dir", required=True, help="Directory of the book store.")
+    parser.add_argument("--num_books", type=int, default=10, help="Number of books to benchmark on.")
+    parser.add_argument("--max_length", type=int, default=7600, help="Truncation and segment length in tokens.")
+    args = parser.parse_args()
+
+    store = BookStore(args.store_dir)
+    book_ids = sorted(f[:-len(".book")] for f in os.listdir(args.store_dir) if f.endswith(".book"))
+    texts = []
+    for book_id in book_ids[:args.num_books]:
+        with store.open(book_id) as reader:
+            texts.append(reader.text())
+
+    results = benchmark(AutoTokenizer.from_pretrained(args.tokenizer), texts, args.max_length)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import re
+import sqlite3
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+TITLES = {"mr", "mrs", "miss", "ms", "dr", "sir", "lady", "lord", "madame", "monsieur", "mme", "mlle", "captain",
+          "father", "mother", "uncle", "aunt", "king", "queen", "prince", "princess", "count", "countess", "the"}
+MALE_TITLES = {"mr", "sir", "lord", "monsieur", "father", "uncle", "king", "prince", "count"}
+FEMALE_TITLES = {"mrs", "miss", "ms", "lady", "madame", "mme", "mlle", "mother", "aunt", "queen", "princess",
+                 "countess"}
+TRIGRAM_DIM = 2048
+
+
+def normalize_name(name):
+    return " ".join(re.findall(r"\w+", name.lower()))
+
+
+def name_tokens(name):
+    """
+    Tokens of a normalised name without titles, which are used for blocking.
+    """
+
+    return {token for token in name.split() if token not in TITLES}
+
+
+def _gender(name):
+    tokens = set(name.split())
+    return ("m" if tokens & MALE_TITLES else "") + ("f" if tokens & FEMALE_TITLES else "")
+
+
+def trigram_vectors(names):
+    """
+    L2-normalised hashed character trigram counts of the names, one row per name.
+    """
+
+    vectors = np.zeros((len(names), TRIGRAM_DIM), dtype=np.float32)
+    for i, name in enumerate(names):
+        padded = f"  {name} "
+        for j in range(len(padded) - 2):
+            vectors[i, zlib.crc32(padded[j:j + 3].encode("utf-8")) % TRIGRAM_DIM] += 1
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+
+def score_pairs(names, pairs):
+    """
+    Similarity of the candidate name pairs: the mean of the trigram cosine similarity and the containment of the
+    shorter name's tokens in the longer one's, computed for all pairs at once.
+    """
+
+    if not pairs:
+        return np.empty(0, dtype=np.float32)
+
+    left, right = np.array(pairs).T
+    vectors = trigram_vectors(names)
+    cosine = np.einsum("ij,ij->i", vectors[left], vectors[right])
+
+    tokens = [name_tokens(name) for name in names]
+    containment = np.array([len(tokens[i] & tokens[j]) / max(1, min(len(tokens[i]), len(tokens[j])))
+                            for i, j in pairs], dtype=np.float32)
+    return (cosine + containment) / 2
+
+
+def align_book(mentions, threshold=0.6):
+    """
+    Cluster the (name, source) mentions of the characters of one book. Candidate pairs share a name token, come
+    from different sources (unless they are the same name) and have no conflicting gendered titles; they are merged
+    from the most to the least similar as long as no cluster ends up with two different names from the same source.
+    Returns a list of clusters, each a list of mention indices.
+    """
+
+    names = [normalize_name(name) for name, _ in mentions]
+
+    blocks = defaultdict(list)
+    for i, name in enumerate(names):
+        for token in name_tokens(name) or {name}:
+            blocks[token].append(i)
+
+    pairs = set()
+    for members in blocks.values():
+        for a in range(len(members)):
+            for b in range(a + 1, len(members)):
+                i, j = members[a], members[b]
+                if mentions[i][1] == mentions[j][1] and names[i] != names[j]:
+                    continue
+                if set(_gender(names[i]) + _gender(names[j])) == {"m", "f"}:
+                    continue
+                pairs.add((min(i, j), max(i, j)))
+    pairs = sorted(pairs)
+    scores = score_pairs(names, pairs)
+
+    parents = list(range(len(mentions)))
+    sources = [{mentions[i][1]: names[i]} for i in range(len(mentions))]
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for k in np.argsort(-scores, kind="stable"):
+        if scores[k] < threshold:
+            break
+        root_i, root_j = find(pairs[k][0]), find(pairs[k][1])
+        if root_i == root_j:
+            continue
+        if any(sources[root_j].get(source, name) != name for source, name in sources[root_i].items()):
+            continue
+        parents[root_j] = root_i
+        sources[root_i].update(sources[root_j])
+
+    clusters = defaultdict(list)
+    for i in range(len(mentions)):
+        clusters[find(i)].append(i)
+    return list(clusters.values())
+
+
+def character_id(book_id, name):
+    """
+    Id of a character from its book and canonical name, so that it does not change when other characters of the
+    book are added or removed.
+    """
+
+    digest = hashlib.sha256(f"{book_id}\x00{normalize_name(name)}".encode("utf-8")).hexdigest()[:12]
+    return f"{book_id}-{digest}"
+
+
+def align_characters(mentions, threshold=0.6):
+    """
+    Build the canonical character table from (book_id, character name, source) mentions. Names are only compared
+    within the same book. Returns a list of {character_id, book_id, name, aliases, sources} dicts; two characters of
+    a book with the same canonical name get the suffixes -2, -3, ... in the order of their first mention.
+    """
+
+    by_book = defaultdict(set)
+    for book_id, name, source in mentions:
+        by_book[book_id].add((name, source))
+
+    characters = []
+    for book_id in sorted(by_book):
+        book_mentions = sorted(by_book[book_id])
+        ids = defaultdict(int)
+        for cluster in sorted(align_book(book_mentions, threshold), key=min):
+            aliases = sorted({book_mentions[i][0] for i in cluster})
+            name = max(aliases, key=len)
+            base_id = character_id(book_id, name)
+            ids[base_id] += 1
+            characters.append({
+                "character_id": base_id if ids[base_id] == 1 else f"{base_id}-{ids[base_id]}",
+                "book_id": book_id,
+                "name": name,
+                "aliases": aliases,
+                "sources": sorted({book_mentions[i][1] for i in cluster}),
+            })
+
+    return characters
+
+
+def write_character_table(characters, path):
+    """
+    Store the character table in SQLite with the aliases indexed by (book_id, normalised alias).
+    """
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS characters")
+        conn.execute("DROP TABLE IF EXISTS aliases")
+        conn.execute("CREATE TABLE characters (character_id TEXT PRIMARY KEY, book_id INTEGER, name TEXT, "
+                     "aliases TEXT, sources TEXT)")
+        conn.execute("CREATE TABLE aliases (book_id INTEGER, alias TEXT, character_id TEXT, "
+                     "PRIMARY KEY (book_id, alias))")
+        for c in characters:
+            conn.execute("INSERT INTO characters VALUES (?, ?, ?, ?, ?)",
+                         (c["character_id"], int(c["book_id"]), c["name"], json.dumps(c["aliases"]),
+                          json.dumps(c["sources"])))
+            conn.executemany("INSERT OR IGNORE INTO aliases VALUES (?, ?, ?)",
+                             [(int(c["book_id"]), normalize_name(alias), c["character_id"])
+                              for alias in c["aliases"]])
+    conn.close()
+
+
+class CharacterTable:
+    """
+    Lookup of the canonical character id of a (book_id, character name) pair in a table written by
+    write_character_table.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+    def lookup(self, book_id, name):
+        row = self.conn.execute("SELECT character_id FROM aliases WHERE book_id = ? AND alias = ?",
+                                (int(book_id), normalize_name(name))).fetchone()
+        return row[0] if row else None
+
+    def get(self, character_id):
+        row = self.conn.execute("SELECT character_id, book_id, name, aliases, sources FROM characters "
+                                "WHERE character_id = ?", (character_id,)).fetchone()
+        if row is None:
+            return None
+        return {"character_id": row[0], "book_id": row[1], "name": row[2], "aliases": json.loads(row[3]),
+                "sources": json.loads(row[4])}
+
+    def close(self):
+        self.conn.close()
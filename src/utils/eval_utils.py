@@ -0,0 +1,110 @@
+def length_batches(lengths, batch_size=1, max_batch_tokens=None):
+    """
+    Group the indices of prompts of the given lengths into batches of at most batch_size prompts, from the longest
+    to the shortest prompt so that the prompts of a batch need little padding. With max_batch_tokens, a batch also
+    holds at most max_batch_tokens tokens, counting every prompt at the length of the longest one.
+    """
+
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches, batch = [], []
+    for i in order:
+        # the first prompt of a batch is its longest
+        if batch and (len(batch) == batch_size or
+                      (max_batch_tokens is not None and (len(batch) + 1) * lengths[batch[0]] > max_batch_tokens)):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def merge_groups(lengths, max_length, separator_length=0):
+    """
+    Split consecutive texts of the given token lengths into groups whose lengths, joined by separators, fit in
+    max_length tokens. Every group but the last holds at least two texts, so that a merge round reduces the number
+    of texts; any two texts must therefore fit together (see merge_limit).
+    """
+
+    if any(length > merge_limit(max_length, separator_length) for length in lengths):
+        raise ValueError(f"Texts must be at most {merge_limit(max_length, separator_length)} tokens long to be merged "
+                         f"in {max_length} tokens")
+
+    groups, group, group_length = [], [], 0
+    for i, length in enumerate(lengths):
+        if len(group) >= 2 and group_length + separator_length + length > max_length:
+            groups.append(group)
+            group, group_length = [], 0
+        group_length += length + (separator_length if group else 0)
+        group.append(i)
+    if group:
+        groups.append(group)
+
+    return groups
+
+
+def merge_limit(max_length, separator_length=0):
+    """
+    Maximum token length of texts of which any two fit together in max_length tokens.
+    """
+
+    return (max_length - separator_length) // 2
+
+
+def truncate_tokens(text, token_cache, max_length):
+    """
+    Longest lead of text, cut at a token, that is at most max_length tokens long.
+    """
+
+    ids = token_cache.encode(text)
+    if len(ids) <= max_length:
+        return text
+    # decoding and encoding again can change the tokens at the cut, which then moves back
+    for cut in range(max_length, 0, -1):
+        lead = token_cache.tokenizer.decode(ids[:cut])
+        if len(token_cache.encode(lead)) <= max_length:
+            return lead
+    return ""
+
+
+def tree_merge(samples_outputs, characters, merge_builder, max_length, generate_fn):
+    """
+    Reduce the segment outputs of every sample to a single description. The outputs are split into groups whose
+    merge prompt fits in max_length tokens, each group is merged, and the merged descriptions are merged again
+    until a single group is left, whose merge is the final description. The merges of one round of all samples
+    are generated together with generate_fn, so the number of rounds grows with the logarithm of the number of
+    segments. Descriptions longer than half of the budget of a merge prompt are truncated, so that every group
+    fits in max_length tokens.
+    """
+
+    descriptions = [list(outputs) for outputs in samples_outputs]
+    final_outputs = [None] * len(descriptions)
+    separator_length = len(merge_builder.separator_ids)
+
+    while any(output is None for output in final_outputs):
+        prompts_ids, owners = [], []
+        for k, character in enumerate(characters):
+            if final_outputs[k] is not None:
+                continue
+            budget = max_length - merge_builder.generation_overhead(character=character)
+            limit = merge_limit(budget, separator_length)
+            descriptions[k] = [truncate_tokens(d, merge_builder.token_cache, limit) for d in descriptions[k]]
+            lengths = [len(merge_builder.token_cache.encode(d)) for d in descriptions[k]]
+            groups = merge_groups(lengths, budget, separator_length)
+            if not groups:
+                final_outputs[k] = ""
+                continue
+            for group in groups:
+                prompts_ids.append(merge_builder.texts_generation_ids([descriptions[k][i] for i in group],
+                                                                      character=character))
+                owners.append((k, len(groups) == 1))
+            descriptions[k] = []
+
+        for (k, final), output in zip(owners, generate_fn(prompts_ids)):
+            if final:
+                final_outputs[k] = output
+            else:
+                descriptions[k].append(output)
+
+    return final_outputs
@@ -0,0 +1,339 @@
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.utils.pipeline import StageMetrics
+from src.utils.response_cache import CacheMissError
+
+try:
+    import brotli  # noqa: F401  enables "br" decoding in urllib3
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_client = None
+_page_pool = None
+_local = threading.local()
+_page_graph = contextvars.ContextVar("page_graph", default=None)
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised when a host failed too many times in a row and is temporarily skipped."""
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the request rate towards a single host.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker. After failure_threshold consecutive failed requests (urls that used up all their
+    retries) the host is skipped for reset_timeout seconds. The circuit is then half-open: exactly one trial request
+    is let through, and the others are skipped until its success closes the circuit or its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.half_open = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.half_open:
+                return False
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.half_open = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.half_open = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.half_open or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.half_open = False
+
+
+def cache_url(url, params=None):
+    """
+    Key of a request in the response cache: the url with the query parameters in sorted order.
+    """
+
+    if not params:
+        return url
+    params = sorted(params.items()) if isinstance(params, dict) else sorted(params)
+    return requests.Request("GET", url, params=params).prepare().url
+
+
+class HttpClient:
+    """
+    Pooled HTTP client shared by the scrapers. It keeps connections alive, limits the number of in-flight requests
+    and the per-host request rate, and retries each URL on its own with jittered exponential backoff. If a
+    ResponseCache is given, cached responses are served without touching the network, and 2xx responses are stored.
+    """
+
+    def __init__(self, max_concurrency=8, requests_per_second=4.0, burst=None, max_retries=4, backoff_base=2.0,
+                 backoff_max=60.0, timeout=60, failure_threshold=10, reset_timeout=60, cache=None):
+        self.requests_per_second = requests_per_second
+        self.burst = burst or max(1, int(requests_per_second or 1))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.cache = cache
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+        self.fetch_stage = StageMetrics("fetch", max_concurrency)
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.breakers = {}
+
+    def _host_state(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                if self.requests_per_second:
+                    self.buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+            return self.buckets.get(host), self.breakers[host]
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _retry_after(self, response):
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(self.backoff_max, max(0.0, delay))
+
+    def get(self, url, **kwargs):
+        """
+        GET the url, retrying connection errors and 429/5xx responses. If every attempt returns an error status,
+        the last response is returned so that callers can inspect it.
+        """
+
+        key = cache_url(url, kwargs.get("params"))
+        if self.cache is not None:
+            cached = self.cache.lookup(key)
+            if cached is not None:
+                return cached
+            if self.cache.replay:
+                raise CacheMissError(f"{key} is not in the response cache")
+
+        bucket, breaker = self._host_state(urlsplit(url).netloc)
+        kwargs.setdefault("timeout", self.timeout)
+
+        # the breaker is asked once per url, so that the retries of a half-open trial request are let through
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}, skipping {url}")
+
+        response, error = None, None
+        succeeded = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                if bucket is not None:
+                    bucket.acquire()
+
+                try:
+                    with self.fetch_stage.slot():
+                        response = self.session.get(url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                    error = e
+                    delay = self._backoff(attempt)
+                else:
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        succeeded = True
+                        breaker.record_success()
+                        # error pages (403, 404, ...) are not cached, so a later run fetches them again
+                        if self.cache is not None and 200 <= response.status_code < 300:
+                            self.cache.store(key, response)
+                        return response
+                    delay = self._retry_after(response)
+                    if delay is None:
+                        delay = self._backoff(attempt)
+
+                if attempt < self.max_retries:
+                    time.sleep(delay)
+        finally:
+            # one failure per url, however many attempts it took, so that a single bad url does not open the
+            # circuit for the other urls of the host; an unexpected error also ends a half-open trial
+            if not succeeded:
+                breaker.record_failure()
+
+        if response is not None:
+            return response
+        raise error
+
+
+class PageGraph:
+    """
+    The pages requested while crawling one book, keyed by url. Every url is fetched at most once, even when several
+    extractors or page workers ask for it at the same time.
+    """
+
+    def __init__(self):
+        self.pages = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.url_locks = {}
+
+    def get(self, url, fetch):
+        with self.lock:
+            self.requests += 1
+            if url in self.pages:
+                return self.pages[url]
+            url_lock = self.url_locks.setdefault(url, threading.Lock())
+
+        with url_lock:
+            with self.lock:
+                if url in self.pages:
+                    return self.pages[url]
+
+            response = fetch(url)
+
+            # failed pages are fetched again when the book is retried
+            if response.status_code not in RETRY_STATUS_CODES:
+                with self.lock:
+                    self.pages[url] = response
+            return response
+
+    @property
+    def fetched(self):
+        return len(self.pages)
+
+
+@contextmanager
+def page_scope(graph=None):
+    """
+    Within this scope, and in the page workers it starts, every url is fetched at most once.
+    """
+
+    graph = graph if graph is not None else PageGraph()
+    token = _page_graph.set(graph)
+    try:
+        yield graph
+    finally:
+        _page_graph.reset(token)
+
+
+def configure(page_workers=1, **client_kwargs):
+    """
+    Install a new default client built from client_kwargs and set the number of workers used to fetch the pages
+    of a single book.
+    """
+    global _page_pool
+
+    set_client(HttpClient(**client_kwargs))
+
+    with _lock:
+        if _page_pool is not None:
+            _page_pool.shutdown(wait=False)
+        _page_pool = ThreadPoolExecutor(max_workers=page_workers, thread_name_prefix="page") \
+            if page_workers > 1 else None
+
+
+def set_client(client):
+    global _client
+
+    with _lock:
+        _client = client
+
+
+def get_client():
+    global _client
+
+    with _lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def get(url, **kwargs):
+    """
+    Drop-in replacement of requests.get that goes through the default client.
+    """
+
+    graph = _page_graph.get()
+    if graph is not None and not kwargs:
+        return graph.get(url, get_client().get)
+
+    return get_client().get(url, **kwargs)
+
+
+def _run_page_task(func, item):
+    _local.in_page_worker = True
+    try:
+        return func(item)
+    finally:
+        _local.in_page_worker = False
+
+
+def map_pages(func, items):
+    """
+    Apply func to every item (usually the character pages of a book) using the page workers. Results keep the
+    order of items. Calls made from inside a page worker run serially to avoid exhausting the pool.
+    """
+
+    items = list(items)
+    if _page_pool is None or len(items) <= 1 or getattr(_local, "in_page_worker", False):
+        return [func(item) for item in items]
+
+    # every task runs in a copy of the caller's context so that the page scope is shared with the workers
+    contexts = [contextvars.copy_context() for _ in items]
+    return list(_page_pool.map(lambda args: args[0].run(_run_page_task, func, args[1]), zip(contexts, items)))
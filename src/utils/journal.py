@@ -0,0 +1,143 @@
+import contextvars
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+_journal = None
+_journal_lock = threading.Lock()
+_scope = contextvars.ContextVar("journal_scope", default=None)
+
+
+class Journal:
+    """
+    Transactional scraping journal stored in SQLite (WAL mode). It records the status of every book and the
+    records extracted from every fetched page, so that an interrupted run resumes at the exact character page.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS books ("
+                "url TEXT, data_type TEXT, book_id INTEGER, title TEXT, status TEXT, attempts INTEGER DEFAULT 0, "
+                "error TEXT, updated REAL, PRIMARY KEY (url, data_type))")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "book_url TEXT, data_type TEXT, url TEXT, status TEXT, records TEXT, error TEXT, updated REAL, "
+                "PRIMARY KEY (book_url, data_type, url))")
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            with self.conn:
+                return self.conn.execute(sql, params).fetchall()
+
+    def set_book_status(self, book_id, title, url, data_type, status, error=None):
+        self._execute(
+            "INSERT INTO books (url, data_type, book_id, title, status, attempts, error, updated) "
+            "VALUES (?, ?, ?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT (url, data_type) DO UPDATE SET status = excluded.status, error = excluded.error, "
+            "attempts = books.attempts + 1, updated = excluded.updated",
+            (url, data_type, int(book_id), title, status, error, time.time()))
+
+    def book_statuses(self, data_type):
+        rows = self._execute("SELECT url, status FROM books WHERE data_type = ?", (data_type,))
+        return dict(rows)
+
+    def done_books(self):
+        """
+        (url, title) of the books that are done for at least one data type.
+        """
+
+        return self._execute("SELECT url, MIN(title) FROM books WHERE status = 'done' GROUP BY url")
+
+    def get_page(self, book_url, data_type, url):
+        """
+        Return the records extracted from a page that was already scraped successfully, otherwise None.
+        """
+
+        rows = self._execute(
+            "SELECT records FROM pages WHERE book_url = ? AND data_type = ? AND url = ? AND status = 'done'",
+            (book_url, data_type, url))
+        return json.loads(rows[0][0]) if rows else None
+
+    def set_page(self, book_url, data_type, url, status, records=None, error=None):
+        self._execute(
+            "INSERT OR REPLACE INTO pages (book_url, data_type, url, status, records, error, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (book_url, data_type, url, status, json.dumps(records), error, time.time()))
+
+    def summary(self):
+        """
+        Count books and pages per data type and status.
+        """
+
+        books = self._execute("SELECT data_type, status, COUNT(*) FROM books GROUP BY data_type, status")
+        pages = self._execute("SELECT data_type, status, COUNT(*) FROM pages GROUP BY data_type, status")
+        return books, pages
+
+    def failures(self, limit=None):
+        sql = ("SELECT 'book', data_type, url, error FROM books WHERE status = 'failed' UNION ALL "
+               "SELECT 'page', data_type, url, error FROM pages WHERE status = 'failed' ORDER BY 2, 3")
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return self._execute(sql)
+
+    def close(self):
+        self.conn.close()
+
+
+def set_journal(journal):
+    global _journal
+
+    with _journal_lock:
+        _journal = journal
+
+
+def get_journal():
+    with _journal_lock:
+        return _journal
+
+
+@contextmanager
+def scope(book_url, data_type):
+    """
+    Pages checkpointed within this scope, and in the page workers it starts, belong to the given book and data type.
+    """
+
+    token = _scope.set((book_url, data_type))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def checkpoint(url, func, *args, **kwargs):
+    """
+    Return the records of url from the journal if it was already scraped, otherwise call func and journal its result.
+    Empty results and failures are journaled too but scraped again on the next run.
+    """
+
+    journal, current_scope = get_journal(), _scope.get()
+    if journal is None or current_scope is None:
+        return func(*args, **kwargs)
+
+    book_url, data_type = current_scope
+    records = journal.get_page(book_url, data_type, url)
+    if records is not None:
+        return records
+
+    try:
+        records = func(*args, **kwargs)
+    except Exception as e:
+        journal.set_page(book_url, data_type, url, "failed", error=repr(e))
+        raise
+
+    journal.set_page(book_url, data_type, url, "done" if records else "empty", records)
+    return records
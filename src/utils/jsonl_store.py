@@ -0,0 +1,318 @@
+import glob
+import io
+import json
+import mmap
+import os
+import re
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SHARD_PATTERN = re.compile(r"-(\d{5})\.jsonl(\.zst)?$")
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+CHUNK_SIZE = 1 << 20
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstd compressed JSONL files require the zstandard package")
+
+
+def _shard_base(path):
+    return path[:-len(".jsonl")] if path.endswith(".jsonl") else path
+
+
+def list_shards(path):
+    """
+    Return the completed shards of the JSONL file path (e.g. data-00000.jsonl.zst for data.jsonl) in order.
+    A shard is completed once its .done marker exists.
+    """
+
+    candidates = glob.glob(glob.escape(_shard_base(path)) + "-[0-9][0-9][0-9][0-9][0-9].jsonl*")
+    shards = [p for p in candidates if SHARD_PATTERN.search(p) and os.path.exists(p + ".done")]
+    return sorted(shards, key=lambda p: int(SHARD_PATTERN.search(p).group(1)))
+
+
+def _decode_frame(data, start):
+    """
+    Decompress the zstd frame that starts at offset start of data (bytes or an mmap). Return (end, content), or None
+    if the frame is damaged or cut short. The input is fed in chunks, so the rest of data is never copied.
+    """
+
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    content = []
+    position = start
+    with memoryview(data) as view:
+        try:
+            while not decompressor.eof and position < len(data):
+                chunk = view[position:position + CHUNK_SIZE]
+                content.append(decompressor.decompress(chunk))
+                position += len(chunk)
+        except zstandard.ZstdError:
+            return None
+    if not decompressor.eof:
+        return None
+    return position - len(decompressor.unused_data), b"".join(content)
+
+
+def _zstd_frames(data):
+    """
+    Yield (start, end, content) for the complete zstd frames of data. A frame that cannot be decompressed, e.g. one
+    cut short by a crash and followed by frames appended later, is skipped up to the next frame header.
+    """
+
+    start = data.find(ZSTD_MAGIC)
+    while start != -1:
+        frame = _decode_frame(data, start)
+        if frame is not None:
+            end, content = frame
+            yield start, end, content
+            start = data.find(ZSTD_MAGIC, end)
+        else:
+            start = data.find(ZSTD_MAGIC, start + 1)
+
+
+def _last_frame_end(data):
+    """
+    End of the last complete zstd frame of data, or 0. The frame headers are tried from the end, so only the tail of
+    data is decompressed.
+    """
+
+    start = data.rfind(ZSTD_MAGIC)
+    while start != -1:
+        frame = _decode_frame(data, start)
+        if frame is not None:
+            return frame[0]
+        start = data.rfind(ZSTD_MAGIC, 0, start)
+    return 0
+
+
+def _last_line_end(f):
+    # end of the last newline of the binary file f, read backwards in chunks
+    position = f.seek(0, os.SEEK_END)
+    while position > 0:
+        size = min(CHUNK_SIZE, position)
+        f.seek(position - size)
+        newline = f.read(size).rfind(b"\n")
+        if newline != -1:
+            return position - size + newline + 1
+        position -= size
+    return 0
+
+
+def _read_lines(path, compressed=None):
+    """
+    Yield the complete lines of a plain or zstd compressed file (by default, if path ends with .zst). A truncated
+    last line, or a truncated frame, left by a crash is skipped. Compressed files are memory-mapped and decompressed
+    one frame at a time.
+    """
+
+    if compressed is None:
+        compressed = path.endswith(".zst")
+
+    if compressed:
+        _require_zstandard()
+        if os.path.getsize(path) == 0:
+            return
+        with open(path, "rb") as raw, mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for _, _, content in _zstd_frames(data):
+                for line in io.BytesIO(content):
+                    if line.endswith(b"\n"):
+                        yield line
+    else:
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                yield line
+
+
+def iter_jsonl(path):
+    """
+    Iterate the records of a JSONL dataset, which may be a single plain or .zst file or a set of completed shards
+    written by JsonlWriter.
+    """
+
+    paths = [p for p in [path, path + ".zst"] if os.path.exists(p)] + list_shards(path)
+    if not paths:
+        raise FileNotFoundError(f"No JSONL file or shards found for {path}")
+
+    for p in paths:
+        for line in _read_lines(p):
+            if line.strip():
+                yield json.loads(line)
+
+
+class JsonlWriter:
+    """
+    Batched, crash-safe JSONL writer. Records are buffered and written when flush_records records are pending or
+    flush_seconds have passed, optionally followed by an fsync. Callbacks passed to write are called once their
+    records have been written, e.g. to mark a book as done only when its records are on disk.
+
+    With shard_records, the output rotates into numbered shards next to path (data-00000.jsonl, ...). The shard
+    being written has a .partial suffix and is renamed and given a .done marker once it is complete. compression
+    "zstd" compresses every flushed batch as an independent zstd frame, so that a crash loses at most the frame being
+    written.
+    """
+
+    def __init__(self, path, flush_records=100, flush_seconds=5.0, fsync=False, shard_records=None,
+                 compression=None):
+        if compression not in [None, "zstd"]:
+            raise ValueError(f"Unsupported compression: {compression}")
+        if compression == "zstd":
+            _require_zstandard()
+
+        self.path = path
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.shard_records = shard_records
+        self.compression = compression
+        self.extension = ".jsonl.zst" if compression == "zstd" else ".jsonl"
+
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.callbacks = []
+        self.last_flush = time.monotonic()
+        self.file = None
+        self.shard_index = 0
+        self.shard_count = 0
+
+        if shard_records is None:
+            self.file_path = path + ".zst" if compression == "zstd" else path
+            self._repair(self.file_path)
+            self.file = open(self.file_path, "ab")
+        else:
+            self._recover_shards()
+
+    def _repair(self, file_path):
+        # drop a partially written last line, or frame, so that new records are appended after complete data; a
+        # crash can only have cut the tail, so only the tail is read
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            return
+        with open(file_path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if self.compression == "zstd":
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    end = _last_frame_end(data)
+            else:
+                end = _last_line_end(f)
+            if end < size:
+                f.truncate(end)
+
+    def _shard_path(self, index):
+        return f"{_shard_base(self.path)}-{index:05d}{self.extension}"
+
+    def _write_marker(self, shard_path, count):
+        tmp_path = shard_path + ".done.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"records": count}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, shard_path + ".done")
+
+    def _recover_shards(self):
+        pattern = glob.escape(_shard_base(self.path)) + "-[0-9][0-9][0-9][0-9][0-9].jsonl*"
+
+        indices = []
+        for p in glob.glob(pattern):
+            match = SHARD_PATTERN.search(p[:-len(".partial")] if p.endswith(".partial") else p)
+            if match:
+                indices.append(int(match.group(1)))
+        self.shard_index = max(indices) + 1 if indices else 0
+
+        # complete the shards of a crashed run, keeping their fully written lines
+        for partial in glob.glob(pattern + ".partial"):
+            shard_path = partial[:-len(".partial")]
+            lines = list(_read_lines(partial, compressed=shard_path.endswith(".zst")))
+            tmp_path = shard_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                data = b"".join(lines)
+                if shard_path.endswith(".zst"):
+                    data = zstandard.ZstdCompressor(write_checksum=True).compress(data)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, shard_path)
+            os.remove(partial)
+            self._write_marker(shard_path, len(lines))
+
+    def _open_shard(self):
+        self.file = open(self._shard_path(self.shard_index) + ".partial", "ab")
+        self.shard_count = 0
+
+    def _close_shard(self):
+        shard_path = self._shard_path(self.shard_index)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(shard_path + ".partial", shard_path)
+        self._write_marker(shard_path, self.shard_count)
+        self.file = None
+        self.shard_index += 1
+
+    def _write_bytes(self, data):
+        if self.compression == "zstd":
+            # the checksum lets readers tell a damaged frame from a complete one
+            data = zstandard.ZstdCompressor(write_checksum=True).compress(data)
+        self.file.write(data)
+
+    def write(self, record, callback=None):
+        self.write_many([record], callback)
+
+    def write_many(self, records, callback=None):
+        with self.lock:
+            self.buffer.extend(json.dumps(record) + "\n" for record in records)
+            if callback is not None:
+                self.callbacks.append(callback)
+            due = len(self.buffer) >= self.flush_records
+        if due:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        if time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            lines, self.buffer = self.buffer, []
+            callbacks, self.callbacks = self.callbacks, []
+
+            if self.shard_records is None:
+                if lines:
+                    self._write_bytes("".join(lines).encode())
+            else:
+                while lines:
+                    if self.file is None:
+                        self._open_shard()
+                    batch = lines[:self.shard_records - self.shard_count]
+                    lines = lines[len(batch):]
+                    self._write_bytes("".join(batch).encode())
+                    self.shard_count += len(batch)
+                    if self.shard_count >= self.shard_records:
+                        self._close_shard()
+
+            if self.file is not None:
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            self.last_flush = time.monotonic()
+
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.file is not None:
+                if self.shard_records is None:
+                    self.file.close()
+                    self.file = None
+                else:
+                    self._close_shard()
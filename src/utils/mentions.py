@@ -0,0 +1,159 @@
+import json
+import os
+from collections import defaultdict, deque
+
+from src.utils.character_alignment import name_tokens, normalize_name
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton that finds all occurrences of a set of patterns in one pass over a text.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for pattern, value in patterns:
+            state = 0
+            for ch in pattern:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.output[state].append((len(pattern), value))
+
+        # breadth-first, so that the failure state of a state's parent is known
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(ch, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, text):
+        """
+        Yield (start, end, value) for every occurrence of a pattern in text.
+        """
+
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for length, value in self.output[state]:
+                yield i - length + 1, i + 1, value
+
+
+class PyAhoCorasick:
+    """
+    AhoCorasick on the C automaton of pyahocorasick, with the same matches.
+    """
+
+    def __init__(self, patterns):
+        self.automaton = ahocorasick.Automaton()
+        for pattern, value in patterns:
+            if pattern in self.automaton:
+                self.automaton.get(pattern)[1].append(value)
+            else:
+                self.automaton.add_word(pattern, (len(pattern), [value]))
+        self.automaton.make_automaton()
+
+    def iter_matches(self, text):
+        if not len(self.automaton):
+            return
+        for end, (length, values) in self.automaton.iter(text):
+            for value in values:
+                yield end - length + 1, end + 1, value
+
+
+def make_automaton(patterns):
+    """
+    Automaton of patterns, on pyahocorasick if it is installed.
+    """
+
+    return PyAhoCorasick(patterns) if ahocorasick is not None else AhoCorasick(patterns)
+
+
+def character_patterns(characters):
+    """
+    Patterns of the characters of a book, given as {key: [names and aliases]}: every normalised alias, plus the
+    name tokens (e.g. a surname) of at least three letters that belong to no other character of the book.
+    """
+
+    token_owners = defaultdict(set)
+    for key, aliases in characters.items():
+        for alias in aliases:
+            for token in name_tokens(normalize_name(alias)):
+                token_owners[token].add(key)
+
+    patterns = set()
+    for key, aliases in characters.items():
+        for alias in aliases:
+            name = normalize_name(alias)
+            if name:
+                patterns.add((name, key))
+            for token in name_tokens(name):
+                if len(token) >= 3 and token_owners[token] == {key}:
+                    patterns.add((token, key))
+
+    return sorted(patterns)
+
+
+def scan_mentions(paragraphs, characters):
+    """
+    Count the mentions of the characters in an iterable of paragraphs in one pass and record the paragraphs they
+    occur in. Matches must start and end at word boundaries. Returns {key: {"count": n, "paragraphs": [...]}}.
+    """
+
+    automaton = make_automaton(character_patterns(characters))
+    mentions = {key: {"count": 0, "paragraphs": []} for key in characters}
+
+    for i, paragraph in enumerate(paragraphs):
+        # normalised words are separated by single spaces, as in the patterns
+        text = normalize_name(paragraph)
+        last_end = {}
+        for start, end, key in automaton.iter_matches(text):
+            if (start > 0 and text[start - 1] != " ") or (end < len(text) and text[end] != " "):
+                continue
+            # overlapping matches of a character, e.g. a full name and its surname, are one mention
+            if start < last_end.get(key, 0):
+                last_end[key] = max(last_end[key], end)
+                continue
+            last_end[key] = end
+            mentions[key]["count"] += 1
+            if not mentions[key]["paragraphs"] or mentions[key]["paragraphs"][-1] != i:
+                mentions[key]["paragraphs"].append(i)
+
+    return mentions
+
+
+def mention_index_path(store_dir, book_id):
+    return os.path.join(store_dir, f"{book_id}.mentions.json")
+
+
+def write_mention_index(store_dir, book_id, mentions):
+    path = mention_index_path(store_dir, book_id)
+    with open(path + ".tmp", "w") as f:
+        json.dump(mentions, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def read_mention_index(store_dir, book_id):
+    path = mention_index_path(store_dir, book_id)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,92 @@
+import re
+import zlib
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+WORD = re.compile(r"\w+")
+
+
+def shingles(text, ngram=5):
+    """
+    Set of the lowercased word n-grams of text, hashed to 32 bits. Texts shorter than ngram words are one shingle.
+    """
+
+    words = WORD.findall(text.lower())
+    grams = {" ".join(words[i:i + ngram]) for i in range(max(1, len(words) - ngram + 1))}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+class MinHasher:
+    """
+    MinHash signatures of num_perm hash functions (a * x + b) mod p, computed for all shingles of a text at once.
+    """
+
+    def __init__(self, num_perm=128, ngram=5, seed=1):
+        generator = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.ngram = ngram
+        self.a = generator.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = shingles(text, self.ngram)
+        if not len(hashes):
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint32)
+        permuted = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def signatures(self, texts):
+        return np.stack([self.signature(text) for text in texts]) if texts else \
+            np.empty((0, self.num_perm), dtype=np.uint32)
+
+
+def lsh_params(threshold, num_perm=128):
+    """
+    Number of bands and rows per band with the highest LSH threshold (1 / bands) ** (1 / rows) below threshold.
+    Erring on the low side keeps the recall high, the false candidates are filtered by find_clusters.
+    """
+
+    candidates = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    below = [p for p in candidates if (1 / p[0]) ** (1 / p[1]) <= threshold]
+    return max(below or candidates[-1:], key=lambda p: (1 / p[0]) ** (1 / p[1]))
+
+
+def _find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def find_clusters(signatures, threshold=0.8, bands=None, rows=None):
+    """
+    Group near-duplicate signatures with locality-sensitive hashing. Signatures that share a band bucket are
+    candidates; a candidate is merged with the first signature of its bucket if their estimated Jaccard similarity
+    reaches threshold. Returns the clusters of two or more indices.
+    """
+
+    num_records, num_perm = signatures.shape
+    if bands is None or rows is None:
+        bands, rows = lsh_params(threshold, num_perm)
+
+    parents = list(range(num_records))
+    for band in range(bands):
+        band_values = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        buckets = {}
+        for i in range(num_records):
+            buckets.setdefault(band_values[i].tobytes(), []).append(i)
+
+        for members in buckets.values():
+            first = members[0]
+            for i in members[1:]:
+                if _find(parents, i) == _find(parents, first):
+                    continue
+                if np.mean(signatures[i] == signatures[first]) >= threshold:
+                    parents[_find(parents, i)] = _find(parents, first)
+
+    clusters = {}
+    for i in range(num_records):
+        clusters.setdefault(_find(parents, i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
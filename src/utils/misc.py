@@ -3,18 +3,14 @@ import os
 import re
 from datetime import datetime
 
-import requests
 import yaml
-from dateutil.relativedelta import relativedelta  # Install via pip if needed
 
+from src.utils import http_client, jsonl_store, wayback
 
-def read_jsonl(file_path):
-    data = []
-    with open(file_path, 'r') as file:
-        for line in file:
-            data.append(json.loads(line))
 
-    return data
+def read_jsonl(file_path):
+    # also reads the sharded and zstd compressed files written by jsonl_store.JsonlWriter
+    return list(jsonl_store.iter_jsonl(file_path))
 
 
 def write_jsonl(data, file_path):
@@ -36,37 +32,53 @@ def save_config(data, path):
 
 
 def truncate_text(text, tokenizer, max_length=4096):
-    paragraphs = text.split("\n\n")
+    return "\n\n".join(truncate_paragraphs(text.split("\n\n"), tokenizer, max_length))
+
+
+def truncate_paragraphs(paragraphs, tokenizer, max_length=4096):
+    """
+    Return the leading paragraphs that fit in max_length tokens. paragraphs can be any iterable, e.g.
+    BookReader.iter_paragraphs(), which is only consumed up to the first paragraph that does not fit.
+    """
+
     truncated_paragraphs = []
     current_length = 0
 
     for p in paragraphs:
-        if (len(tokenizer.encode(p)) + current_length) > max_length:
+        token_length = len(tokenizer.encode(p))
+        if (token_length + current_length) > max_length:
             break
         else:
             truncated_paragraphs.append(p)
-            current_length += len(tokenizer.encode(p))
+            current_length += token_length
 
-    return "\n\n".join(truncated_paragraphs)
+    return truncated_paragraphs
 
 
 def segment_text(text, tokenizer, max_length=4096):
-    paragraphs = text.split("\n\n")
+    return ["\n\n".join(segment) for segment in segment_paragraphs(text.split("\n\n"), tokenizer, max_length)]
+
+
+def segment_paragraphs(paragraphs, tokenizer, max_length=4096):
+    """
+    Group an iterable of paragraphs into segments of at most max_length tokens.
+    """
+
     segments = []
-    segment_paragraphs = []
+    current_paragraphs = []
     current_length = 0
     for p in paragraphs:
         token_length = len(tokenizer.encode(p))
         if (token_length + current_length) > max_length:
-            segments.append("\n\n".join(segment_paragraphs))
+            segments.append(current_paragraphs)
             current_length = token_length
-            segment_paragraphs = [p]
+            current_paragraphs = [p]
         else:
-            segment_paragraphs.append(p)
+            current_paragraphs.append(p)
             current_length += token_length
 
-    if segment_paragraphs:
-        segments.append("\n\n".join(segment_paragraphs))
+    if current_paragraphs:
+        segments.append(current_paragraphs)
 
     return segments
 
@@ -110,11 +122,11 @@ def load_template(method, task="description"):
     elif method == "hierarchical":
         if task == "description":
             general_prompt_template = load_prompt("../../prompts/description_prompt.txt")
-            merge_prompt_template = load_prompt("../../prompts/merge_prompt_description.txt")
+            merge_prompt_template = load_prompt("../../prompts/description_merge_prompt.txt")
             return general_prompt_template, merge_prompt_template
         elif task == "analysis":
             general_prompt_template = load_prompt("../../prompts/analysis_prompt.txt")
-            merge_prompt_template = load_prompt("../../prompts/merge_prompt_analysis.txt")
+            merge_prompt_template = load_prompt("../../prompts/analysis_merge_prompt.txt")
             return general_prompt_template, merge_prompt_template
     else:
         raise ValueError("Invalid method given.")
@@ -123,11 +135,10 @@ def load_template(method, task="description"):
 def check_snapshot_date(page, url, max_date=20241112000000):
     """
     Check if the snapshot of the scraped page is before the max_date (in case of new created snapshot which is sooner
-    than the originally used date). If not, find the closest previous snapshot.
+    than the originally used date). If not, look up the closest previous snapshot in the Wayback CDX index and fetch
+    it instead.
     """
 
-    max_date = datetime.strptime(str(max_date), "%Y%m%d%H%M%S")
-
     final_url = page.url
     parts = final_url.split("/")
     current_timestamp_str = parts[4].replace("id_", "")
@@ -136,33 +147,12 @@ def check_snapshot_date(page, url, max_date=20241112000000):
     if len(url_parts) <= 4:
         return True, page
 
-    initial_timestamp_str = url_parts[4].replace("id_", "")
-
-    try:
-        initial_date = datetime.strptime(initial_timestamp_str, "%Y%m%d%H%M%S")
-    except ValueError:
-        initial_date = datetime.strptime(initial_timestamp_str, "%Y")
-
     actual_date = datetime.strptime(current_timestamp_str, "%Y%m%d%H%M%S")
+    if actual_date < datetime.strptime(str(max_date), "%Y%m%d%H%M%S"):
+        return True, page
 
-    valid = True
-    count = 1
-    response = page
-
-    while actual_date >= max_date:
-        adjusted_date = initial_date - relativedelta(years=count)
-        new_timestamp = adjusted_date.strftime("%Y%m%d%H%M%S")
-        adjusted_url = url.replace(initial_timestamp_str, new_timestamp)
-
-        response = requests.get(adjusted_url)
-        final_url = response.url
-        parts = final_url.split("/")
-
-        current_timestamp_str = parts[4].replace("id_", "")
-        actual_date = datetime.strptime(current_timestamp_str, "%Y%m%d%H%M%S")
-        valid = False
-        count += 1
-        if count >= 5:
-            break
+    resolved_url = wayback.get_resolver().resolve(url, max_date=max_date)
+    if resolved_url is None:
+        return False, page
 
-    return valid, response
+    return False, http_client.get(resolved_url)
@@ -0,0 +1,110 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageMetrics:
+    """
+    Queue-depth and throughput counters of one pipeline stage. If capacity is given, at most capacity items are
+    in the stage at once and producers block (backpressure) until a slot is free.
+    """
+
+    def __init__(self, name, capacity=None):
+        self.name = name
+        self.capacity = capacity
+        self.slots = threading.BoundedSemaphore(capacity) if capacity else None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+        self.blocked_time = 0.0
+        self.busy_time = 0.0
+
+    @contextmanager
+    def slot(self):
+        start = time.perf_counter()
+        if self.slots is not None:
+            self.slots.acquire()
+        acquired = time.perf_counter()
+
+        with self.lock:
+            self.blocked_time += acquired - start
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.busy_time += time.perf_counter() - acquired
+            if self.slots is not None:
+                self.slots.release()
+
+    def snapshot(self):
+        with self.lock:
+            return {"stage": self.name, "in_flight": self.in_flight, "capacity": self.capacity,
+                    "max_in_flight": self.max_in_flight, "completed": self.completed,
+                    "blocked_time": self.blocked_time, "busy_time": self.busy_time}
+
+
+class MeteredQueue(queue.Queue):
+    """
+    Bounded queue that records its maximum depth and how long producers were blocked on it.
+    """
+
+    def __init__(self, name, maxsize=0):
+        super().__init__(maxsize)
+        self.name = name
+        self.max_depth = 0
+        self.completed = 0
+        self.blocked_time = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        start = time.perf_counter()
+        super().put(item, block, timeout)
+        with self.mutex:
+            self.blocked_time += time.perf_counter() - start
+            self.max_depth = max(self.max_depth, self._qsize())
+
+    def task_done(self):
+        super().task_done()
+        with self.mutex:
+            self.completed += 1
+
+    def snapshot(self):
+        with self.mutex:
+            return {"stage": self.name, "in_flight": self._qsize(), "capacity": self.maxsize or None,
+                    "max_in_flight": self.max_depth, "completed": self.completed,
+                    "blocked_time": self.blocked_time, "busy_time": None}
+
+
+def format_metrics(stages):
+    parts = []
+    for stage in stages:
+        s = stage.snapshot()
+        capacity = f"/{s['capacity']}" if s["capacity"] else ""
+        parts.append(f"{s['stage']}: {s['in_flight']}{capacity} (max {s['max_in_flight']}, done {s['completed']}, "
+                     f"blocked {s['blocked_time']:.1f}s)")
+    return " | ".join(parts)
+
+
+class Monitor(threading.Thread):
+    """
+    Print the queue depths of the pipeline stages every interval seconds.
+    """
+
+    def __init__(self, stages, interval=30):
+        super().__init__(daemon=True)
+        self.stages = stages
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            print("[pipeline]", format_metrics(self.stages))
+
+    def stop(self):
+        self.stopped.set()
+        print("[pipeline]", format_metrics(self.stages))
@@ -0,0 +1,187 @@
+import string
+
+import numpy as np
+
+from src.utils.book_tokens import segment_bounds, truncate_count, window_bounds
+
+SENTINEL = "\x00{}\x00"
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+def split_template(text, names):
+    """
+    Split a text that contains the SENTINELs of names into [static, name, static, name, ..., static].
+    """
+
+    parts = [text]
+    for name in names:
+        marker = SENTINEL.format(name)
+        split_parts = []
+        for i, part in enumerate(parts):
+            if i % 2 == 1:
+                split_parts.append(part)
+                continue
+            pieces = part.split(marker)
+            for j, piece in enumerate(pieces):
+                if j > 0:
+                    split_parts.append(name)
+                split_parts.append(piece)
+        parts = split_parts
+    return parts
+
+
+class PromptBuilder:
+    """
+    Build the chat input ids of a prompt template directly from token ids. The inner paragraphs of the context come
+    from the BookTokenCache, tokenized once per book together with the separator that follows them (see
+    BookTokenCache.separated). Only the text around them, i.e. the prompt template with its variables and the first
+    and last paragraphs of the context, is tokenized per prompt and memoised by the cache, so the prompt is never
+    decoded, formatted and tokenized again.
+
+    The text is only cut after a paragraph separator followed by a non-space character, where byte-level BPE
+    pre-tokenizers such as the one of Llama 3 always split, and the user message and response are trimmed if the
+    chat template trims them, so the ids are those of apply_chat_template for these tokenizers.
+    """
+
+    def __init__(self, tokenizer, prompt_template, token_cache, context_key="context"):
+        self.tokenizer = tokenizer
+        self.token_cache = token_cache
+        self.context_key = context_key
+        self.separator_ids = self._encode(PARAGRAPH_SEPARATOR)
+
+        names = [name for _, name, _, _ in string.Formatter().parse(prompt_template) if name]
+        if names.count(context_key) != 1:
+            raise ValueError(f"The prompt template must contain {{{context_key}}} once")
+        self.template_parts = split_template(prompt_template.format(**{name: SENTINEL.format(name) for name in names}),
+                                             names)
+
+        user, assistant = SENTINEL.format("user"), SENTINEL.format("assistant")
+        generation = tokenizer.apply_chat_template([{"role": "user", "content": user}], tokenize=False,
+                                                   add_generation_prompt=True)
+        self.generation_parts = self._encode_parts(split_template(generation, ["user"]))
+        training = tokenizer.apply_chat_template([{"role": "user", "content": user},
+                                                  {"role": "assistant", "content": assistant}], tokenize=False)
+        self.training_parts = self._encode_parts(split_template(training, ["user", "assistant"]))
+
+        # e.g. the chat template of Llama 3 applies | trim to every message
+        padded = tokenizer.apply_chat_template([{"role": "user", "content": f" {user} "}], tokenize=False,
+                                               add_generation_prompt=True)
+        self.trim = f" {user} " not in padded
+
+    def _encode(self, text):
+        # memoised by the token cache, in memory and with a cache_dir across runs
+        return np.array(self.token_cache.encode(text), dtype=np.int64)
+
+    def _encode_parts(self, parts):
+        return [part if i % 2 == 1 else self._encode(part) for i, part in enumerate(parts)]
+
+    def _around_context(self, **kwargs):
+        # the user message before and after the context, with the other variables filled in
+        text = "".join(part if i % 2 == 0 else SENTINEL.format(part) if part == self.context_key else str(kwargs[part])
+                       for i, part in enumerate(self.template_parts))
+        head, _, tail = text.partition(SENTINEL.format(self.context_key))
+        return head, tail
+
+    def _strip(self, text, leading=True, trailing=True):
+        # str.strip removes the same whitespace as the trim filter of Jinja
+        if self.trim and leading:
+            text = text.lstrip()
+        if self.trim and trailing:
+            text = text.rstrip()
+        return text
+
+    def user_ids(self, book, start, end, **kwargs):
+        """
+        Ids of the user message whose context is the paragraphs start to end of the BookTokens book.
+        """
+
+        head, tail = self._around_context(**kwargs)
+        paragraphs = book.paragraphs[start:end]
+        # the context is cut before every paragraph but the first that starts with a non-space character
+        cuts = [0] + [j for j in range(1, len(paragraphs)) if paragraphs[j][:1].strip()] + [len(paragraphs)]
+        if len(cuts) <= 3:
+            return self._encode(self._strip(head + PARAGRAPH_SEPARATOR.join(paragraphs) + tail))
+
+        token_ids, offsets = self.token_cache.separated(book)
+        parts = [self._encode(self._strip(head + PARAGRAPH_SEPARATOR.join(paragraphs[:cuts[1]]) + PARAGRAPH_SEPARATOR,
+                                          trailing=False))]
+        for first, last in zip(cuts[1:-2], cuts[2:-1]):
+            if last == first + 1:
+                parts.append(token_ids[offsets[start + first]:offsets[start + last]])
+            else:
+                parts.append(self._encode(PARAGRAPH_SEPARATOR.join(paragraphs[first:last]) + PARAGRAPH_SEPARATOR))
+        parts.append(self._encode(self._strip(PARAGRAPH_SEPARATOR.join(paragraphs[cuts[-2]:]) + tail, leading=False)))
+        return np.concatenate(parts).astype(np.int64)
+
+    def texts_user_ids(self, texts, **kwargs):
+        """
+        Ids of the user message whose context is short texts (e.g. intermediate descriptions) joined by blank lines.
+        """
+
+        head, tail = self._around_context(**kwargs)
+        return self._encode(self._strip(head + PARAGRAPH_SEPARATOR.join(texts) + tail))
+
+    def template_length(self, **kwargs):
+        """
+        Number of tokens of the prompt without the context.
+        """
+
+        return len(self.texts_user_ids([], **kwargs))
+
+    def generation_overhead(self, **kwargs):
+        """
+        Number of tokens of the chat prompt with the generation prompt, without the context.
+        """
+
+        head, _, tail = self.generation_parts
+        return len(head) + self.template_length(**kwargs) + len(tail)
+
+    def _generation_ids(self, user_ids):
+        head, _, tail = self.generation_parts
+        return np.concatenate([head, user_ids, tail]).tolist()
+
+    def generation_ids(self, text, max_length=4096, book_id=None, **kwargs):
+        """
+        Input ids of the chat prompt (with the generation prompt) of the lead of text that truncate_text keeps in
+        max_length tokens.
+        """
+
+        book = self.token_cache.get(text, book_id)
+        return self._generation_ids(self.user_ids(book, 0, truncate_count(book.offsets, max_length), **kwargs))
+
+    def texts_generation_ids(self, texts, **kwargs):
+        """
+        Input ids of the chat prompt whose context is the given short texts joined by blank lines.
+        """
+
+        return self._generation_ids(self.texts_user_ids(texts, **kwargs))
+
+    def segment_generation_ids(self, text, max_length=4096, overlap=0, book_id=None, **kwargs):
+        """
+        Input ids of the chat prompts of the segments of text (see BookTokens.segment_text and window_text).
+        """
+
+        book = self.token_cache.get(text, book_id)
+        bounds = window_bounds(book.offsets, max_length, overlap) if overlap else \
+            segment_bounds(book.offsets, max_length)
+        return [self._generation_ids(self.user_ids(book, start, end, **kwargs)) for start, end in bounds]
+
+    def training_example(self, text, response, max_length=4096, max_input_length=8192, book_id=None, **kwargs):
+        """
+        Input ids, attention mask and labels of a chat with the prompt of text and the assistant response. The
+        context is truncated to the paragraphs that fit in max_length tokens together with the rest of the prompt,
+        and the whole chat to max_input_length tokens. Only the response and the end of the assistant turn are
+        labelled; the lengths of the parts give the mask without tokenizing the response twice.
+        """
+
+        book = self.token_cache.get(text, book_id)
+        context_length = max(0, max_length - self.template_length(**kwargs))
+        user_ids = self.user_ids(book, 0, truncate_count(book.offsets, context_length), **kwargs)
+
+        head, _, middle, _, tail = self.training_parts
+        prompt_ids = np.concatenate([head, user_ids, middle])
+        response_ids = np.concatenate([self._encode(self._strip(response)), tail])
+
+        input_ids = np.concatenate([prompt_ids, response_ids])[:max_input_length].tolist()
+        labels = ([-100] * len(prompt_ids) + response_ids.tolist())[:max_input_length]
+        return {"input_ids": input_ids, "attention_mask": [1] * len(input_ids), "labels": labels}
@@ -0,0 +1,140 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+CACHED_HEADERS = ["Content-Type", "Content-Encoding", "Last-Modified", "Memento-Datetime", "Link"]
+
+
+class CacheMissError(requests.RequestException):
+    """Raised in replay mode when a url is not in the cache."""
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of raw HTTP responses. Bodies are stored gzip-compressed under
+    objects/<sha256[:2]>/<sha256>.gz and index.jsonl records, for every final (Wayback) url, its status, headers and
+    body hash, plus the requested url that redirected to it. In replay mode the network is never used.
+    """
+
+    def __init__(self, cache_dir, replay=False):
+        self.cache_dir = cache_dir
+        self.replay = replay
+        self.index_path = os.path.join(cache_dir, "index.jsonl")
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.aliases = {}
+
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        self._add_entry(json.loads(line))
+
+        self.index_file = open(self.index_path, "a")
+
+    def _add_entry(self, entry):
+        self.entries[entry["final_url"]] = entry
+        self.aliases[entry["url"]] = entry["final_url"]
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest[:2], digest + ".gz")
+
+    def __contains__(self, url):
+        return url in self.entries or url in self.aliases
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, url):
+        """
+        Return a requests.Response rebuilt from the cache, or None if the url was never stored.
+        """
+
+        with self.lock:
+            entry = self.entries.get(self.aliases.get(url, url))
+        if entry is None:
+            return None
+
+        with gzip.open(self._object_path(entry["sha256"]), "rb") as f:
+            content = f.read()
+
+        response = requests.models.Response()
+        response.status_code = entry["status"]
+        response.url = entry["final_url"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        return response
+
+    def add(self, url, content, status=200, final_url=None, headers=None):
+        """
+        Store a raw body for url. final_url is the url the request was redirected to, if any.
+        """
+
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(digest)
+
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = f"{object_path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, object_path)
+
+        entry = {"url": url, "final_url": final_url or url, "status": status, "headers": headers or {},
+                 "sha256": digest}
+
+        with self.lock:
+            self._add_entry(entry)
+            self.index_file.write(json.dumps(entry) + "\n")
+            self.index_file.flush()
+
+    def store(self, url, response):
+        headers = {k: response.headers[k] for k in CACHED_HEADERS if k in response.headers}
+        # the body is already decoded, so the original content encoding no longer applies
+        headers.pop("Content-Encoding", None)
+        self.add(url, response.content, status=response.status_code, final_url=response.url, headers=headers)
+
+    def close(self):
+        self.index_file.close()
+
+
+def import_fixtures(fixtures_dir, cache_dir):
+    """
+    Build a cache from a directory of saved pages. fixtures_dir must contain a urls.tsv file with the columns
+    Url and File (relative to fixtures_dir), and optionally FinalUrl and Status.
+    """
+
+    fixtures = pd.read_csv(os.path.join(fixtures_dir, "urls.tsv"), sep="\t")
+    cache = ResponseCache(cache_dir)
+
+    for _, row in fixtures.iterrows():
+        with open(os.path.join(fixtures_dir, row["File"]), "rb") as f:
+            content = f.read()
+        final_url = row["FinalUrl"] if "FinalUrl" in row and pd.notna(row["FinalUrl"]) else None
+        status = int(row["Status"]) if "Status" in row and pd.notna(row["Status"]) else 200
+        cache.add(row["Url"], content, status=status, final_url=final_url,
+                  headers={"Content-Type": "text/html; charset=utf-8"})
+
+    cache.close()
+    return cache
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Import saved pages into a response cache.")
+    parser.add_argument("--fixtures_dir", required=True, help="Directory with saved pages and a urls.tsv file.")
+    parser.add_argument("--cache_dir", required=True, help="Directory of the response cache.")
+    args = parser.parse_args()
+
+    imported = import_fixtures(args.fixtures_dir, args.cache_dir)
+    print(f"Cache {args.cache_dir} holds {len(imported)} responses")
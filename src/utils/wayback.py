@@ -0,0 +1,220 @@
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+from src.utils import http_client
+
+CDX_ENDPOINT = "https://web.archive.org/cdx/search/cdx"
+MAX_DATE = 20241112000000
+
+# number of path segments that identify a study guide on each website, e.g. sparknotes.com/lit/christmascarol
+PREFIX_DEPTH = {
+    "sparknotes.com": 2,
+    "litcharts.com": 2,
+    "cliffsnotes.com": 3,
+    "shmoop.com": 3,
+    "gradesaver.com": 1,
+}
+
+WAYBACK_URL = re.compile(r"^https?://web\.archive\.org/web/(\d+)[a-z_]*/(.+)$")
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def split_wayback_url(url):
+    """
+    Split a Wayback url into its timestamp and the original url. Returns (None, url) for other urls.
+    """
+
+    match = WAYBACK_URL.match(url)
+    if match is None:
+        return None, url
+    return match.group(1), match.group(2)
+
+
+def normalize_url(url):
+    """
+    Normalise an original url so that the same page compares equal regardless of scheme, www. or slashes.
+    """
+
+    if "://" not in url:
+        url = "http://" + url
+    parts = urlsplit(url)
+    host = parts.netloc.lower().split(":")[0]
+    if host.startswith("www."):
+        host = host[4:]
+    path = re.sub(r"/+", "/", parts.path).rstrip("/")
+    normalized = host + path
+    if parts.query:
+        normalized += "?" + parts.query
+    return normalized
+
+
+def url_prefix(original):
+    """
+    The study guide prefix of an original url, which is queried once for all the pages of a book.
+    """
+
+    normalized = normalize_url(original).split("?")[0]
+    host, _, path = normalized.partition("/")
+    segments = [s for s in path.split("/") if s]
+    depth = PREFIX_DEPTH.get(host, max(len(segments) - 1, 0))
+    return "/".join([host] + segments[:depth])
+
+
+def _pad_timestamp(timestamp):
+    return int(str(timestamp).ljust(14, "0")[:14])
+
+
+class SnapshotResolver:
+    """
+    Resolve Wayback urls to the closest snapshot taken before max_date using the CDX index. The index is queried
+    once per study guide prefix and the resulting timestamp tables are kept in cache_dir.
+    """
+
+    def __init__(self, cache_dir=None, cdx_endpoint=CDX_ENDPOINT, max_date=MAX_DATE):
+        self.cache_dir = cache_dir
+        self.cdx_endpoint = cdx_endpoint
+        self.max_date = max_date
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.prefix_locks = {}
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, prefix):
+        digest = hashlib.sha1(f"{prefix}|{self.max_date}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _query(self, prefix):
+        params = {
+            "url": prefix + "/",
+            "matchType": "prefix",
+            "output": "json",
+            "fl": "timestamp,original",
+            "filter": "statuscode:200",
+            "to": str(self.max_date),
+        }
+        response = http_client.get(self.cdx_endpoint, params=params)
+        response.raise_for_status()
+
+        rows = response.json() if response.content.strip() else []
+        table = {}
+        for timestamp, original in rows[1:]:
+            table.setdefault(normalize_url(original), []).append(int(timestamp))
+
+        for timestamps in table.values():
+            timestamps.sort()
+        return table
+
+    def snapshots(self, prefix):
+        """
+        Return the {normalized original url: sorted timestamps} table of all snapshots under prefix.
+        """
+
+        with self.lock:
+            if prefix in self.tables:
+                return self.tables[prefix]
+            prefix_lock = self.prefix_locks.setdefault(prefix, threading.Lock())
+
+        with prefix_lock:
+            with self.lock:
+                if prefix in self.tables:
+                    return self.tables[prefix]
+
+            if self.cache_dir is not None and os.path.exists(self._cache_path(prefix)):
+                with open(self._cache_path(prefix), "r") as f:
+                    table = json.load(f)["snapshots"]
+            else:
+                table = self._query(prefix)
+                if self.cache_dir is not None:
+                    tmp_path = self._cache_path(prefix) + ".tmp"
+                    with open(tmp_path, "w") as f:
+                        json.dump({"prefix": prefix, "max_date": self.max_date, "snapshots": table}, f)
+                    os.replace(tmp_path, self._cache_path(prefix))
+
+            with self.lock:
+                self.tables[prefix] = table
+            return table
+
+    def resolve(self, url, max_date=None):
+        """
+        Return the Wayback url of the snapshot of url closest to its requested timestamp among the snapshots taken
+        before max_date (which cannot be later than the resolver's max_date), or None if there is no such snapshot.
+        """
+
+        timestamp, original = split_wayback_url(url)
+        timestamps = self.snapshots(url_prefix(original)).get(normalize_url(original))
+        if not timestamps:
+            return None
+
+        max_date = _pad_timestamp(min(int(max_date or self.max_date), int(self.max_date)))
+        end = bisect.bisect_left(timestamps, max_date)
+        if end == 0:
+            return None
+
+        if timestamp is None:
+            best = timestamps[end - 1]
+        else:
+            target = _pad_timestamp(timestamp)
+            i = bisect.bisect_left(timestamps, target, 0, end)
+            candidates = timestamps[max(i - 1, 0):min(i + 1, end)]
+            best = min(candidates, key=lambda t: abs(t - target))
+
+        return f"https://web.archive.org/web/{best}/{original}"
+
+    def prefetch(self, urls):
+        """
+        Query the CDX index for the prefixes of all urls at once, so that scraping never waits on it.
+        """
+
+        prefixes = sorted({url_prefix(split_wayback_url(url)[1]) for url in urls})
+        http_client.map_pages(self.snapshots, prefixes)
+        return prefixes
+
+
+def resolve_tsv(data_file, resolver):
+    """
+    Batch resolve the snapshot tables of every url of a data TSV file.
+    """
+
+    data = pd.read_csv(data_file, sep="\t", index_col=False)
+    return resolver.prefetch(data["Url"].tolist())
+
+
+def set_resolver(resolver):
+    global _resolver
+
+    with _resolver_lock:
+        _resolver = resolver
+
+
+def get_resolver():
+    global _resolver
+
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = SnapshotResolver()
+        return _resolver
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Resolve the Wayback snapshots of a data file via the CDX index.")
+    parser.add_argument("--data_file", required=True, help="Path to the input TSV file containing book data.")
+    parser.add_argument("--cache_dir", required=True, help="Directory where the snapshot tables are stored.")
+    parser.add_argument("--cdx_endpoint", default=CDX_ENDPOINT, help="Url of the CDX server.")
+    parser.add_argument("--max_date", type=int, default=MAX_DATE, help="Snapshots must be older than this date.")
+    args = parser.parse_args()
+
+    resolved = resolve_tsv(args.data_file, SnapshotResolver(args.cache_dir, args.cdx_endpoint, args.max_date))
+    print(f"Resolved {len(resolved)} url prefixes")
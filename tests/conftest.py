@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+# the modules are imported as src.*, from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pre-tokenizer and chat template of Llama 3
+SPLIT_PATTERN = (r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|"
+                 r"\s*[\r\n]+|\s+(?!\S)|\s+")
+CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "{% set content = '<|start_header_id|>' + message['role'] + '<|end_header_id|>\n\n' + message['content'] | trim"
+    " + '<|eot_id|>' %}"
+    "{% if loop.index0 == 0 %}{% set content = bos_token + content %}{% endif %}{{ content }}{% endfor %}"
+    "{% if add_generation_prompt %}{{ '<|start_header_id|>assistant<|end_header_id|>\n\n' }}{% endif %}"
+)
+SPECIAL_TOKENS = ["<|begin_of_text|>", "<|start_header_id|>", "<|end_header_id|>", "<|eot_id|>"]
+TRAINING_TEXT = """CHAPTER I
+
+Emma Woodhouse, handsome, clever, and rich, with a comfortable home and happy disposition, seemed to unite some of
+the best blessings of existence; and had lived nearly twenty-one years in the world with very little to distress or
+vex her.
+
+She was the youngest of the two daughters of a most affectionate, indulgent father.
+
+Describe character: Mr. Weston given the following context.
+
+Context: "It is a very great pity," said Mr. Woodhouse, "that Miss Taylor ever came here."
+"""
+
+
+@pytest.fixture(scope="session")
+def tokenizer():
+    """
+    Byte-level BPE tokenizer with the pre-tokenizer, special tokens and chat template of Llama 3, trained on a few
+    sentences.
+    """
+
+    pytest.importorskip("jinja2")
+    tokenizers = pytest.importorskip("tokenizers")
+    transformers = pytest.importorskip("transformers")
+    from tokenizers import decoders, models, pre_tokenizers, processors, trainers
+
+    backend = tokenizers.Tokenizer(models.BPE())
+    backend.pre_tokenizer = pre_tokenizers.Sequence([
+        pre_tokenizers.Split(tokenizers.Regex(SPLIT_PATTERN), behavior="isolated"),
+        pre_tokenizers.ByteLevel(add_prefix_space=False, use_regex=False),
+    ])
+    backend.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=1000, special_tokens=SPECIAL_TOKENS,
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    backend.train_from_iterator([TRAINING_TEXT] * 20, trainer)
+    backend.post_processor = processors.TemplateProcessing(single="<|begin_of_text|> $A",
+                                                           special_tokens=[("<|begin_of_text|>", 0)])
+
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, bos_token="<|begin_of_text|>",
+                                                     eos_token="<|eot_id|>")
+    tokenizer.chat_template = CHAT_TEMPLATE
+    return tokenizer
@@ -0,0 +1,68 @@
+import pytest
+
+from src.utils.book_store import BookReader, BookStore, BookTexts, write_book
+
+PARAGRAPHS = ["CHAPTER I", "Emma Woodhouse, handsome, clever, and rich.", "", "\nCHAPTER II", "Élise — naïve. ",
+              "The end."] * 20
+TEXT = "\n\n".join(PARAGRAPHS)
+
+
+@pytest.mark.parametrize("block_size", [1, 64, 1 << 16])
+def test_paragraphs_round_trip(tmp_path, block_size):
+    path = str(tmp_path / "1.book")
+    write_book(path, TEXT, block_size)
+
+    with BookReader(path) as reader:
+        assert len(reader) == len(PARAGRAPHS)
+        assert reader.text() == TEXT
+        assert (reader.num_blocks > 1) == (block_size < len(TEXT))
+        # every range, including those spanning several blocks, decompresses to the same paragraphs
+        for start, end in [(0, 1), (3, 4), (5, 17), (50, 200), (len(PARAGRAPHS), None)]:
+            assert reader.paragraphs(start, end) == PARAGRAPHS[start:end]
+        assert reader.first(7) == PARAGRAPHS[:7]
+
+
+def test_block_offsets_index_the_paragraphs(tmp_path):
+    path = str(tmp_path / "1.book")
+    write_book(path, TEXT, block_size=64)
+
+    with BookReader(path) as reader:
+        assert reader.block_first[0] == 0 and reader.block_first[-1] == len(PARAGRAPHS)
+        assert reader.para_offsets[-1] == sum(len(p.encode("utf-8")) for p in PARAGRAPHS)
+        for paragraph in range(len(PARAGRAPHS)):
+            block = reader._block_of(paragraph)
+            assert reader.block_first[block] <= paragraph < reader.block_first[block + 1]
+
+
+def test_store_rejects_other_files(tmp_path):
+    store = BookStore(str(tmp_path))
+    store.add(7, "Emma.")
+    assert 7 in store and 8 not in store
+    with store.open(7) as reader:
+        assert reader.text() == "Emma."
+
+    (tmp_path / "8.book").write_bytes(b"not a book store file")
+    with pytest.raises(ValueError):
+        store.open(8)
+
+
+def test_book_texts_keep_one_copy_per_book(tmp_path, monkeypatch):
+    store = BookStore(str(tmp_path))
+    store.add(1, TEXT)
+    store.add(2, "Emma.")
+    book_texts = BookTexts(str(tmp_path))
+
+    opened = []
+    open_book = book_texts.store.open
+    monkeypatch.setattr(book_texts.store, "open", lambda book_id: opened.append(book_id) or open_book(book_id))
+
+    # the records of the characters of a book share a single text, read once from the store
+    records = [{"book_id": 1, "character": "Emma"}, {"book_id": "1", "character": "Harriet"}, {"book_id": 2}]
+    texts = [book_texts.input(record) for record in records]
+    assert texts[0] == TEXT and texts[0] is texts[1]
+    assert texts[2] == "Emma."
+    assert opened == ["1", "2"]
+
+    assert book_texts.input({"book_id": 1, "input": "inline"}) == "inline"
+    with pytest.raises(ValueError):
+        BookTexts().input({"book_id": 1})
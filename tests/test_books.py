@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+pytest.importorskip("gutenbergpy")
+
+from src.data import books
+from src.utils.book_store import BookStore
+
+RAW = b"header\r\n*** START OF THE PROJECT GUTENBERG EBOOK EMMA ***\r\nEmma Woodhouse.\r\n"
+
+
+def write_book(save_path, book_id, manifest):
+    book_dir = os.path.join(save_path, str(book_id))
+    os.makedirs(book_dir)
+    files = {"book.txt": RAW, "book_cleaned.txt": b"Emma Woodhouse."}
+    for name, content in files.items():
+        books.write_atomic(os.path.join(book_dir, name), content)
+    manifest.add(book_id, book_dir, files)
+    return book_dir
+
+
+def test_unchanged_files_are_not_hashed_again(tmp_path, monkeypatch):
+    manifest = books.Manifest(str(tmp_path))
+    book_dir = write_book(str(tmp_path), 1, manifest)
+
+    def fail(*args):
+        raise AssertionError("file hashed again")
+
+    monkeypatch.setattr(books.hashlib, "sha256", fail)
+    assert books.Manifest(str(tmp_path)).is_valid(book_dir, 1)
+
+
+def test_touched_file_is_hashed_once(tmp_path):
+    manifest = books.Manifest(str(tmp_path))
+    book_dir = write_book(str(tmp_path), 1, manifest)
+    path = os.path.join(book_dir, "book.txt")
+    os.utime(path, ns=(0, 0))
+
+    assert books.Manifest(str(tmp_path)).is_valid(book_dir, 1)
+    assert books.Manifest(str(tmp_path)).books["1"]["book.txt"]["mtime"] == 0
+
+    with open(path, "r+b") as f:
+        f.write(b"H")
+    assert not books.Manifest(str(tmp_path)).is_valid(book_dir, 1)
+
+
+def test_store_only_writes_the_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(books.textget, "get_text_by_id", lambda book_id: RAW)
+    monkeypatch.setattr(books.textget, "strip_headers", lambda raw: b"Emma Woodhouse.")
+    save_path, store = str(tmp_path / "books"), BookStore(str(tmp_path / "store"))
+    manifest = books.Manifest(save_path)
+
+    assert books.get_book(1, save_path, manifest, store=store) == "gutenberg"
+    assert not os.path.exists(os.path.join(save_path, "1"))
+    with store.open(1) as reader:
+        assert reader.text() == "Emma Woodhouse."
+
+    monkeypatch.setattr(books.textget, "get_text_by_id", None)
+    assert books.get_book(1, save_path, manifest, store=store) == "existing"
@@ -0,0 +1,40 @@
+import pytest
+
+from src.utils import eval_utils
+from src.utils.book_tokens import BookTokenCache
+from src.utils.prompt_tokens import PromptBuilder
+
+MERGE_PROMPT = ("Describe character: {character} by merging the following descriptions into a single description."
+                "\n\nDescriptions:\n{descriptions}\n")
+
+
+def test_length_batches_sort_and_cap_tokens():
+    lengths = [5, 20, 10, 15]
+    assert eval_utils.length_batches(lengths, batch_size=2) == [[1, 3], [2, 0]]
+    # every prompt of a batch counts at the length of its longest one
+    assert eval_utils.length_batches(lengths, batch_size=4, max_batch_tokens=40) == [[1, 3], [2, 0]]
+    assert eval_utils.length_batches(lengths, batch_size=4, max_batch_tokens=30) == [[1], [3, 2], [0]]
+
+
+def test_merge_groups_reject_texts_over_half_the_budget():
+    assert eval_utils.merge_groups([4, 4, 4], 10, separator_length=2) == [[0, 1], [2]]
+    with pytest.raises(ValueError):
+        eval_utils.merge_groups([8, 3], 10, separator_length=2)
+
+
+def test_tree_merge_truncates_descriptions_over_budget(tokenizer):
+    builder = PromptBuilder(tokenizer, MERGE_PROMPT, BookTokenCache(tokenizer), context_key="descriptions")
+    descriptions = ["Emma Woodhouse, handsome, clever, and rich, " * 20, "She was the youngest of the daughters. " * 20]
+    max_length = builder.generation_overhead(character="Emma") + 100
+    assert sum(len(builder.token_cache.encode(d)) for d in descriptions) > 100
+
+    prompts = []
+
+    def generate_fn(prompts_ids):
+        prompts.extend(prompts_ids)
+        return ["merged"] * len(prompts_ids)
+
+    outputs = eval_utils.tree_merge([descriptions], ["Emma"], builder, max_length, generate_fn)
+    assert outputs == ["merged"]
+    assert len(prompts) == 1
+    assert len(prompts[0]) <= max_length
@@ -0,0 +1,148 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from src.utils import http_client
+from src.utils.http_client import CircuitBreaker, CircuitOpenError, HttpClient
+from src.utils.response_cache import ResponseCache
+
+
+def make_response(url, status):
+    response = requests.models.Response()
+    response.status_code = status
+    response.url = url
+    response._content = b""
+    return response
+
+
+def test_bad_url_does_not_open_circuit_for_host():
+    client = HttpClient(requests_per_second=None, max_retries=4, backoff_base=0.0)
+    calls = []
+
+    def fake_get(url, **kwargs):
+        calls.append(url)
+        return make_response(url, 503 if url.endswith("/bad") else 200)
+
+    client.session.get = fake_get
+
+    # every attempt of the bad url fails, but it counts as a single failed request
+    assert client.get("https://web.archive.org/bad").status_code == 503
+    assert calls.count("https://web.archive.org/bad") == client.max_retries + 1
+    assert client.get("https://web.archive.org/good").status_code == 200
+
+
+def test_circuit_opens_after_failure_threshold_urls():
+    client = HttpClient(requests_per_second=None, max_retries=1, backoff_base=0.0, failure_threshold=3)
+    client.session.get = lambda url, **kwargs: make_response(url, 503)
+
+    for i in range(3):
+        client.get(f"https://web.archive.org/bad/{i}")
+
+    with pytest.raises(CircuitOpenError):
+        client.get("https://web.archive.org/other")
+
+
+def test_half_open_circuit_admits_one_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    # the failed trial opens the circuit again
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_chunked_encoding_error_is_retried():
+    client = HttpClient(requests_per_second=None, max_retries=2, backoff_base=0.0)
+    calls = []
+
+    def fake_get(url, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            raise requests.exceptions.ChunkedEncodingError("connection broken")
+        return make_response(url, 200)
+
+    client.session.get = fake_get
+
+    assert client.get("https://web.archive.org/page").status_code == 200
+    assert len(calls) == 2
+
+
+def test_only_successful_responses_are_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    client = HttpClient(requests_per_second=None, max_retries=0, cache=cache)
+    client.session.get = lambda url, **kwargs: make_response(url, 404 if url.endswith("/missing") else 200)
+
+    client.get("https://web.archive.org/page")
+    client.get("https://web.archive.org/missing")
+    assert cache.lookup("https://web.archive.org/page") is not None
+    assert cache.lookup("https://web.archive.org/missing") is None
+    cache.close()
+
+
+def test_token_bucket_limits_the_rate(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(http_client.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(http_client.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+
+    bucket = http_client.TokenBucket(rate=2.0, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    # the burst is served at once, the next requests wait for the bucket to refill
+    assert clock[0] == 0.0
+    bucket.acquire()
+    bucket.acquire()
+    assert clock[0] == pytest.approx(1.0)
+
+
+def test_session_pool_is_shared_and_bounded():
+    client = HttpClient(max_concurrency=3, requests_per_second=None)
+    adapter = client.session.get_adapter("https://web.archive.org/")
+    assert adapter is client.session.get_adapter("http://www.sparknotes.com/")
+    assert adapter._pool_maxsize == 3
+
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    def fake_get(url, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return make_response(url, 200)
+
+    client.session.get = fake_get
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(client.get, [f"https://web.archive.org/{i}" for i in range(24)]))
+    # at most max_concurrency requests are in flight, however many threads ask
+    assert peak[0] == client.fetch_stage.max_in_flight <= 3
+
+
+def test_page_graph_fetches_each_url_once():
+    graph = http_client.PageGraph()
+    calls = []
+
+    def fetch(url):
+        calls.append(url)
+        time.sleep(0.01)
+        return make_response(url, 503 if url.endswith("/bad") else 200)
+
+    # e.g. the characters page, needed by the description and analysis extractors at the same time
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda url: graph.get(url, fetch), ["https://web.archive.org/characters"] * 4))
+    graph.get("https://web.archive.org/bad", fetch)
+    graph.get("https://web.archive.org/bad", fetch)
+
+    # failed pages are fetched again
+    assert calls == ["https://web.archive.org/characters"] + ["https://web.archive.org/bad"] * 2
+    assert (graph.requests, graph.fetched) == (6, 1)
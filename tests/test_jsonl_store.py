@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from src.utils import jsonl_store
+from src.utils.jsonl_store import JsonlWriter, iter_jsonl
+
+zstandard = pytest.importorskip("zstandard")
+
+
+def write_batches(path, batches, **kwargs):
+    writer = JsonlWriter(path, **kwargs)
+    for batch in batches:
+        writer.write_many([{"id": i} for i in batch])
+        writer.flush()
+    return writer
+
+
+def ids(path):
+    return [record["id"] for record in iter_jsonl(path)]
+
+
+def test_zstd_crash_then_append(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    write_batches(path, [range(0, 3), range(3, 6)], compression="zstd").close()
+
+    # a crash in the middle of the next frame
+    frame = zstandard.ZstdCompressor(write_checksum=True).compress(b'{"id": 6}\n{"id": 7}\n')
+    with open(path + ".zst", "ab") as f:
+        f.write(frame[:len(frame) // 2])
+
+    write_batches(path, [range(8, 10)], compression="zstd").close()
+    assert ids(path) == [0, 1, 2, 3, 4, 5, 8, 9]
+
+
+def test_zstd_damaged_frame_is_skipped(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    compressor = zstandard.ZstdCompressor(write_checksum=True)
+    damaged = compressor.compress(b'{"id": 1}\n')
+    with open(path + ".zst", "wb") as f:
+        f.write(compressor.compress(b'{"id": 0}\n'))
+        f.write(damaged[:len(damaged) - 3])
+        f.write(compressor.compress(b'{"id": 2}\n'))
+
+    # only the damaged frame is lost, also when the file was appended to without repair
+    assert ids(path) == [0, 2]
+
+
+def test_zstd_repair_only_cuts_the_tail(tmp_path, monkeypatch):
+    # frames are fed to the decompressor in several chunks
+    monkeypatch.setattr(jsonl_store, "CHUNK_SIZE", 16)
+    path = str(tmp_path / "data.jsonl")
+    compressor = zstandard.ZstdCompressor(write_checksum=True)
+    damaged = compressor.compress(b'{"id": 1}\n')
+    large = compressor.compress("".join(f'{{"id": {i}}}\n' for i in range(2, 100)).encode())
+    with open(path + ".zst", "wb") as f:
+        f.write(compressor.compress(b'{"id": 0}\n'))
+        f.write(damaged[:len(damaged) - 3])
+        f.write(large)
+        f.write(damaged[:5])
+
+    write_batches(path, [range(100, 101)], compression="zstd").close()
+    assert ids(path) == [0] + list(range(2, 101))
+
+
+def test_plain_crash_then_append(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    write_batches(path, [range(0, 2)]).close()
+    with open(path, "a") as f:
+        f.write('{"id": 2')
+
+    write_batches(path, [range(3, 4)]).close()
+    assert ids(path) == [0, 1, 3]
+
+
+def test_zstd_partial_shard_is_recovered(tmp_path):
+    path = str(tmp_path / "data.jsonl")
+    writer = write_batches(path, [range(0, 4)], compression="zstd", shard_records=10)
+    writer.file.write(b"\x28\xb5\x2f\xfd\x00")
+    writer.file.flush()
+
+    write_batches(path, [range(4, 6)], compression="zstd", shard_records=10).close()
+    assert ids(path) == [0, 1, 2, 3, 4, 5]
+    assert sorted(os.listdir(tmp_path)) == ["data-00000.jsonl.zst", "data-00000.jsonl.zst.done",
+                                            "data-00001.jsonl.zst", "data-00001.jsonl.zst.done"]
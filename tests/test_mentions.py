@@ -0,0 +1,42 @@
+import pytest
+
+from src.utils import mentions
+
+CHARACTERS = {
+    "emma": ["Emma Woodhouse", "Emma"],
+    "knightley": ["Mr. Knightley", "George Knightley"],
+    "john": ["John Knightley"],
+    "harriet": ["Harriet Smith"],
+}
+PARAGRAPHS = [
+    "Emma Woodhouse, handsome, clever, and rich.",
+    "Emmanuel and Woodhouses are not Emma; neither is Smithson.",
+    "Mr. Knightley and John Knightley came. Harriet smiled at Mr. Knightley.",
+    "Smith! said Emma.",
+]
+
+
+@pytest.fixture(params=["python", "pyahocorasick"])
+def automaton(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(mentions, "ahocorasick", None)
+    elif mentions.ahocorasick is None:
+        pytest.skip("pyahocorasick is not installed")
+    return request.param
+
+
+def test_automata_find_overlapping_matches(automaton):
+    found = sorted(mentions.make_automaton([("he", 1), ("she", 2), ("hers", 3), ("he", 4)]).iter_matches("ushers"))
+    assert found == [(1, 4, 2), (2, 4, 1), (2, 4, 4), (2, 6, 3)]
+
+
+def test_scan_mentions_word_boundaries_and_overlaps(automaton):
+    found = mentions.scan_mentions(PARAGRAPHS, CHARACTERS)
+
+    # "Emma Woodhouse" and its "emma" and "woodhouse" tokens overlap and are one mention; "Emmanuel",
+    # "Woodhouses" and "Smithson" are not mentions
+    assert found["emma"] == {"count": 3, "paragraphs": [0, 1, 3]}
+    # "knightley" is shared by two characters, so only their full names are patterns
+    assert found["knightley"] == {"count": 2, "paragraphs": [2]}
+    assert found["john"] == {"count": 1, "paragraphs": [2]}
+    assert found["harriet"] == {"count": 2, "paragraphs": [2, 3]}
@@ -0,0 +1,25 @@
+from src.utils.minhash import MinHasher, find_clusters, lsh_params
+
+EMMA = ("Emma Woodhouse, handsome, clever, and rich, with a comfortable home and happy disposition, seemed to unite "
+        "some of the best blessings of existence; and had lived nearly twenty-one years in the world with very "
+        "little to distress or vex her. She was the youngest of the two daughters of a most affectionate, indulgent "
+        "father; and had, in consequence of her sister's marriage, been mistress of his house from a very early "
+        "period.")
+# the same description from another source, with one word changed and different punctuation and case
+EMMA_COPY = EMMA.replace("indulgent", "doting").replace(";", ".").upper()
+KNIGHTLEY = ("Mr. Knightley, a sensible man about seven or eight and thirty, was not only a very old and intimate "
+             "friend of the family, but particularly connected with it, as the elder brother of Isabella's husband.")
+
+
+def test_near_duplicate_pair_is_clustered():
+    hasher = MinHasher(num_perm=128, ngram=5)
+    signatures = hasher.signatures([KNIGHTLEY, EMMA, "Harriet Smith.", EMMA_COPY])
+    assert signatures.shape == (4, 128)
+    assert find_clusters(signatures, threshold=0.8) == [[1, 3]]
+    assert find_clusters(signatures, threshold=0.99) == []
+
+
+def test_lsh_threshold_is_below_the_similarity_threshold():
+    bands, rows = lsh_params(0.8, 128)
+    assert bands * rows == 128
+    assert (1 / bands) ** (1 / rows) <= 0.8
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from src.data.websites import cliffsnotes, parsing, sparknotes
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+URL = "https://web.archive.org/web/20221109035530/https://www.sparknotes.com/lit/a-tale-of-two-cities/characters/"
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+@pytest.fixture(params=["html.parser", "lxml", "selectolax"])
+def backend(request):
+    try:
+        parsing.set_backend(request.param)
+    except ValueError:
+        pytest.skip(f"{request.param} is not installed")
+    yield request.param
+    parsing.set_backend("html.parser")
+
+
+def test_strained_soup_keeps_matching_subtrees(backend):
+    soup = parsing.make_soup(read_fixture("sparknotes_characters.html"),
+                             sparknotes.STRAINERS["character_description"])
+
+    assert soup.find("div", class_="mainTextContent main-container") is not None
+    # the sidebar is not part of the strained document
+    assert soup.find("aside") is None
+    assert "Take a Study Break" not in soup.get_text()
+
+
+def test_sparknotes_character_description(backend):
+    data = sparknotes.parse_character_description(read_fixture("sparknotes_characters.html"), 98,
+                                                  "A Tale of Two Cities", "Charles Dickens", URL)
+
+    assert [record["character"] for record in data] == ["Charles Darnay", "Sydney Carton", "Lucie Manette"]
+    assert data[1]["description"].startswith("An alcoholic attorney who works with Stryver.")
+
+
+def test_sparknotes_character_analysis_urls(backend):
+    urls = sparknotes.parse_char_analysis_urls(read_fixture("sparknotes_characters.html"),
+                                               "https://www.sparknotes.com/lit/a-tale-of-two-cities/")
+
+    assert urls == ["https://www.sparknotes.com/lit/a-tale-of-two-cities/character/charles-darnay",
+                    "https://www.sparknotes.com/lit/a-tale-of-two-cities/character/sydney-carton"]
+
+
+def test_cliffsnotes_character_analysis(backend):
+    url = ("https://web.archive.org/web/20230616062923/https://www.cliffsnotes.com/literature/p/the-portrait-of-a-lady/"
+           "character-analysis/isabel-archer")
+    data = cliffsnotes.parse_character_analysis(read_fixture("cliffsnotes_character_analysis.html"), 2833,
+                                                "The Portrait of a Lady", "Henry James", url)
+
+    assert len(data) == 1
+    assert data[0]["character"] == "Isabel Archer"
+    assert data[0]["analysis"].startswith("Isabel Archer is a young American woman")
+    assert "Related study guides" not in data[0]["analysis"]
@@ -0,0 +1,40 @@
+import threading
+import time
+
+from src.utils.pipeline import MeteredQueue, StageMetrics, format_metrics
+
+
+def test_stage_slots_apply_backpressure():
+    stage = StageMetrics("fetch", capacity=2)
+    release = threading.Event()
+
+    def work():
+        with stage.slot():
+            release.wait()
+
+    threads = [threading.Thread(target=work) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    # the third producer blocks until a slot is free
+    assert stage.snapshot()["in_flight"] == 2
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    snapshot = stage.snapshot()
+    assert (snapshot["in_flight"], snapshot["max_in_flight"], snapshot["completed"]) == (0, 2, 3)
+    assert snapshot["blocked_time"] > 0
+
+
+def test_metered_queue_records_depth_and_completed():
+    write_queue = MeteredQueue("write", maxsize=4)
+    for i in range(3):
+        write_queue.put(i)
+    write_queue.get()
+    write_queue.task_done()
+
+    snapshot = write_queue.snapshot()
+    assert (snapshot["in_flight"], snapshot["capacity"], snapshot["max_in_flight"], snapshot["completed"]) == \
+        (2, 4, 3, 1)
+    assert format_metrics([write_queue]).startswith("write: 2/4 (max 3, done 1")
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+pytest.importorskip("nltk")
+
+from src.data import prepare_data
+from src.utils.book_store import BookStore, BookTexts
+from src.utils.jsonl_store import iter_jsonl
+
+DESCRIPTIONS = ["Emma.", "Emma is clever.", "Emma Woodhouse is handsome, clever and rich."]
+
+
+def write_records(path, records):
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def test_token_counts_are_reused_across_thresholds(tmp_path, monkeypatch):
+    monkeypatch.setattr(prepare_data, "count_tokens", lambda text: len(text.split()))
+    dataset_path = str(tmp_path / "description_data.jsonl")
+    write_records(dataset_path, [{"id": i, "description": d} for i, d in enumerate(DESCRIPTIONS)])
+
+    prepare_data.filter_corpus(dataset_path, [1, 3], str(tmp_path), chunk_size=2)
+    assert [r["id"] for r in iter_jsonl(str(tmp_path / "description_data-filtered-1.jsonl"))] == [1, 2]
+    assert [r["id"] for r in iter_jsonl(str(tmp_path / "description_data-filtered-3.jsonl"))] == [2]
+
+    def fail(text):
+        raise AssertionError(f"{text!r} counted again")
+
+    # another threshold reads every count from token_counts.tsv
+    monkeypatch.setattr(prepare_data, "count_tokens", fail)
+    prepare_data.filter_corpus(dataset_path, 2, str(tmp_path))
+    assert [r["id"] for r in iter_jsonl(str(tmp_path / "description_data-filtered-2.jsonl"))] == [1, 2]
+    count_cache = prepare_data.TokenCountCache(str(tmp_path / "token_counts.tsv"))
+    assert len(count_cache.counts) == len(DESCRIPTIONS)
+    count_cache.close()
+
+
+def write_splits(split_path, splits):
+    split_path.mkdir()
+    for split in prepare_data.SPLITS:
+        lines = ["BookId\tTitle"] + [f"{book_id}\tBook {book_id}" for book_id in splits.get(split, [])]
+        (split_path / f"{split}.tsv").write_text("\n".join(lines) + "\n")
+
+
+def test_load_split_map_rejects_books_in_two_splits(tmp_path):
+    write_splits(tmp_path / "ok", {"train": [1, 2, 2], "val": [3], "test": [4]})
+    assert prepare_data.load_split_map(str(tmp_path / "ok")) == {1: "train", 2: "train", 3: "val", 4: "test"}
+
+    write_splits(tmp_path / "overlap", {"train": [1, 2], "val": [3], "test": [2]})
+    with pytest.raises(ValueError, match="Book 2"):
+        prepare_data.load_split_map(str(tmp_path / "overlap"))
+
+
+def test_hash_split_is_stable():
+    # pinned, so that a change to the hash would not silently move books between splits
+    assert [prepare_data.hash_split(book_id) for book_id in [1, 2, 3, 4, 5, 6]] == \
+        ["train", "val", "train", "train", "test", "test"]
+    assert [prepare_data.hash_split(book_id) for book_id in range(1000)].count("train") == pytest.approx(800, abs=40)
+    assert prepare_data.hash_split(7, split_ratios=(1.0, 0.0, 0.0)) == "train"
+    assert prepare_data.hash_split(7, split_ratios=(0.0, 0.0, 1.0)) == "test"
+
+
+def test_full_book_records_refer_to_the_store(tmp_path):
+    splits_path, save_path = tmp_path / "splits", tmp_path / "full_book"
+    splits_path.mkdir()
+    records = {"train": [{"id": 1, "character": "Emma", "input": "Emma Woodhouse.", "description": "Emma."},
+                         {"id": 2, "character": "Jane", "input": "Jane Fairfax.", "description": "Jane."}],
+               "val": [], "test": []}
+    for split in prepare_data.SPLITS:
+        write_records(str(splits_path / f"{split}.jsonl"), records[split])
+    BookStore(str(tmp_path / "store")).add(1, "Emma Woodhouse.")
+
+    # the book text is not copied into the records; books missing from the store are skipped
+    prepare_data.build_full_book(str(splits_path), str(tmp_path / "store"), str(save_path))
+    assert list(iter_jsonl(str(save_path / "train.jsonl"))) == [
+        {"id": 1, "character": "Emma", "description": "Emma.", "book_id": 1}]
+    assert BookTexts(str(tmp_path / "store")).input({"id": 1, "book_id": 1}) == "Emma Woodhouse."
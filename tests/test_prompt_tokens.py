@@ -0,0 +1,76 @@
+import pytest
+
+from src.utils.book_tokens import BookTokenCache
+from src.utils.prompt_tokens import PromptBuilder
+
+PROMPT = "Describe character: {character} given the following context.\n\nContext: {context}"
+MERGE_PROMPT = ("Describe character: {character} by merging the following descriptions into a single description."
+                "\n\nDescriptions:\n{descriptions}\n")
+BOOK = "\n\n".join([
+    "CHAPTER I",
+    "Emma Woodhouse, handsome, clever, and rich, seemed to unite some of the best blessings of existence.",
+    "She was the youngest of the two daughters of a most affectionate, indulgent father.",
+    "",
+    "\nCHAPTER II",
+    " Mr. Weston was a native of Highbury, and born of a respectable family.",
+    "\"It is a very great pity,\" said Mr. Woodhouse, \"that Miss Taylor ever came here.\"",
+    "Her father was not fond of walking.",
+    "The end. ",
+])
+
+
+def chat_ids(tokenizer, messages, add_generation_prompt=True):
+    return tokenizer.apply_chat_template(messages, add_generation_prompt=add_generation_prompt)["input_ids"]
+
+
+def assert_same_ids(tokenizer, ids, expected):
+    assert tokenizer.decode(ids) == tokenizer.decode(expected)
+    assert len(ids) == len(expected)
+    assert ids == expected
+
+
+@pytest.mark.parametrize("max_length", [0, 30, 60, 1000])
+def test_generation_ids_match_chat_template(tokenizer, max_length):
+    cache = BookTokenCache(tokenizer)
+    builder = PromptBuilder(tokenizer, PROMPT, cache)
+
+    context = cache.truncate_text(BOOK, max_length)
+    expected = chat_ids(tokenizer, [{"role": "user", "content": PROMPT.format(character="Emma", context=context)}])
+    assert_same_ids(tokenizer, builder.generation_ids(BOOK, max_length, character="Emma"), expected)
+
+
+def test_segment_generation_ids_match_chat_template(tokenizer):
+    cache = BookTokenCache(tokenizer)
+    builder = PromptBuilder(tokenizer, PROMPT, cache)
+
+    segments = cache.window_text(BOOK, 60, overlap=20)
+    for ids, segment in zip(builder.segment_generation_ids(BOOK, 60, overlap=20, character="Mr. Weston"), segments):
+        content = PROMPT.format(character="Mr. Weston", context=segment)
+        assert_same_ids(tokenizer, ids, chat_ids(tokenizer, [{"role": "user", "content": content}]))
+
+
+def test_texts_generation_ids_match_chat_template(tokenizer):
+    builder = PromptBuilder(tokenizer, MERGE_PROMPT, BookTokenCache(tokenizer), context_key="descriptions")
+
+    texts = ["Emma is clever.", "Emma is rich. "]
+    content = MERGE_PROMPT.format(character="Emma", descriptions="\n\n".join(texts))
+    expected = chat_ids(tokenizer, [{"role": "user", "content": content}])
+    assert_same_ids(tokenizer, builder.texts_generation_ids(texts, character="Emma"), expected)
+
+
+def test_training_example_matches_chat_template(tokenizer):
+    cache = BookTokenCache(tokenizer)
+    builder = PromptBuilder(tokenizer, PROMPT, cache)
+
+    response = " Emma is handsome, clever, and rich.\n"
+    example = builder.training_example(BOOK, response, max_length=1000, character="Emma")
+    content = PROMPT.format(character="Emma", context=BOOK)
+    expected = chat_ids(tokenizer, [{"role": "user", "content": content}, {"role": "assistant", "content": response}],
+                        add_generation_prompt=False)
+    assert_same_ids(tokenizer, example["input_ids"], expected)
+    assert example["labels"][-1] == tokenizer.convert_tokens_to_ids("<|eot_id|>")
+
+    # the prompt and the assistant header are masked, only the response and the end of the turn are labelled
+    prompt = chat_ids(tokenizer, [{"role": "user", "content": content}])
+    assert example["labels"][:len(prompt)] == [-100] * len(prompt)
+    assert example["labels"][len(prompt):] == example["input_ids"][len(prompt):]
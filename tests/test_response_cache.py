@@ -0,0 +1,37 @@
+import pytest
+
+from src.utils.http_client import HttpClient
+from src.utils.response_cache import CacheMissError, ResponseCache
+
+
+def test_lookup_after_reopen_by_url_and_final_url(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.add("https://web.archive.org/web/2023/https://www.sparknotes.com/lit/emma/", b"<html>Emma</html>",
+              final_url="https://web.archive.org/web/20230101/https://www.sparknotes.com/lit/emma/",
+              headers={"Content-Type": "text/html; charset=utf-8"})
+    cache.close()
+
+    cache = ResponseCache(str(tmp_path), replay=True)
+    for url in ["https://web.archive.org/web/2023/https://www.sparknotes.com/lit/emma/",
+                "https://web.archive.org/web/20230101/https://www.sparknotes.com/lit/emma/"]:
+        response = cache.lookup(url)
+        assert response.status_code == 200
+        assert response.url == "https://web.archive.org/web/20230101/https://www.sparknotes.com/lit/emma/"
+        assert response.text == "<html>Emma</html>"
+    assert len(cache) == 1
+    cache.close()
+
+
+def test_replay_never_reaches_the_network(tmp_path):
+    cache = ResponseCache(str(tmp_path), replay=True)
+    cache.add("https://web.archive.org/page", b"cached")
+    client = HttpClient(requests_per_second=None, cache=cache)
+
+    def fail(url, **kwargs):
+        raise AssertionError(f"{url} was fetched")
+
+    client.session.get = fail
+    assert client.get("https://web.archive.org/page").content == b"cached"
+    with pytest.raises(CacheMissError):
+        client.get("https://web.archive.org/other")
+    cache.close()
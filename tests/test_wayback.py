@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from src.utils import http_client
+from src.utils.response_cache import CacheMissError, ResponseCache
+from src.utils.wayback import CDX_ENDPOINT, SnapshotResolver
+
+PREFIX = "www.sparknotes.com/lit/christmascarol"
+
+
+@pytest.fixture
+def replay_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path), replay=True)
+    http_client.set_client(http_client.HttpClient(cache=cache))
+    yield cache
+    http_client.set_client(None)
+    cache.close()
+
+
+def cdx_params(resolver):
+    return {"url": PREFIX + "/", "matchType": "prefix", "output": "json", "fl": "timestamp,original",
+            "filter": "statuscode:200", "to": str(resolver.max_date)}
+
+
+def test_replay_cdx_query_raises_cache_miss(replay_cache):
+    resolver = SnapshotResolver()
+    with pytest.raises(CacheMissError):
+        resolver.snapshots(PREFIX)
+
+
+def test_replay_cdx_query_is_served_from_cache(replay_cache):
+    resolver = SnapshotResolver()
+    rows = [["timestamp", "original"], ["20200101000000", f"https://{PREFIX}/characters/"]]
+    # the parameters are stored in another order than the resolver sends them
+    params = dict(reversed(list(cdx_params(resolver).items())))
+    replay_cache.add(http_client.cache_url(CDX_ENDPOINT, params), json.dumps(rows).encode())
+
+    table = resolver.snapshots(PREFIX)
+    assert [timestamps for timestamps in table.values()] == [[20200101000000]]